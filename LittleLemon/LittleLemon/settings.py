@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.instrumentation.ServerTimingMiddleware',  # first, so its total covers everything
+    'LittleLemonAPI.compression.CompressionMiddleware',  # before anything that reads or changes the body
+    'LittleLemonAPI.db.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,10 +82,55 @@ WSGI_APPLICATION = 'LittleLemon.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # LITTLELEMON_DB points the project at another file, e.g. a benchmark dataset
+        'NAME': os.environ.get('LITTLELEMON_DB', BASE_DIR / 'db.sqlite3'),
+        # Keep connections open between requests (set LITTLELEMON_CONN_MAX_AGE=0 under ASGI)
+        'CONN_MAX_AGE': int(os.environ.get('LITTLELEMON_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so a transaction that
+            # reads and then writes waits for busy_timeout instead of failing
+            # with "database is locked" when another writer got in first
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Test on a file rather than the in-memory default: threads sharing an
+        # in-memory database get "table is locked" straight away instead of
+        # waiting for busy_timeout, so ConcurrentCartTests (and the other
+        # tests that write from several threads) fail intermittently
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# LITTLELEMON_REPLICA_DB adds a read replica (another SQLite file, refreshed
+# with the sync_replica command) that the menu and order listings read from
+if os.environ.get('LITTLELEMON_REPLICA_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['LITTLELEMON_REPLICA_DB'],
+        # Its own test database: the tests sync it from the primary's like the real one
+        'TEST': {'NAME': BASE_DIR / 'test_replica.sqlite3'},
+    }
+
+DATABASE_ROUTERS = ['LittleLemonAPI.db.PrimaryReplicaRouter']
+REPLICA_DATABASE = 'replica'
+
+# Seconds a user's reads stay on the primary after they write, so they see their own changes
+REPLICA_PIN_SECONDS = 10
+
+# Applied to every new SQLite connection (see LittleLemonAPI.db.configure_sqlite)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',      # readers don't block the writer, and the writer doesn't block readers
+    'synchronous': 'NORMAL',    # safe with WAL; only the last transactions can be lost on power failure
+    'busy_timeout': 5000,       # wait up to 5 s for a lock instead of failing straight away
+    'mmap_size': 268435456,     # read through a 256 MiB memory map
+}
+
+# journal_mode is the one pragma stored in the database file rather than on the
+# connection, so it's left alone on these files: the checked-in sample database
+# stays as it is when a manage.py command opens it. Point LITTLELEMON_DB at a
+# copy to run it in WAL mode
+SQLITE_KEEP_JOURNAL_MODE = [BASE_DIR / 'db.sqlite3']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -126,20 +175,118 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'LittleLemonAPI.renderers.TimedJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'LittleLemonAPI.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 3, 
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',
-        'rest_framework.throttling.AnonRateThrottle',
+        'LittleLemonAPI.throttling.SharedUserRateThrottle',
+        'LittleLemonAPI.throttling.SharedAnonRateThrottle',
+        'LittleLemonAPI.throttling.SharedEndpointRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'user': '100/day',       # Authenticated users can make 100 requests per day
         'anon': '10/hour',       # Unauthenticated users can make 10 requests per hour
+        # Per-endpoint limits, keyed by '<url name>:<method>'
+        'manage_order:POST': '10/hour',     # checkout
+        'manage_cart:POST': '60/hour',
+        'manage_cart_bulk:POST': '60/hour',
+        # Order feeds, which don't count towards the 'user' rate (clients poll them in a loop)
+        'order_events:GET': '600/hour',
+        'async_order_events:GET': '600/hour',
+        'async_order_event_stream:GET': '60/hour',
+    }
+}
+
+# Cached tokens, roles, menu pages and replica pins are dropped by whichever
+# worker process sees the change, so every worker has to share the cache: a
+# directory on this host by default (like the throttle store), or Redis with
+# LITTLELEMON_REDIS_URL (needs the redis package). Keys include the database
+# name, so other databases never read the project's entries; the tests and
+# benchmarks also get a cache directory of their own (bench.private_cache), so
+# clearing theirs leaves a running server's cache alone
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('LITTLELEMON_CACHE_DIR', BASE_DIR / 'cache'),
+        'KEY_FUNCTION': 'LittleLemonAPI.db.cache_key',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+if os.environ.get('LITTLELEMON_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['LITTLELEMON_REDIS_URL'],
+        'KEY_FUNCTION': 'LittleLemonAPI.db.cache_key',
     }
-}
\ No newline at end of file
+
+# LITTLELEMON_THROTTLE=0 turns the rate limits off, for servers under a
+# benchmark (see manage.py bench_deployments); the management commands that
+# start their own server turn them off the same way
+if os.environ.get('LITTLELEMON_THROTTLE') == '0':
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] = {'user': None, 'anon': None}
+
+# Seconds a user's group names stay cached for role checks
+ROLE_CACHE_TIMEOUT = 300
+
+# Seconds a serialized menu page stays cached (entries are also dropped when the menu changes)
+MENU_CACHE_TIMEOUT = 600
+
+# Seconds a token -> user lookup stays cached (dropped early on logout or user changes)
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
+# SQLite file holding the rate limit counters, shared by all worker processes
+THROTTLE_STORE_PATH = BASE_DIR / 'throttle.sqlite3'
+
+# Longest a long-poll on the order feed waits for changes, and how long an
+# SSE stream stays open before the client reconnects (both in seconds)
+ORDER_EVENTS_TIMEOUT = 25
+ORDER_EVENTS_STREAM_SECONDS = 300
+
+# `manage.py archive_orders` moves delivered orders placed more than this many
+# days ago out of the order tables (see LittleLemonAPI.archive)
+ORDER_ARCHIVE_DAYS = 90
+
+# COMPRESSION_CONTENT_TYPES responses of at least COMPRESSION_MIN_SIZE bytes
+# are gzip/deflate compressed for clients that accept it (see
+# LittleLemonAPI.compression). Keep HTML out: its pages carry the CSRF token
+COMPRESSION_CONTENT_TYPES = ('application/json',)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+
+# Requests slower than this (in milliseconds) log their slowest SQL
+SLOW_REQUEST_MS = 500
+
+# Per-request timings go to the 'LittleLemonAPI.performance' logger: one INFO
+# line per request, and a WARNING with the SQL for slow requests
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'LittleLemonAPI.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('LITTLELEMON_PERFORMANCE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        # Background task retries and failures
+        'LittleLemonAPI.tasks': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Background tasks (manage.py run_tasks): a failed task is retried after
+# TASK_RETRY_BACKOFF seconds, doubling each time up to TASK_RETRY_BACKOFF_MAX;
+# finished tasks are deleted after TASK_RETENTION_DAYS
+TASK_RETRY_BACKOFF = 5
+TASK_RETRY_BACKOFF_MAX = 600
+TASK_RETENTION_DAYS = 7
@@ -0,0 +1,215 @@
+"""
+Async versions of the read-heavy endpoints, for ASGI deployments.
+
+DRF's @api_view is sync only, so these are plain Django async views. They
+authenticate, throttle and check roles the same way as the sync views, use
+the async ORM and cache APIs, and render with the same JSON renderer, so the
+responses are byte-for-byte the same as the sync endpoints'.
+"""
+import json
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .archive import order_model
+from .authentication import aauthenticate_token
+from .db import replica_reads
+from .events import alatest_event_id, await_events, parse_cursor, wait_timeout
+from .fast_serializers import menu_item_values
+from .menu_cache import MENU_CACHE_TIMEOUT, amenu_cache_entry, is_not_modified
+from .models import MenuItem
+from .pagination import MenuItemPagination, OrderPagination
+from .permissions import aget_roles
+from .renderers import TimedJSONRenderer
+from .snapshots import aorder_data, snapshot_rows
+from .throttling import SharedEndpointRateThrottle
+from .serializers import CustomerOrderSerializer, MenuItemSerializer, OrderSerializer, requested_fields
+from .views import filter_menu_items, filter_orders, menu_page, uses_page_numbers
+
+
+SSE_RETRY_MS = 3000  # how long a disconnected EventSource waits before reconnecting
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def render(data, status=200, headers=None):
+    body = TimedJSONRenderer().render(data) if data is not None else b''
+    return HttpResponse(body, status=status, headers=headers, content_type='application/json')
+
+
+def throttle_wait(request, throttle_classes):
+    """Seconds to wait according to the first throttle that refuses the request, or None."""
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            return throttle.wait()
+    return None
+
+
+def async_api_view(roles=None, throttle_classes=None):
+    """
+    Async counterpart of @api_view + @permission_classes for GET endpoints:
+    token authentication, throttling (DEFAULT_THROTTLE_CLASSES unless
+    throttle_classes is given) and an optional role check. The view gets a
+    DRF Request (for query_params), with .user and .roles set.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return render({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+
+            user = await aauthenticate_token(request)
+            if user is None:
+                return render(
+                    {'detail': 'Authentication credentials were not provided.'},
+                    status=401,
+                    headers={'WWW-Authenticate': 'Token'},
+                )
+            request.user = user
+
+            # The throttle store is a SQLite file that can wait up to its busy
+            # timeout for a writer, so it's kept off the event loop; its
+            # connections are per thread, so any thread will do
+            wait = await sync_to_async(throttle_wait, thread_sensitive=False)(
+                request, throttle_classes or api_settings.DEFAULT_THROTTLE_CLASSES,
+            )
+            if wait is not None:
+                return render(
+                    {'detail': f'Request was throttled. Expected available in {int(wait) + 1} seconds.'},
+                    status=429,
+                    headers={'Retry-After': str(int(wait) + 1)},
+                )
+
+            request = Request(request)
+            request.user = user
+            request.roles = await aget_roles(user)
+            if roles and not request.roles & roles:
+                return render({'error': 'Unauthorized'}, status=403)
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as error:  # e.g. an invalid cursor or filter
+                # The same body as DRF's exception handler: validation errors as they are
+                detail = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+                return render(detail, status=error.status_code)
+        return wrapper
+    return decorator
+
+
+@async_api_view()
+async def display_current_user(request):
+    return render({'username': request.user.username, 'email': request.user.email})
+
+
+@async_api_view(roles={'customer', 'delivery-crew', 'manager'})
+@replica_reads
+async def menu_items(request):
+    cache_key, etag = await amenu_cache_entry(request, 'list')
+    if is_not_modified(request, etag):
+        return render(None, status=304, headers={'ETag': etag})
+
+    data = await cache.aget(cache_key)
+    if data is None:
+        if uses_page_numbers(request.query_params):
+            # Page numbers go through Django's sync Paginator
+            data = await sync_to_async(menu_page)(request)
+        else:
+            menu_values = menu_item_values.only(requested_fields(request.query_params, MenuItemSerializer))
+            paginator = MenuItemPagination()
+            page = await paginator.apaginate_queryset(menu_values.values(filter_menu_items(request.query_params)), request)
+            data = paginator.get_paginated_data(menu_values.serialize(page))
+        await cache.aset(cache_key, data, MENU_CACHE_TIMEOUT)
+    return render(data, headers={'ETag': etag})
+
+
+@async_api_view(roles={'customer', 'delivery-crew', 'manager'})
+@replica_reads
+async def menu_item_detail(request, menuItem):
+    cache_key, etag = await amenu_cache_entry(request, 'detail', id=menuItem)
+    if is_not_modified(request, etag):
+        return render(None, status=304, headers={'ETag': etag})
+
+    data = await cache.aget(cache_key)
+    if data is None:
+        menu_values = menu_item_values.only(requested_fields(request.query_params, MenuItemSerializer))
+        menu_items = [row async for row in menu_values.values(MenuItem.objects.filter(id=menuItem))]
+        data = {'menu_items': menu_values.serialize(menu_items)}
+        await cache.aset(cache_key, data, MENU_CACHE_TIMEOUT)
+    return render(data, headers={'ETag': etag})
+
+
+@async_api_view(roles={'customer', 'delivery-crew', 'manager'})
+@replica_reads
+async def orders(request):
+    model = order_model(request.query_params)  # OrderHistory with ?archived=1
+    if 'manager' in request.roles:
+        orders, serializer_class = filter_orders(model.objects.all(), request.query_params), OrderSerializer
+    elif 'delivery-crew' in request.roles:
+        orders, serializer_class = model.objects.filter(delivery_crew=request.user), OrderSerializer
+    else:
+        orders, serializer_class = model.objects.filter(user=request.user), CustomerOrderSerializer
+
+    paginator = OrderPagination()
+    fields = requested_fields(request.query_params, serializer_class)
+    page = await paginator.apaginate_queryset(snapshot_rows(orders, fields), request)
+    return render(paginator.get_paginated_data(await aorder_data(page, serializer_class, fields)))
+
+
+@async_api_view(roles={'customer', 'delivery-crew', 'manager'}, throttle_classes=[SharedEndpointRateThrottle])
+async def order_events(request):
+    # Same long-poll as /api/orders/events/, but waiting doesn't hold a thread
+    try:
+        since = parse_cursor(request.query_params.get('since'))
+        timeout = wait_timeout(request.query_params.get('timeout'))
+    except ValueError as error:
+        return render({'error': str(error)}, status=400)
+    if since is None:
+        since = await alatest_event_id()
+
+    events = await await_events(request.user, request.roles, since, timeout)
+    return render({'events': events, 'cursor': events[-1]['id'] if events else since})
+
+
+@async_api_view(roles={'customer', 'delivery-crew', 'manager'}, throttle_classes=[SharedEndpointRateThrottle])
+async def order_event_stream(request):
+    """
+    Server-Sent Events: one `order` event per change, with the event id as the
+    SSE id so a reconnecting EventSource resumes from Last-Event-ID. The stream
+    ends after ORDER_EVENTS_STREAM_SECONDS and the client reconnects.
+    """
+    if not isinstance(request._request, ASGIRequest):
+        # A WSGI server would buffer the whole stream before sending any of it
+        return render({'error': 'The event stream needs the ASGI server; use /api/orders/events/'}, status=400)
+    try:
+        # EventSource sends Last-Event-ID when it reconnects
+        since = parse_cursor(request.headers.get('Last-Event-ID') or request.query_params.get('since'))
+    except ValueError as error:
+        return render({'error': str(error)}, status=400)
+    if since is None:
+        since = await alatest_event_id()
+    user, roles = request.user, request.roles
+
+    async def stream():
+        nonlocal since
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        deadline = time.monotonic() + getattr(settings, 'ORDER_EVENTS_STREAM_SECONDS', 300)
+        while time.monotonic() < deadline:
+            timeout = min(SSE_KEEPALIVE_SECONDS, deadline - time.monotonic())
+            events = await await_events(user, roles, since, timeout)
+            for event in events:
+                yield f'id: {event["id"]}\nevent: order\ndata: {json.dumps(event)}\n\n'
+            if events:
+                since = events[-1]['id']
+            else:
+                yield ': keepalive\n\n'  # a comment, so proxies don't close an idle connection
+
+    return StreamingHttpResponse(
+        stream(), content_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -0,0 +1,60 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .permissions import aget_roles, get_roles
+
+
+AUTH_TOKEN_CACHE_TIMEOUT = getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 300)
+
+
+def _token_cache_key(key):
+    # Hash the token so raw credentials never show up in the cache backend
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def cache_token(token):
+    """Stores the token with its user, and warms the user's roles as well."""
+    cache.set(_token_cache_key(token.key), token, AUTH_TOKEN_CACHE_TIMEOUT)
+    get_roles(token.user)
+
+
+async def aauthenticate_token(request):
+    """
+    Token authentication for async views (plain Django views, which DRF's
+    authentication classes don't support). Returns the user, or None.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+
+    key = _token_cache_key(auth[1])
+    token = await cache.aget(key)
+    if token is None:
+        token = await Token.objects.select_related('user').filter(key=auth[1]).afirst()
+        if token is None or not token.user.is_active:
+            return None
+        await cache.aset(key, token, AUTH_TOKEN_CACHE_TIMEOUT)
+        await aget_roles(token.user)
+    return token.user
+
+
+def invalidate_tokens(*keys):
+    cache.delete_many([_token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that keeps the token -> user lookup in the cache, so
+    authenticated requests don't need the Token + User join every time.
+    Entries are dropped when the token is deleted or the user is saved.
+    """
+    def authenticate_credentials(self, key):
+        token = cache.get(_token_cache_key(key))
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            cache_token(token)
+        return (token.user, token)
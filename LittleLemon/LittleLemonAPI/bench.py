@@ -0,0 +1,234 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.servers.basehttp import ThreadedWSGIServer, get_internal_wsgi_application
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.testcases import QuietWSGIRequestHandler
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Category, MenuItem, Order, OrderItem
+
+
+WORDS = [
+    'lemon', 'grilled', 'chicken', 'salad', 'greek', 'bruschetta', 'tomato', 'basil', 'olive', 'feta',
+    'lamb', 'souvlaki', 'pita', 'hummus', 'falafel', 'spinach', 'pie', 'baklava', 'honey', 'walnut',
+    'orange', 'mint', 'lentil', 'soup', 'roasted', 'garlic', 'shrimp', 'octopus', 'rice', 'yogurt',
+]
+CATEGORIES = ['Starters', 'Mains', 'Salads', 'Desserts', 'Drinks', 'Sides', 'Specials', 'Kids']
+
+
+@contextmanager
+def private_cache():
+    """
+    Points the default cache at an empty directory of its own for the block,
+    and yields its path. Clearing the shared cache would drop the entries of
+    every server using it; this one can be cleared freely.
+    """
+    location = tempfile.mkdtemp(prefix='littlelemon-cache-')
+    try:
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+            'KEY_FUNCTION': settings.CACHES['default'].get('KEY_FUNCTION'),
+        }}):
+            yield location
+    finally:
+        shutil.rmtree(location, ignore_errors=True)
+
+
+@contextmanager
+def temporary_database(verbosity=0):
+    """
+    Runs the block against a fresh, migrated test database (the same kind the
+    test runner uses) and a private cache, so benchmarks never touch the real
+    data or a running server's cached entries.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        with private_cache():
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+class LocalServer(ThreadedWSGIServer):
+    # socketserver only queues 5 connections; clients beyond that wait for a
+    # SYN retry (a second or more), which would show up as request latency
+    request_queue_size = 128
+
+
+@contextmanager
+def local_server(host='127.0.0.1'):
+    """
+    Serves the project from a threaded WSGI server (a thread and a database
+    connection per request, like runserver) in the background, and yields its
+    base URL.
+    """
+    server = LocalServer((host, 0), QuietWSGIRequestHandler)
+    server.set_app(get_internal_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://{host}:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def seed_menu(count, categories=CATEGORIES, batch_size=5000, seed=0):
+    """Creates the categories and `count` menu items with random dish names."""
+    rng = random.Random(seed)
+    category_ids = [
+        Category.objects.create(slug=slugify(title), title=title).id
+        for title in categories
+    ]
+    for start in range(0, count, batch_size):
+        MenuItem.objects.bulk_create([
+            MenuItem(
+                title=' '.join(rng.sample(WORDS, 3)).title(),
+                price=Decimal(rng.randint(100, 5000)) / 100,
+                featured=rng.random() < 0.1,
+                category_id=rng.choice(category_ids),
+            )
+            for _ in range(min(batch_size, count - start))
+        ])
+    return category_ids
+
+
+def seed_users(count, password='bench1234', manager_share=0.01, crew_share=0.05, batch_size=5000):
+    """
+    Creates `count` users (bench-0, bench-1, ...) split across the manager,
+    delivery-crew and customer groups. Returns {group name: [user ids]}.
+    """
+    hashed = make_password(password)  # hashing is slow, so every user shares one hash
+    groups = {name: Group.objects.get_or_create(name=name)[0] for name in ('manager', 'delivery-crew', 'customer')}
+    managers = max(1, int(count * manager_share))
+    crew = max(1, int(count * crew_share))
+
+    members = {name: [] for name in groups}
+    for start in range(0, count, batch_size):
+        users = User.objects.bulk_create([
+            User(username=f'bench-{i}', email=f'bench-{i}@example.com', password=hashed)
+            for i in range(start, min(start + batch_size, count))
+        ])
+        for user in users:
+            index = int(user.username.split('-')[1])
+            name = 'manager' if index < managers else 'delivery-crew' if index < managers + crew else 'customer'
+            members[name].append(user.id)
+
+    Membership = User.groups.through
+    Membership.objects.bulk_create(
+        [Membership(user_id=user_id, group_id=groups[name].id) for name, ids in members.items() for user_id in ids],
+        batch_size=batch_size,
+    )
+    return members
+
+
+def seed_orders(count, customer_ids, crew_ids, days=365, max_items=4, batch_size=5000, seed=0):
+    """
+    Creates `count` orders with 1..max_items items each, spread over the last
+    `days` days. Most are assigned to a delivery crew, and all but the most
+    recent are delivered.
+    """
+    rng = random.Random(seed)
+    prices = list(MenuItem.objects.values_list('id', 'price'))
+    if len(prices) < max_items:
+        raise ValueError(f'Orders need at least {max_items} menu items to pick from.')
+    now = timezone.now()
+    for start in range(0, count, batch_size):
+        orders, order_items = [], []
+        for _ in range(min(batch_size, count - start)):
+            age = timedelta(seconds=rng.uniform(0, days * 86400))
+            items = [
+                (menuitem_id, price, rng.randint(1, 3))
+                for menuitem_id, price in rng.sample(prices, rng.randint(1, max_items))
+            ]
+            crew_id = rng.choice(crew_ids) if rng.random() < 0.9 else None
+            orders.append(Order(
+                user_id=rng.choice(customer_ids),
+                delivery_crew_id=crew_id,
+                status=crew_id is not None and age > timedelta(days=1),
+                total=sum(price * quantity for _, price, quantity in items),
+                date=now - age,
+            ))
+            order_items.append(items)
+
+        with transaction.atomic():
+            Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem_id=menuitem_id, quantity=quantity, unit_price=price, price=price * quantity)
+                for order, items in zip(orders, order_items)
+                for menuitem_id, price, quantity in items
+            ], batch_size=batch_size)
+
+
+def measure(function, runs):
+    """Calls `function` `runs` times and returns the timings in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def summarize(timings):
+    return {
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+    }
+
+
+def http_load(urls, requests, concurrency, headers=None):
+    """
+    Sends `requests` GETs, cycling through `urls`, from `concurrency` threads.
+    Returns the requests per second, the latencies in milliseconds and a
+    Counter of the response statuses (None for requests that got no response).
+    """
+    def fetch(i):
+        request = urllib.request.Request(urls[i % len(urls)], headers=headers or {})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except OSError:  # refused, reset or timed out
+            status = None
+        return (time.perf_counter() - start) * 1000, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, [timing for timing, _ in results], Counter(status for _, status in results)
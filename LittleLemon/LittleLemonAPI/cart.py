@@ -0,0 +1,119 @@
+"""
+Cart writes that are safe under concurrent requests. Quantities are added in
+SQL (UPDATE ... SET quantity = quantity + n, or INSERT ... ON CONFLICT DO
+UPDATE), so two taps on the same item never lose an increment or trip the
+(user, menuitem) unique constraint. Adds that would take a row past what its
+columns hold (a SmallIntegerField quantity, a 6 digit price) raise
+CartLimitError instead of storing a row that can't be read back.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.lookups import LessThanOrEqual
+
+from .models import Cart, MenuItem
+
+
+def _max_price(field):
+    return Decimal(10) ** (field.max_digits - field.decimal_places) - Decimal(10) ** -field.decimal_places
+
+
+# SQLite stores any 64 bit integer, but quantity is a SmallIntegerField elsewhere
+MAX_QUANTITY = 32767
+MAX_PRICE = _max_price(Cart._meta.get_field('price'))
+
+
+class CartLimitError(Exception):
+    """Adding to the cart would take these menu items past MAX_QUANTITY or MAX_PRICE."""
+    def __init__(self, menu_items):
+        super().__init__(f'A cart line holds at most {MAX_QUANTITY} items and {MAX_PRICE} in price.')
+        self.menu_items = menu_items
+
+
+def within_limits(quantity, unit_price):
+    return quantity <= MAX_QUANTITY and quantity * unit_price <= MAX_PRICE
+
+
+def increment_cart_item(user, menuitem_id, quantity=1):
+    """
+    Adds `quantity` to an item already in the cart. Returns False if it isn't
+    there, or if the new quantity or price would be over the limits.
+    """
+    return bool(Cart.objects.filter(
+        LessThanOrEqual(F('quantity') + quantity, MAX_QUANTITY),
+        LessThanOrEqual((F('quantity') + quantity) * F('unit_price'), MAX_PRICE),
+        user=user, menuitem_id=menuitem_id,
+    ).update(
+        # Right-hand sides see the row as it was before the update
+        quantity=F('quantity') + quantity,
+        price=(F('quantity') + quantity) * F('unit_price'),
+    ))
+
+
+def add_cart_item(serializer, user):
+    """
+    Saves a validated CartSerializer as a new cart row. If another request
+    inserted the same item in the meantime, adds one to that row instead,
+    the same as if this request had come second. Returns whether a row was
+    created; raises CartLimitError if the existing row can't take one more.
+    """
+    try:
+        with transaction.atomic():
+            serializer.save(user=user)
+        return True
+    except IntegrityError:
+        menuitem_id = serializer.validated_data['menuitem'].id
+        if not increment_cart_item(user, menuitem_id):
+            raise CartLimitError([menuitem_id])
+        return False
+
+
+def add_cart_items(user, entries):
+    """
+    Adds many (menuitem_id, quantity) entries to the cart: one query for the
+    prices, one for the rows already in the cart, one INSERT ... ON CONFLICT DO
+    UPDATE for the rows. Items already in the cart keep their unit price.
+    Returns the ids that aren't on the menu (and writes nothing) if there are
+    any, and raises CartLimitError (writing nothing) if the totals would be
+    over the limits.
+    """
+    quantities = Counter()
+    for menuitem_id, quantity in entries:
+        quantities[menuitem_id] += quantity
+
+    prices = dict(MenuItem.objects.filter(id__in=quantities).values_list('id', 'price'))
+    missing = sorted(set(quantities) - set(prices))
+    if missing or not quantities:
+        return missing
+
+    qn = connection.ops.quote_name
+    table = qn(Cart._meta.db_table)
+    columns = [qn(Cart._meta.get_field(name).column) for name in ('user', 'menuitem', 'quantity', 'unit_price', 'price')]
+    user_id, menuitem_id, quantity, unit_price, price = columns
+
+    params = []
+    for item_id, count in quantities.items():
+        params += [user.id, item_id, count, str(prices[item_id]), str(prices[item_id] * count)]
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s)'] * len(quantities))
+    # The transaction holds the write lock from the start (transaction_mode
+    # IMMEDIATE), so the rows can't change between the check and the upsert
+    with transaction.atomic():
+        in_cart = Cart.objects.filter(user=user, menuitem_id__in=quantities).values_list('menuitem_id', 'quantity', 'unit_price')
+        totals = {item_id: (count, prices[item_id]) for item_id, count in quantities.items()}
+        for item_id, count, item_price in in_cart:
+            totals[item_id] = (count + quantities[item_id], item_price)
+        over = sorted(item_id for item_id, (count, item_price) in totals.items() if not within_limits(count, item_price))
+        if over:
+            raise CartLimitError(over)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {placeholders} '
+                f'ON CONFLICT ({user_id}, {menuitem_id}) DO UPDATE SET '
+                f'{quantity} = {table}.{quantity} + excluded.{quantity}, '
+                f'{price} = ({table}.{quantity} + excluded.{quantity}) * {table}.{unit_price}',
+                params,
+            )
+    return []
@@ -0,0 +1,103 @@
+"""
+Response compression, negotiated from Accept-Encoding. Django's
+GZipMiddleware only speaks gzip and compresses anything over 200 bytes;
+this one also offers deflate, honours q-values, and leaves bodies under
+COMPRESSION_MIN_SIZE alone, where the headers cost more than they save.
+
+Only COMPRESSION_CONTENT_TYPES (JSON) are compressed. HTML pages such as
+the admin's and the browsable API's carry the CSRF token next to text an
+attacker can reflect into them, and compressing those gives the token away
+one length at a time (BREACH).
+
+Streaming responses (order exports, the SSE feed) are passed through: they
+are sent as they are produced, and buffering them to compress would undo
+that.
+"""
+import gzip
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+
+# In order of preference when the client rates them the same
+ENCODINGS = {
+    'gzip': lambda body, level: gzip.compress(body, compresslevel=level, mtime=0),
+    'deflate': lambda body, level: zlib.compress(body, level),  # HTTP "deflate" is the zlib format
+}
+
+
+def accepted_encoding(accept_encoding):
+    """The encoding to use for an Accept-Encoding header, or None for identity."""
+    qualities = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        qualities[name] = quality
+
+    best, best_quality = None, 0.0
+    for name in ENCODINGS:
+        quality = qualities.get(name, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compresses COMPRESSION_CONTENT_TYPES response bodies of at least
+    COMPRESSION_MIN_SIZE bytes with gzip or deflate, whichever the client
+    prefers, at COMPRESSION_LEVEL.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').partition(';')[0].strip().lower()
+        if content_type not in getattr(settings, 'COMPRESSION_CONTENT_TYPES', ('application/json',)):
+            return response
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        # Caches must keep the encodings apart, whichever one this client gets
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        compressed = ENCODINGS[encoding](response.content, getattr(settings, 'COMPRESSION_LEVEL', 6))
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The bytes differ from the uncompressed response, so a strong ETag
+        # would be wrong; a weak one still matches If-None-Match
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,164 @@
+"""
+Database connection tuning and read-replica routing.
+
+Every new SQLite connection gets the SQLITE_PRAGMAS from settings (WAL, a
+busy timeout, ...), applied by the connection_created receiver below,
+except for journal_mode on the SQLITE_KEEP_JOURNAL_MODE files.
+
+Views decorated with @replica_reads read from the REPLICA_DATABASE alias
+for GET and HEAD requests, when that alias is configured. Everything else
+uses the primary: writes, reads inside a transaction, reads made after the
+view has written, and requests from a user who wrote something in the
+last REPLICA_PIN_SECONDS (so they always see their own changes).
+
+cache_key() is the CACHES KEY_FUNCTION: it puts the primary database's name
+into every cache key, so databases sharing the cache keep separate entries.
+"""
+import hashlib
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def configure_sqlite(connection, **kwargs):
+    """connection_created receiver: applies settings.SQLITE_PRAGMAS to new SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    keep_journal_mode = {str(path) for path in getattr(settings, 'SQLITE_KEEP_JOURNAL_MODE', [])}
+    if str(connection.settings_dict['NAME']) in keep_journal_mode:
+        pragmas.pop('journal_mode', None)  # persistent: it would rewrite the file's header
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@lru_cache(maxsize=None)
+def _database_prefix(name):
+    return hashlib.sha256(str(name).encode()).hexdigest()[:12]
+
+
+def cache_key(key, key_prefix, version):
+    """Django's default cache key, prefixed with (a hash of) the primary database's name."""
+    return f'{_database_prefix(connections[DEFAULT_DB_ALIAS].settings_dict["NAME"])}:{key_prefix}:{version}:{key}'
+
+
+def replica_alias():
+    """The configured replica alias, or None when there isn't one."""
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """Sends the user's reads to the primary for REPLICA_PIN_SECONDS, until the replica has caught up."""
+    cache.set(_pin_key(user.pk), True, getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+
+
+async def apin_to_primary(user):
+    """pin_to_primary() for async code."""
+    await cache.aset(_pin_key(user.pk), True, getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+
+
+def _read_from(request, pinned):
+    if request.method not in SAFE_METHODS or pinned:
+        return None
+    return replica_alias()
+
+
+def replica_reads(view):
+    """
+    Reads made by the view on a GET go to the replica. Put it under @api_view
+    (or @async_api_view) so the user is known when it runs.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            user = request.user
+            pinned = user.is_authenticated and await cache.aget(_pin_key(user.pk))
+            token = _read_alias.set(_read_from(request, pinned))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user = request.user
+        pinned = user.is_authenticated and cache.get(_pin_key(user.pk))
+        token = _read_alias.set(_read_from(request, pinned))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Routes reads to the replica inside @replica_reads views, and everything else to the primary."""
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Read-after-write: once the view writes, its reads stay on the primary
+        if _read_alias.get() is not None:
+            _read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so objects from either can be related
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return True
+
+
+class ReplicaPinMiddleware:
+    """
+    After a successful write (POST, PUT, PATCH, DELETE), pins the user's reads
+    to the primary for a while; see pin_to_primary().
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            pin_to_primary(request.user)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            await apin_to_primary(request.user)
+        return response
+
+    def wrote(self, request, response):
+        user = getattr(request, 'user', None)
+        return (
+            replica_alias() is not None and request.method not in SAFE_METHODS
+            and response.status_code < 400 and user is not None and user.is_authenticated
+        )
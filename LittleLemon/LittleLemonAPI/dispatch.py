@@ -0,0 +1,122 @@
+"""
+Bulk order updates for dispatchers and delivery crew. Each call reads the
+orders once, applies the change with a single UPDATE ... WHERE id IN (...),
+queues one task to move the delivery crew rollups and adds the order feed
+events with one INSERT, all in one transaction. The order snapshots are
+updated in SQL by the same UPDATE.
+"""
+import heapq
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, Count, Value, When
+
+from .events import publish
+from .models import Order, OrderEvent
+from .reports import enqueue_rollups, order_day
+from .serializers import MAX_BULK_ORDERS
+from .snapshots import snapshot_update
+
+
+def _lock_orders(queryset):
+    # On SQLite the IMMEDIATE transaction already holds the write lock
+    return {
+        order['id']: order
+        for order in queryset.select_for_update().values('id', 'date', 'user_id', 'delivery_crew_id', 'status')
+    }
+
+
+def _record(kind, orders, new_crew_ids, new_status=None):
+    # Queues the delivery crew rollup changes and adds an event per order to the order feed
+    changes, events = [], []
+    for order in orders.values():
+        crew_id = new_crew_ids[order['id']]
+        status = order['status'] if new_status is None else new_status
+        changes.append((order_day(order['date']), order['delivery_crew_id'], order['status'], crew_id, status))
+        events.append(OrderEvent(
+            order_id=order['id'], kind=kind, user_id=order['user_id'], delivery_crew_id=crew_id,
+            previous_crew_id=order['delivery_crew_id'] if kind == OrderEvent.ASSIGNED else None, status=status,
+        ))
+    enqueue_rollups(crew_changes=changes)
+    publish(*events)
+
+
+def assign_orders(order_ids, crew_id):
+    """
+    Assigns the orders to one delivery crew member. Returns the ids that
+    don't exist (and changes nothing) if there are any.
+    """
+    with transaction.atomic():
+        orders = _lock_orders(Order.objects.filter(id__in=order_ids))
+        missing = sorted(set(order_ids) - set(orders))
+        if missing:
+            return missing
+        Order.objects.filter(id__in=orders).update(delivery_crew_id=crew_id, snapshot=snapshot_update(delivery_crew=crew_id))
+        _record(OrderEvent.ASSIGNED, orders, dict.fromkeys(orders, crew_id))
+    return []
+
+
+def set_orders_status(order_ids, status, delivery_crew=None):
+    """
+    Marks the orders delivered (or not). With `delivery_crew`, only that crew
+    member's orders can be changed. Returns the ids that can't be updated (and
+    changes nothing) if there are any.
+    """
+    orders = Order.objects.filter(id__in=order_ids)
+    if delivery_crew is not None:
+        orders = orders.filter(delivery_crew=delivery_crew)
+    with transaction.atomic():
+        orders = _lock_orders(orders)
+        missing = sorted(set(order_ids) - set(orders))
+        if missing:
+            return missing
+        Order.objects.filter(id__in=orders).update(status=status, snapshot=snapshot_update(status=status))
+        _record(OrderEvent.STATUS, orders, {order_id: order['delivery_crew_id'] for order_id, order in orders.items()}, status)
+    return []
+
+
+def crew_load():
+    """{crew member id: undelivered orders assigned to them}, for everyone in the delivery-crew group."""
+    load = dict.fromkeys(User.objects.filter(groups__name='delivery-crew').values_list('id', flat=True), 0)
+    # One aggregate over the open orders (a few, through the status index),
+    # rather than joining every order each crew member ever had
+    load.update(
+        Order.objects.filter(status__in=[False], delivery_crew__in=list(load))
+        .values('delivery_crew').annotate(open_orders=Count('id')).order_by()
+        .values_list('delivery_crew', 'open_orders')
+    )
+    return load
+
+
+def auto_dispatch(order_ids=None, limit=MAX_BULK_ORDERS):
+    """
+    Spreads unassigned, undelivered orders (the given ids, or the oldest
+    `limit`) across the delivery crew, each to whoever has the fewest open
+    orders at that point. Returns {crew member id: [order ids]}; orders that
+    are already assigned are skipped.
+    """
+    with transaction.atomic():
+        load = crew_load()
+        if not load:
+            return {}
+        queryset = Order.objects.filter(delivery_crew__isnull=True, status__in=[False]).order_by('date', 'id')
+        if order_ids is not None:
+            queryset = queryset.filter(id__in=order_ids)
+        orders = _lock_orders(queryset[:limit])
+        if not orders:
+            return {}
+
+        # Least loaded crew member first; ties go to the lowest id
+        heap = [(open_orders, crew_id) for crew_id, open_orders in load.items()]
+        heapq.heapify(heap)
+        assignments = {}
+        for order_id in orders:
+            open_orders, crew_id = heapq.heappop(heap)
+            assignments.setdefault(crew_id, []).append(order_id)
+            heapq.heappush(heap, (open_orders + 1, crew_id))
+
+        # One UPDATE for every crew member's orders
+        crew = Case(*[When(id__in=ids, then=Value(crew_id)) for crew_id, ids in assignments.items()])
+        Order.objects.filter(id__in=orders).update(delivery_crew_id=crew, snapshot=snapshot_update(delivery_crew=crew))
+        _record(OrderEvent.ASSIGNED, orders, {order_id: crew_id for crew_id, ids in assignments.items() for order_id in ids})
+    return assignments
@@ -0,0 +1,109 @@
+"""
+The order change feed. Checkout and the order update endpoints add an
+OrderEvent in the same transaction as the change, and clients ask for the
+events after a cursor (the id of the last event they saw), by long-polling
+or over Server-Sent Events, instead of reloading their order listings.
+
+Waiting clients check the newest event id, a single b-tree lookup, every
+POLL_INTERVAL seconds and only query their own events once it moves past
+what they have already looked at.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.db.models import Max, Q
+
+from .fast_serializers import order_event_values
+from .models import OrderEvent
+
+
+POLL_INTERVAL = 0.5
+MAX_EVENTS = 100  # per response; clients come back with the new cursor for the rest
+
+
+def order_event(kind, order, previous_crew_id=None):
+    """An unsaved OrderEvent for `order` as it is now."""
+    return OrderEvent(
+        order_id=order.id, kind=kind, user_id=order.user_id, delivery_crew_id=order.delivery_crew_id,
+        previous_crew_id=previous_crew_id, status=order.status,
+    )
+
+
+def publish(*events):
+    """Saves the events. Call it inside the transaction making the change."""
+    OrderEvent.objects.bulk_create(events)
+
+
+def visible_events(user, roles):
+    """The events a user may see: every order for managers, otherwise their own and their deliveries."""
+    if 'manager' in roles:
+        return OrderEvent.objects.all()
+    visible = Q(user=user)
+    if 'delivery-crew' in roles:
+        visible |= Q(delivery_crew=user) | Q(previous_crew=user)
+    return OrderEvent.objects.filter(visible)
+
+
+def _events_after(user, roles, since):
+    return order_event_values.values(visible_events(user, roles).filter(id__gt=since).order_by('id')[:MAX_EVENTS])
+
+
+def latest_event_id():
+    return OrderEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+async def alatest_event_id():
+    return (await OrderEvent.objects.aaggregate(latest=Max('id')))['latest'] or 0
+
+
+def parse_cursor(since):
+    """The `since` query param (or Last-Event-ID header) as an event id; None if it wasn't given."""
+    if since is None:
+        return None
+    if not since.isdecimal():
+        raise ValueError('since must be an event id')
+    return int(since)
+
+
+def wait_timeout(requested):
+    """The long-poll timeout in seconds: `requested` (a query param), capped by ORDER_EVENTS_TIMEOUT."""
+    limit = getattr(settings, 'ORDER_EVENTS_TIMEOUT', 25)
+    if requested is None:
+        return limit
+    try:
+        return max(0.0, min(float(requested), limit))
+    except ValueError:
+        raise ValueError('timeout must be a number of seconds') from None
+
+
+def wait_for_events(user, roles, since, timeout):
+    """Returns the user's events after `since`, waiting up to `timeout` seconds for some to arrive."""
+    deadline = time.monotonic() + timeout
+    checked = since
+    while True:
+        latest = latest_event_id()
+        if latest > checked:
+            events = order_event_values.serialize(_events_after(user, roles, since))
+            if events:
+                return events
+            checked = latest  # only other users' events so far
+        if time.monotonic() >= deadline:
+            return []
+        time.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+
+async def await_events(user, roles, since, timeout):
+    """wait_for_events() for async views, sleeping without holding a thread."""
+    deadline = time.monotonic() + timeout
+    checked = since
+    while True:
+        latest = await alatest_event_id()
+        if latest > checked:
+            events = order_event_values.serialize([row async for row in _events_after(user, roles, since)])
+            if events:
+                return events
+            checked = latest
+        if time.monotonic() >= deadline:
+            return []
+        await asyncio.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
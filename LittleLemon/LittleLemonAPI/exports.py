@@ -0,0 +1,67 @@
+import csv
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import OrderHistory
+from .serializers import OrderSerializer
+from .snapshots import order_data, snapshot_rows
+
+
+EXPORT_CHUNK_SIZE = 500
+
+CSV_HEADER = ['order_id', 'user', 'date', 'total', 'menuitem', 'quantity', 'unit_price', 'price']
+
+
+class Echo:
+    """File-like object that hands back what csv.writer writes, instead of buffering it."""
+    def write(self, value):
+        return value
+
+
+def iter_orders(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields serialized orders one by one. Orders are read in chunks, with the
+    items of each chunk prefetched together, so memory use doesn't depend on
+    how many orders are exported.
+    """
+    if orders.model is OrderHistory:
+        yield from iter_order_history(orders, chunk_size)
+        return
+    serializer = OrderSerializer()
+    for order in OrderSerializer.setup_eager_loading(orders).iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(order)
+
+
+def iter_order_history(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    iter_orders() for OrderHistory (?archived=1), which has no items to
+    prefetch: the orders are read from their snapshots, a chunk of ids at a time.
+    """
+    last_id = 0
+    while rows := list(snapshot_rows(orders.filter(id__gt=last_id).order_by('id'))[:chunk_size]):
+        yield from order_data(rows, OrderSerializer)
+        last_id = rows[-1]['id']
+
+
+def ndjson_rows(orders):
+    encoder = JSONEncoder()
+    for order in iter_orders(orders):
+        yield encoder.encode(order) + '\n'
+
+
+def csv_rows(orders):
+    # One line per order item, the order columns are repeated on each line
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in iter_orders(orders):
+        for item in order['items']:
+            yield writer.writerow([
+                order['order_id'], order['user'], order['date'].isoformat(), order['total'],
+                item['menuitem'], item['quantity'], item['unit_price'], item['price'],
+            ])
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_rows),
+    'csv': ('text/csv', csv_rows),
+}
@@ -0,0 +1,134 @@
+"""
+A read-only fast path for listing endpoints. ValuesSerializer looks at a
+ModelSerializer once, works out which .values() lookups its readable fields
+need (following nested serializers through their source), and then turns
+each row dict straight into the same output the serializer would produce,
+without building model instances or DRF field machinery per row.
+"""
+import time
+
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .instrumentation import current_metrics
+from .serializers import CartSerializer, MenuItemSerializer, OrderEventSerializer
+
+
+# Fields whose to_representation() returns database values unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.ReadOnlyField,
+)
+
+
+def _decimal(field):
+    """
+    DecimalField.to_representation() rounds to decimal_places and formats the
+    result. Model decimals come back from the database already rounded to the
+    column's places, so those only need formatting; anything else goes
+    through DRF.
+    """
+    if field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+    exponent = -field.decimal_places
+
+    def convert(value):
+        # COERCE_DECIMAL_TO_STRING is read per call, like DRF does
+        if value.as_tuple().exponent == exponent and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+            return f'{value:f}'
+        return field.to_representation(value)
+    return convert
+
+
+def _compile(serializer, prefix):
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*' or isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+            raise TypeError(f'{type(serializer).__name__}.{name} has no flat .values() equivalent')
+
+        lookup = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            if field.Meta.model._meta.pk.name not in field.fields:
+                raise TypeError(f'{type(serializer).__name__}.{name} must include the primary key')
+            plan.append((name, lookup + '__' + field.Meta.model._meta.pk.name, _compile(field, lookup + '__')))
+        elif isinstance(field, PASSTHROUGH_FIELDS) and not isinstance(field, serializers.DecimalField):
+            plan.append((name, lookup, None))
+        elif isinstance(field, serializers.DecimalField):
+            plan.append((name, lookup, _decimal(field)))
+        elif isinstance(field, (serializers.ChoiceField, serializers.DateTimeField, serializers.DateField)):
+            plan.append((name, lookup, field.to_representation))
+        else:
+            raise TypeError(f'{type(serializer).__name__}.{name} ({type(field).__name__}) is not supported')
+    return plan
+
+
+def _lookups(plan):
+    for _, lookup, convert in plan:
+        if isinstance(convert, list):
+            yield from _lookups(convert)
+        else:
+            yield lookup
+
+
+def _build(plan, row):
+    data = {}
+    for name, lookup, convert in plan:
+        value = row[lookup]
+        if value is None:
+            # A missing related object, or a null value, is None either way
+            data[name] = None
+        elif convert is None:
+            data[name] = value
+        elif isinstance(convert, list):
+            data[name] = _build(convert, row)
+        else:
+            data[name] = convert(value)
+    return data
+
+
+class ValuesSerializer:
+    """
+    ValuesSerializer(MenuItemSerializer).values(queryset) gives a .values()
+    queryset with every column the serializer reads; .serialize(rows) turns
+    those rows into the serializer's output, key order included.
+    .only(fields) gives one for a subset of the fields, which reads only
+    their columns (and skips the joins of nested serializers left out).
+    """
+    def __init__(self, serializer_class, fields=None):
+        self.serializer_class = serializer_class
+        self.plan = _compile(serializer_class() if fields is None else serializer_class(fields=fields), '')
+        # The primary key is always read, so cursor paginators can find their place
+        pk = serializer_class.Meta.model._meta.pk.name
+        self.lookups = list(dict.fromkeys([pk, *_lookups(self.plan)]))
+        self._subsets = {}
+
+    def only(self, fields):
+        """The ValuesSerializer for requested_fields() `fields`; this one when that's None."""
+        if fields is None:
+            return self
+        subset = self._subsets.get(fields)
+        if subset is None:
+            # Compiled once per distinct field set, which requested_fields() limits to real names
+            subset = self._subsets[fields] = ValuesSerializer(self.serializer_class, fields)
+        return subset
+
+    def values(self, queryset):
+        return queryset.values(*self.lookups)
+
+    def serialize(self, rows):
+        metrics = current_metrics()
+        start = time.perf_counter()
+        data = [_build(self.plan, row) for row in rows]
+        if metrics is not None:
+            metrics.serializer += time.perf_counter() - start
+        return data
+
+
+# Compiled once at import; used by the menu, cart and order event GET endpoints
+menu_item_values = ValuesSerializer(MenuItemSerializer)
+cart_values = ValuesSerializer(CartSerializer)
+order_event_values = ValuesSerializer(OrderEventSerializer)
@@ -0,0 +1,152 @@
+"""
+Per-request timings: query count and DB time, time spent waiting for the
+SQLite write lock, serializer time and renderer time. They are sent back in
+a Server-Timing header and logged to the 'LittleLemonAPI.performance' logger,
+and requests slower than SLOW_REQUEST_MS also log their slowest SQL.
+
+Everything is collected in a RequestMetrics object held in a context
+variable, so the sync_to_async threads used by async views report into the
+same request. Outside a request the hooks do nothing but one lookup.
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+logger = logging.getLogger('LittleLemonAPI.performance')
+
+SLOW_REQUEST_QUERIES_LOGGED = 10
+MAX_RECORDED_QUERIES = 200  # keeps memory bounded on requests that run thousands of statements
+
+_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('start', 'queries', 'db', 'lock', 'serializer', 'render', 'statements', 'serializing')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = self.lock = self.serializer = self.render = 0.0
+        self.statements = []  # (seconds, sql), up to MAX_RECORDED_QUERIES
+        self.serializing = False
+
+    def summary(self):
+        return {
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 2),
+            'db_ms': round(self.db * 1000, 2),
+            'queries': self.queries,
+            'lock_ms': round(self.lock * 1000, 2),
+            'serializer_ms': round(self.serializer * 1000, 2),
+            'render_ms': round(self.render * 1000, 2),
+        }
+
+
+def current_metrics():
+    return _metrics.get()
+
+
+def time_queries(execute, sql, params, many, context):
+    """Execute wrapper (see connection.execute_wrapper) counting and timing every statement."""
+    metrics = _metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.queries += 1
+        metrics.db += elapsed
+        if sql.startswith('BEGIN'):
+            # BEGIN IMMEDIATE takes the write lock, waiting up to busy_timeout for
+            # other writers to finish: its duration is the time spent queueing
+            metrics.lock += elapsed
+        if len(metrics.statements) < MAX_RECORDED_QUERIES:
+            metrics.statements.append((elapsed, sql))
+
+
+def install_query_timer(connection, **kwargs):
+    """connection_created receiver: times every query made on the connection."""
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
+
+class TimedSerializerMixin:
+    """Adds the time spent in to_representation() to the request's serializer time."""
+    def to_representation(self, instance):
+        metrics = _metrics.get()
+        if metrics is None or metrics.serializing:  # nested serializers are counted by their parent
+            return super().to_representation(instance)
+        metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer += time.perf_counter() - start
+            metrics.serializing = False
+
+
+def server_timing(summary):
+    return ', '.join([
+        f'db;dur={summary["db_ms"]};desc="{summary["queries"]} queries"',
+        f'lock;dur={summary["lock_ms"]};desc="write lock wait"',
+        f'serialize;dur={summary["serializer_ms"]}',
+        f'render;dur={summary["render_ms"]}',
+        f'total;dur={summary["total_ms"]}',
+    ])
+
+
+def log_request(request, response, metrics):
+    summary = metrics.summary()
+    fields = {'method': request.method, 'path': request.path, 'status': response.status_code, **summary}
+    response['Server-Timing'] = server_timing(summary)
+    logger.info(' '.join(f'{key}={value}' for key, value in fields.items()), extra={'performance': fields})
+
+    if summary['total_ms'] >= getattr(settings, 'SLOW_REQUEST_MS', 500):
+        slowest = sorted(metrics.statements, key=lambda statement: statement[0], reverse=True)
+        logger.warning(
+            'Slow request: %s %s took %s ms (%s queries, %s ms in the database). Slowest queries:\n%s',
+            request.method, request.path, summary['total_ms'], summary['queries'], summary['db_ms'],
+            '\n'.join(f'{seconds * 1000:8.2f} ms  {sql}' for seconds, sql in slowest[:SLOW_REQUEST_QUERIES_LOGGED]),
+            extra={'performance': {**fields, 'slow_queries': [sql for _, sql in slowest[:SLOW_REQUEST_QUERIES_LOGGED]]}},
+        )
+
+
+class ServerTimingMiddleware:
+    """
+    Collects RequestMetrics for each request and reports them. Put it first in
+    MIDDLEWARE so the total covers the other middleware too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        log_request(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        log_request(request, response, metrics)
+        return response
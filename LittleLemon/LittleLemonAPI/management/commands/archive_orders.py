@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves delivered orders older than ORDER_ARCHIVE_DAYS (or --days) to the archive tables. '
+        'The order endpoints show them again with ?archived=1.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive delivered orders placed more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per transaction.')
+
+    def handle(self, *args, **options):
+        moved = archive_orders(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} orders.'))
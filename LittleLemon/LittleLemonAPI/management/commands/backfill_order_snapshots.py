@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.snapshots import backfill_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Writes the order snapshots the order endpoints read, for orders that have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rewrite every order\'s snapshot, not just the missing ones.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per transaction.')
+
+    def handle(self, *args, **options):
+        written = backfill_snapshots(rebuild=options['rebuild'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} order snapshots.'))
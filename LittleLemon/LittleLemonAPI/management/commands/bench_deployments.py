@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.bench import http_load, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares requests per second and latency of the sync endpoints behind a WSGI server with the '
+        'async ones behind an ASGI server. Start both with LITTLELEMON_THROTTLE=0, or past the first 100 '
+        'requests the user rate limit answers 429s and those get timed instead, for example:\n'
+        '  LITTLELEMON_THROTTLE=0 gunicorn LittleLemon.wsgi -w 1 --threads 8 -b :8000\n'
+        '  LITTLELEMON_THROTTLE=0 uvicorn LittleLemon.asgi:application --port 8001\n'
+        '  manage.py bench_deployments --wsgi http://localhost:8000 --asgi http://localhost:8001 --token <token>'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', default='http://localhost:8000', help='Base URL of the WSGI server.')
+        parser.add_argument('--asgi', default='http://localhost:8001', help='Base URL of the ASGI server.')
+        parser.add_argument('--token', required=True, help='Auth token of the user to make the requests as.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and server.')
+        parser.add_argument('--concurrency', default='1,16,64', help='Comma separated numbers of concurrent clients.')
+        parser.add_argument('paths', nargs='*', default=['/users/users/me', '/menu-items/', '/orders/'])
+
+    def handle(self, *args, **options):
+        headers = {'Authorization': f'Token {options["token"]}', 'Accept': 'application/json'}
+        # The async endpoints are the sync ones under /api/async/
+        servers = (
+            ('wsgi', options['wsgi'].rstrip('/') + '/api'),
+            ('asgi', options['asgi'].rstrip('/') + '/api/async'),
+        )
+        throttled = set()
+        for path in options['paths']:
+            for concurrency in map(int, options['concurrency'].split(',')):
+                for name, base_url in servers:
+                    url = base_url + path
+                    http_load([url], min(50, options['requests']), concurrency, headers)  # warm up
+                    rps, timings, statuses = http_load([url], options['requests'], concurrency, headers)
+                    stats = summarize(timings)
+                    counts = ', '.join(f'{status or "no response"}: {count}' for status, count in sorted(statuses.items(), key=str))
+                    self.stdout.write(
+                        f'{path:20} c={concurrency:<4} {name}  {rps:8.1f} req/s'
+                        f'  p50 {stats["p50_ms"]:8.2f} ms  p99 {stats["p99_ms"]:8.2f} ms'
+                        f'  statuses {counts}'
+                    )
+                    if statuses[429]:
+                        throttled.add(name)
+
+        if throttled:
+            self.stderr.write(self.style.WARNING(
+                f'The {" and ".join(sorted(throttled))} server answered 429s, so those timings are mostly of the '
+                f'rate limiter; restart it with LITTLELEMON_THROTTLE=0.'
+            ))
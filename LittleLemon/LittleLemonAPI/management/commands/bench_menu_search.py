@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.bench import measure, seed_menu, summarize, temporary_database
+from LittleLemonAPI.models import MenuItem
+from LittleLemonAPI.search import search_menu_items
+
+
+class Command(BaseCommand):
+    help = 'Compares full-text menu search with the title__icontains filter on a generated catalogue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100_000, help='Number of menu items to generate.')
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per search term.')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('terms', nargs='*', default=['lemon', 'chick', 'baklava', 'grilled lamb'])
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        with temporary_database():
+            self.stdout.write(f'Generating {options["items"]} menu items...')
+            seed_menu(options['items'])
+
+            for term in options['terms']:
+                # Same work as the endpoint: one page of results plus the total count
+                def icontains():
+                    queryset = MenuItem.objects.filter(title__icontains=term).order_by('id')
+                    queryset.count()
+                    list(queryset[:page_size])
+
+                def fts():
+                    queryset = search_menu_items(MenuItem.objects.all(), term)
+                    queryset.count()
+                    list(queryset[:page_size])
+
+                for name, function in (('icontains', icontains), ('fts5', fts)):
+                    function()  # warm up
+                    stats = summarize(measure(function, options['runs']))
+                    self.stdout.write(
+                        f'{term!r:16} {name:10} mean {stats["mean_ms"]:8.2f} ms'
+                        f'  p50 {stats["p50_ms"]:8.2f} ms  p95 {stats["p95_ms"]:8.2f} ms'
+                    )
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from LittleLemonAPI.bench import measure, seed_menu, seed_users, summarize, temporary_database
+
+
+MOBILE_FIELDS = 'id,title,price'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the size and latency of a menu page with all fields and with ?fields=id,title,price, '
+        'uncompressed and with gzip and deflate, on a generated menu. The cache is cleared before each '
+        'request, so every timing covers the query, serializing, rendering and compressing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--menu-items', type=int, default=1000, help='Menu items to generate.')
+        parser.add_argument('--per-page', type=int, default=100, help='Menu items on the page.')
+        parser.add_argument('--runs', type=int, default=50, help='Timed requests per variant.')
+
+    def handle(self, *args, **options):
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': None, 'anon': None}}
+        with override_settings(REST_FRAMEWORK=rest_framework, DEBUG=False, ALLOWED_HOSTS=['testserver']), temporary_database():
+            seed_menu(options['menu_items'])
+            customer = seed_users(20)['customer'][0]
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user_id=customer).key}')
+
+            page = f'/api/menu-items/?per_page={options["per_page"]}'
+            baseline = None
+            for fields in (None, MOBILE_FIELDS):
+                path = page if fields is None else f'{page}&fields={fields}'
+                for encoding in ('identity', 'gzip', 'deflate'):
+                    def request():
+                        cache.clear()
+                        return client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+
+                    size = len(request().content)
+                    timings = summarize(measure(request, options['runs']))
+                    if baseline is None:
+                        baseline = (size, timings['p50_ms'])
+                    self.stdout.write(
+                        f'{fields or "all fields":16} {encoding:9} {size:8} bytes ({size / baseline[0] - 1:+5.0%})'
+                        f'  p50 {timings["p50_ms"]:7.2f} ms ({timings["p50_ms"] / baseline[1] - 1:+5.0%})'
+                        f'  p95 {timings["p95_ms"]:7.2f} ms'
+                    )
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from LittleLemonAPI.bench import measure, seed_menu, summarize, temporary_database
+from LittleLemonAPI.fast_serializers import cart_values, menu_item_values
+from LittleLemonAPI.models import Cart, MenuItem
+from LittleLemonAPI.serializers import CartSerializer, MenuItemSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the DRF serializers with the .values() fast path used by the menu and cart listings, '
+        'per row, on a generated menu and cart. Each timing covers the query and building the output.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10_000], help='Row counts to time.')
+        parser.add_argument('--runs', type=int, default=10, help='Timed runs per row count.')
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            seed_menu(max(options['rows']))
+            user = User.objects.create_user(username='bench-cart', password='bench1234')
+            Cart.objects.bulk_create([
+                Cart(user=user, menuitem_id=item_id, quantity=2, unit_price=price, price=price * 2)
+                for item_id, price in MenuItem.objects.order_by('id').values_list('id', 'price')
+            ], batch_size=5000)
+
+            for rows in options['rows']:
+                menu = MenuItem.objects.select_related('category').order_by('id')[:rows]
+                cart = Cart.objects.filter(user=user).select_related('menuitem__category').order_by('id')[:rows]
+                for name, queryset, serializer_class, fast in (
+                    ('menu items', menu, MenuItemSerializer, menu_item_values),
+                    ('cart', cart, CartSerializer, cart_values),
+                ):
+                    def drf():
+                        return serializer_class(queryset, many=True).data
+
+                    def values():
+                        return fast.serialize(fast.values(queryset))
+
+                    if JSONRenderer().render(drf()) != JSONRenderer().render(values()):
+                        raise CommandError(f'The fast path output differs from {serializer_class.__name__}.')
+
+                    results = {}
+                    for label, function in (('serializer', drf), ('values', values)):
+                        results[label] = summarize(measure(function, options['runs']))
+                        self.stdout.write(
+                            f'{name:10} {rows:6} rows  {label:10} p50 {results[label]["p50_ms"]:9.2f} ms'
+                            f'  {results[label]["p50_ms"] * 1000 / rows:7.2f} us/row'
+                        )
+                    self.stdout.write(f'{"":10} {"":11} {results["serializer"]["p50_ms"] / results["values"]["p50_ms"]:.1f}x faster')
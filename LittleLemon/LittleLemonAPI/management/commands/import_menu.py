@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.menu_import import import_menu, parse_menu_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates or updates menu items from a JSON or CSV file. Rows have title, price, featured, '
+        'category (the slug) and optionally id; rows without an id update the item with the same title.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON or CSV file; the format is taken from the extension.')
+        parser.add_argument('--format', choices=['json', 'csv'], help='Override the file format.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without writing anything.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or ('csv' if path.suffix.lower() == '.csv' else 'json')
+        try:
+            rows = parse_menu_file(path.read_text(encoding='utf-8-sig'), file_format)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Could not read {path}: {error}')
+        if not isinstance(rows, list):
+            raise CommandError('Expected a list of menu items.')
+
+        created, updated, errors = import_menu(rows, dry_run=options['dry_run'])
+        if errors:
+            for error in errors:
+                self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+            raise CommandError(f'{len(errors)} invalid rows, nothing was imported.')
+
+        if options['dry_run']:
+            self.stdout.write(f'The file is valid: it would create {created} and update {updated} menu items.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Created {created} and updated {updated} menu items.'))
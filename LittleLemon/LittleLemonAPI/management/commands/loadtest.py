@@ -0,0 +1,352 @@
+import ast
+import json
+import logging
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connections
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+
+from LittleLemonAPI.bench import local_server, percentile, seed_menu, summarize, temporary_database
+from LittleLemonAPI.models import MenuItem
+from LittleLemonAPI.tasks import Worker
+
+
+REQUEST_TIMEOUT = 60
+MENU_PAGE_SIZE = 20
+IDLE_WAIT = 0.1  # seconds a crew member with nothing to deliver waits before looking again
+
+
+def lock_wait(server_timing):
+    """The write lock wait in milliseconds from a Server-Timing header (0 if it has none)."""
+    for metric in server_timing.split(','):
+        name, *params = metric.strip().split(';')
+        if name == 'lock':
+            for param in params:
+                if param.startswith('dur='):
+                    return float(param[4:])
+    return 0.0
+
+
+class LoadResults:
+    """The latency, status and write lock wait of every request, by script step."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.lock_waits = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.locked_errors = 0  # "database is locked" raised in the local server (500s)
+
+    def record(self, step, elapsed_ms, status, lock_ms):
+        with self.lock:
+            self.timings[step].append(elapsed_ms)
+            self.lock_waits[step].append(lock_ms)
+            self.statuses[step][status] += 1
+
+    def record_locked_error(self):
+        with self.lock:
+            self.locked_errors += 1
+
+    def _stats(self, timings, lock_waits, statuses, elapsed):
+        errors = sum(count for status, count in statuses.items() if status is None or status >= 400)
+        return {
+            'requests': len(timings),
+            'per_second': round(len(timings) / elapsed, 1),
+            **summarize(timings),
+            'errors': errors,
+            'error_rate': round(errors / len(timings), 4),
+            # Checkout answers 409 when it gets "database is locked"
+            'locked': statuses[409],
+            'lock_wait_mean_ms': round(statistics.fmean(lock_waits), 3),
+            'lock_wait_p99_ms': round(percentile(lock_waits, 99), 3),
+            'statuses': {str(status or 'no response'): count for status, count in sorted(statuses.items(), key=str)},
+        }
+
+    def summary(self, elapsed):
+        steps = {
+            step: self._stats(timings, self.lock_waits[step], self.statuses[step], elapsed)
+            for step, timings in self.timings.items()
+        }
+        total = self._stats(
+            [timing for timings in self.timings.values() for timing in timings],
+            [wait for waits in self.lock_waits.values() for wait in waits],
+            sum(self.statuses.values(), Counter()),
+            elapsed,
+        )
+        total['locked'] += self.locked_errors
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'checkouts': self.statuses['checkout'][201],
+            'locked_errors': self.locked_errors,
+            'total': total,
+            'steps': steps,
+        }
+
+
+class Client:
+    """A simulated user: sends requests with their token and records them in `results`."""
+    def __init__(self, base_url, token, results, rng):
+        self.base_url, self.token, self.results, self.rng = base_url, token, results, rng
+
+    def request(self, step, method, path, data=None):
+        """Returns the parsed body of a 2xx response, else None."""
+        headers = {'Authorization': f'Token {self.token}', 'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                status, content, timing = response.status, response.read(), response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as error:
+            status, content, timing = error.code, error.read(), error.headers.get('Server-Timing', '')
+        except OSError:  # refused, reset or timed out
+            status, content, timing = None, b'', ''
+        self.results.record(step, (time.perf_counter() - start) * 1000, status, lock_wait(timing))
+        return json.loads(content) if status is not None and status < 300 and content else None
+
+
+def customer(client, menu_ids):
+    """Browses the menu, fills a cart, checks out and looks at their orders."""
+    rng = client.rng
+    pages = max(1, min(5, len(menu_ids) // MENU_PAGE_SIZE))
+    client.request('browse menu', 'GET', f'/api/menu-items/?per_page={MENU_PAGE_SIZE}&page={rng.randint(1, pages)}')
+    client.request('view menu item', 'GET', f'/api/menu-items/{rng.choice(menu_ids)}/')
+    for menu_item in rng.sample(menu_ids, rng.randint(1, 3)):
+        client.request('add to cart', 'POST', '/api/cart/menu-items/', {'menu_item': menu_item, 'quantity': rng.randint(1, 3)})
+    client.request('view cart', 'GET', '/api/cart/menu-items/')
+    client.request('checkout', 'POST', '/api/orders/')
+    client.request('own orders', 'GET', '/api/orders/?per_page=10')
+
+
+def delivery_crew(client, menu_ids):
+    """Looks at their newest orders and marks a few delivered."""
+    data = client.request('assigned orders', 'GET', '/api/orders/?per_page=10')
+    orders = [order['order_id'] for order in (data or {}).get('orders', [])]
+    if not orders:
+        time.sleep(IDLE_WAIT)
+        return
+    client.request('deliver', 'PATCH', '/api/orders/bulk/', {'orders': orders[:client.rng.randint(1, 5)], 'status': True})
+
+
+def manager(client, menu_ids):
+    """Looks at the newest orders and dispatches the unassigned ones."""
+    client.request('all orders', 'GET', '/api/orders/?per_page=50')
+    client.request('dispatch', 'PATCH', '/api/orders/bulk/', {'auto': True})
+
+
+SCRIPTS = {'customer': customer, 'delivery-crew': delivery_crew, 'manager': manager}
+
+
+def load_usernames(role, count):
+    return [f'load-{role}-{i}' for i in range(count)]
+
+
+def load_users(counts):
+    """
+    Gets or creates counts[role] users (load-<role>-0, ...) in each role's
+    group. Returns {role: [token keys]}.
+    """
+    tokens = {}
+    for role, count in counts.items():
+        usernames = load_usernames(role, count)
+        User.objects.bulk_create(
+            [User(username=username, password=make_password(None)) for username in usernames], ignore_conflicts=True,
+        )
+        users = list(User.objects.filter(username__in=usernames))
+        Group.objects.get_or_create(name=role)[0].user_set.add(*users)
+        tokens[role] = [Token.objects.get_or_create(user=user)[0].key for user in users]
+    return tokens
+
+
+def delete_load_users(counts):
+    """Deletes the users load_users made, with their tokens, carts and orders."""
+    usernames = [username for role, count in counts.items() for username in load_usernames(role, count)]
+    User.objects.filter(username__in=usernames).delete()
+
+
+def run_load(base_url, tokens, menu_ids, duration, think=0.0, seed=0, results=None):
+    """
+    Runs each user's script over and over, a thread per user, for `duration`
+    seconds, pausing `think` seconds on average between runs. `tokens` is
+    {role: [token keys]}. Returns the LoadResults and the seconds it took.
+    """
+    results = results or LoadResults()
+    deadline = time.monotonic() + duration
+
+    def run(role, token, user_seed):
+        client = Client(base_url, token, results, random.Random(user_seed))
+        while time.monotonic() < deadline:
+            SCRIPTS[role](client, menu_ids)
+            if think:
+                time.sleep(client.rng.uniform(0, 2 * think))
+
+    threads = [
+        threading.Thread(target=run, args=(role, token, f'{seed}-{role}-{i}'))
+        for role, role_tokens in tokens.items()
+        for i, token in enumerate(role_tokens)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+@contextmanager
+def background_worker(threads):
+    """Runs the task queue (report rollups) alongside the load, as run_tasks would."""
+    if not threads:
+        yield
+        return
+    worker = Worker(threads=threads, poll=0.2)
+
+    def run():
+        try:
+            worker.run()
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        worker.stop()
+        thread.join()
+
+
+@contextmanager
+def counting_locked_errors(results):
+    """Counts the requests that failed with "database is locked", and keeps their tracebacks out of the output."""
+    def receiver(sender, **kwargs):
+        error = sys.exc_info()[1]
+        if isinstance(error, OperationalError) and 'locked' in str(error):
+            results.record_locked_error()
+
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    got_request_exception.connect(receiver)
+    try:
+        yield
+    finally:
+        got_request_exception.disconnect(receiver)
+        request_logger.setLevel(level)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the order flow under contention: simulated customers browse the menu, fill their carts '
+        'and check out while delivery crew deliver and managers dispatch, all at once. By default it seeds '
+        'a temporary database and serves it from a local threaded server; --url loads a running server '
+        'instead. Reports throughput, latency percentiles, error rates, "database is locked" failures and '
+        'the time requests waited for the SQLite write lock.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=20, help='Simulated customers.')
+        parser.add_argument('--crew', type=int, default=3, help='Simulated delivery crew.')
+        parser.add_argument('--managers', type=int, default=1, help='Simulated managers.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for.')
+        parser.add_argument('--think', type=float, default=0,
+                            help='Average seconds each user pauses between runs of their script (0: none).')
+        parser.add_argument('--menu-items', type=int, default=200, help='Menu items to generate for the local server.')
+        parser.add_argument('--task-threads', type=int, default=1,
+                            help='Threads running the task queue next to the local server (0: none).')
+        parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                            help='Override a setting for the local server, as a Python literal, e.g. '
+                                 '--set "SQLITE_PRAGMAS={\'journal_mode\': \'DELETE\', \'busy_timeout\': 1000}".')
+        parser.add_argument('--url', help='Load this running server instead. It must use the same database as this '
+                                          'command, where the load-* users are created (and deleted afterwards, '
+                                          'with the orders they placed); its rate limits apply.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        counts = {'customer': options['customers'], 'delivery-crew': options['crew'], 'manager': options['managers']}
+        if options['url']:
+            if options['set']:
+                raise CommandError('--set only applies to the local server.')
+            menu_ids = list(MenuItem.objects.values_list('id', flat=True))
+            if not menu_ids:
+                raise CommandError('The database has no menu items to order; run seed_bench first.')
+            try:
+                results, elapsed = run_load(
+                    options['url'].rstrip('/'), load_users(counts), menu_ids, options['duration'], options['think'],
+                    options['seed'],
+                )
+            finally:
+                # The server's database is a real one; leave no manager or crew logins behind
+                delete_load_users(counts)
+        else:
+            results, elapsed = self.run_locally(counts, options)
+
+        summary = results.summary(elapsed)
+        self.report(summary)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({'options': {name: options[name] for name in (
+                    'customers', 'crew', 'managers', 'duration', 'think', 'task_threads', 'set', 'url',
+                )}, **summary}, file, indent=2)
+
+    def run_locally(self, counts, options):
+        overrides = {}
+        for setting in options['set']:
+            name, _, value = setting.partition('=')
+            try:
+                overrides[name.strip()] = ast.literal_eval(value.strip())
+            except (ValueError, SyntaxError):
+                raise CommandError(f'--set {setting}: the value must be a Python literal.')
+
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': None, 'anon': None}}
+        test_settings = {
+            'REST_FRAMEWORK': rest_framework, 'DEBUG': False, 'ALLOWED_HOSTS': ['127.0.0.1'], 'SLOW_REQUEST_MS': 10 ** 9,
+        }
+        with override_settings(**{**test_settings, **overrides}), temporary_database():
+            seed_menu(options['menu_items'], seed=options['seed'])
+            tokens = load_users(counts)
+            menu_ids = list(MenuItem.objects.values_list('id', flat=True))
+            results = LoadResults()
+            with local_server() as base_url, background_worker(options['task_threads']), counting_locked_errors(results):
+                return run_load(
+                    base_url, tokens, menu_ids, options['duration'], options['think'], options['seed'], results=results,
+                )
+
+    def report(self, summary):
+        self.stdout.write(
+            f'{"step":18} {"requests":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+            f'{"errors":>7} {"locked":>6} {"lock wait ms":>14}'
+        )
+        for step, stats in [*summary['steps'].items(), ('total', summary['total'])]:
+            self.stdout.write(
+                f'{step:18} {stats["requests"]:8} {stats["per_second"]:8.1f} {stats["p50_ms"]:8.2f} '
+                f'{stats["p95_ms"]:8.2f} {stats["p99_ms"]:8.2f} {stats["error_rate"]:7.1%} {stats["locked"]:6} '
+                f'{stats["lock_wait_mean_ms"]:6.2f} / {stats["lock_wait_p99_ms"]:<6.2f}'
+            )
+        self.stdout.write(
+            f'{summary["checkouts"]} checkouts in {summary["elapsed_s"]} s; '
+            f'{summary["total"]["locked"]} requests failed with "database is locked" '
+            f'({summary["locked_errors"]} as 500s, the rest as 409s from checkout). '
+            'Lock wait is the mean / p99 time spent waiting to start a write transaction.'
+        )
+        for step, stats in summary['steps'].items():
+            if stats['errors']:
+                self.stdout.write(f'  {step}: {stats["statuses"]}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from LittleLemonAPI.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for menu item titles from the menu tables.'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The menu search index only exists on SQLite.')
+
+        with transaction.atomic():
+            count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} menu items.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from LittleLemonAPI.reports import rebuild_reports
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the sales and delivery crew rollup tables from the orders.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_reports()
+        self.stdout.write(self.style.SUCCESS('Rollup tables rebuilt.'))
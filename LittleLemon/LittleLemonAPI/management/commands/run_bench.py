@@ -0,0 +1,249 @@
+import json
+import os
+import subprocess
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from LittleLemonAPI import urls
+from LittleLemonAPI.bench import (
+    measure, private_cache, seed_menu, seed_orders, seed_users, summarize, temporary_database,
+)
+from LittleLemonAPI.events import latest_event_id
+from LittleLemonAPI.models import Cart, Category, MenuItem, Order
+
+
+COLD = object()
+
+# Routes run_bench can't time through the test client
+NOT_BENCHMARKED = {
+    'async_order_event_stream': 'an SSE stream needs an ASGI server',
+}
+
+
+def scenarios(ids):
+    """
+    (name, url name, method, path, role, data) for every route, with ids from
+    the dataset. Data of COLD means a GET with the cache cleared first.
+    """
+    menu_item, order, crew_order, customer = ids['menu_item'], ids['order'], ids['crew_order'], ids['customer']
+    return [
+        ('register', 'users', 'post', '/api/users/', None, {'username': 'bench-new', 'password': 'x', 'email': 'new@example.com'}),
+        ('current user', 'current_user', 'get', '/api/users/users/me', 'customer', None),
+        ('menu list', 'menu_items', 'get', '/api/menu-items/', 'customer', None),
+        ('menu list, cold cache', 'menu_items', 'get', '/api/menu-items/?per_page=50&category=Mains&price=20', 'customer', COLD),
+        ('menu search', 'menu_items', 'get', '/api/menu-items/?search=lemon&per_page=20', 'customer', COLD),
+        ('menu create', 'menu_items', 'post', '/api/menu-items/', 'manager',
+         {'title': 'Bench Dish', 'price': '9.99', 'featured': False, 'category_id': ids['category']}),
+        ('menu bulk import', 'menu_items_bulk', 'post', '/api/menu-items/bulk/', 'manager',
+         [{'title': f'Bench Dish {i}', 'price': '9.99', 'category': ids['category_slug']} for i in range(100)]),
+        ('menu item', 'menu_item_detail', 'get', f'/api/menu-items/{menu_item}/', 'customer', COLD),
+        ('menu item update', 'menu_item_detail', 'patch', f'/api/menu-items/{menu_item}/', 'manager', {'price': '8.50'}),
+        ('group members', 'group_user', 'get', '/api/groups/delivery-crew/users', 'manager', None),
+        ('group add', 'group_user', 'post', '/api/groups/delivery-crew/users', 'manager', {'user_id': customer}),
+        ('group remove', 'remove_user_from_group', 'delete', f'/api/groups/delivery-crew/users/{ids["crew"]}/', 'manager', None),
+        ('cart', 'manage_cart', 'get', '/api/cart/menu-items/', 'customer', None),
+        ('cart add', 'manage_cart', 'post', '/api/cart/menu-items/', 'customer', {'menu_item': menu_item, 'quantity': 1}),
+        ('cart bulk add', 'manage_cart_bulk', 'post', '/api/cart/menu-items/bulk/', 'customer',
+         [{'menu_item': item_id, 'quantity': 2} for item_id in ids['menu_items']]),
+        ('orders, customer', 'manage_order', 'get', '/api/orders/', 'customer', None),
+        ('orders, crew', 'manage_order', 'get', '/api/orders/', 'crew', None),
+        ('orders, manager', 'manage_order', 'get', '/api/orders/', 'manager', None),
+        ('checkout', 'manage_order', 'post', '/api/orders/', 'customer', None),
+        ('orders bulk assign', 'manage_orders_bulk', 'patch', '/api/orders/bulk/', 'manager',
+         {'orders': ids['orders'], 'delivery_crew': ids['crew']}),
+        ('orders auto-dispatch', 'manage_orders_bulk', 'patch', '/api/orders/bulk/', 'manager', {'auto': True}),
+        ('order events, customer', 'order_events', 'get', f'/api/orders/events/?since={ids["event"]}&timeout=0', 'customer', None),
+        ('order events, manager', 'order_events', 'get', f'/api/orders/events/?since={ids["event"]}&timeout=0', 'manager', None),
+        ('export, one customer', 'export_orders', 'get', f'/api/orders/export/?user={customer}', 'manager', None),
+        ('order, crew', 'manager_specific_order', 'get', f'/api/orders/{crew_order}/', 'crew', None),
+        ('order delivered', 'manager_specific_order', 'patch', f'/api/orders/{crew_order}/', 'crew', {'status': 1}),
+        ('order reassign', 'manager_specific_order', 'patch', f'/api/orders/{order}/', 'manager', {'delivery_crew': ids['crew']}),
+        ('order delete', 'manager_specific_order', 'delete', f'/api/orders/{order}/', 'manager', None),
+        ('sales report, 30 days', 'sales_reports', 'get', '/api/reports/?start=' + ids['month_ago'], 'manager', None),
+        ('async current user', 'async_current_user', 'get', '/api/async/users/users/me', 'customer', None),
+        ('async menu list', 'async_menu_items', 'get', '/api/async/menu-items/', 'customer', None),
+        ('async menu item', 'async_menu_item_detail', 'get', f'/api/async/menu-items/{menu_item}/', 'customer', COLD),
+        ('async orders, manager', 'async_orders', 'get', '/api/async/orders/', 'manager', None),
+        ('async order events, manager', 'async_order_events', 'get',
+         f'/api/async/orders/events/?since={ids["event"]}&timeout=0', 'manager', None),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests every API route through the test client and records latency percentiles, queries per '
+        'request and peak Python memory, as JSON. Writes are rolled back after each request. Run it '
+        'against a seeded database named with LITTLELEMON_DB (see seed_bench), or with --seed for a '
+        'small throwaway dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', help='Only run scenarios whose name contains this text.')
+        parser.add_argument('--output', default='bench-results.json', help='Where to write the JSON results.')
+        parser.add_argument('--compare', help='Earlier results file to show p50 changes against.')
+        parser.add_argument('--seed', action='store_true',
+                            help='Run against a temporary database with a small generated dataset.')
+
+    def handle(self, *args, **options):
+        # The run is one transaction, holding the write lock throughout, so
+        # every other writer of the database would wait on it (or time out)
+        project_database = os.path.abspath(settings.BASE_DIR / 'db.sqlite3')
+        if not options['seed'] and os.path.abspath(connection.settings_dict['NAME']) == project_database:
+            raise CommandError(
+                "run_bench locks the database it runs against, so it won't run on the project's database. "
+                'Point LITTLELEMON_DB at a scratch copy or a seeded one (see seed_bench), or use --seed.'
+            )
+
+        # No rate limits, no per-query logging from DEBUG, and a cache of its own
+        # to clear for the cold requests
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': None, 'anon': None}}
+        with override_settings(REST_FRAMEWORK=rest_framework, DEBUG=False, ALLOWED_HOSTS=['testserver']), private_cache():
+            if options['seed']:
+                with temporary_database():
+                    seed_menu(2000)
+                    users = seed_users(500)
+                    seed_orders(20_000, users['customer'], users['delivery-crew'])
+                    results = self.run(options)
+            else:
+                results = self.run(options)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+
+    def run(self, options):
+        # Everything below, including the tokens and the cart, is rolled back at the end
+        with transaction.atomic():
+            ids, clients = self.prepare()
+            selected = [s for s in scenarios(ids) if not options['only'] or options['only'] in s[0]]
+
+            covered = {s[1] for s in scenarios(ids)} | set(NOT_BENCHMARKED)
+            missing = [p.name for p in urls.urlpatterns if p.name not in covered]
+            if missing:
+                raise CommandError(f'No benchmark scenario for: {", ".join(missing)}')
+
+            previous = {}
+            if options['compare']:
+                with open(options['compare']) as file:
+                    previous = {result['name']: result for result in json.load(file)['results']}
+
+            results = []
+            for name, route, method, path, role, data in selected:
+                result = self.bench(clients[role], method, path, data, options)
+                result.update(name=name, route=route, method=method.upper(), path=path)
+                results.append(result)
+                self.report(result, previous.get(name))
+            transaction.set_rollback(True)
+
+        return {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': self.git_commit(),
+            'database': str(connection.settings_dict['NAME']),
+            'dataset': ids['counts'],
+            'runs': options['runs'],
+            'results': results,
+        }
+
+    def prepare(self):
+        counts = {
+            'menu_items': MenuItem.objects.count(),
+            'orders': Order.objects.count(),
+            'users': User.objects.count(),
+        }
+        crew_order = Order.objects.filter(delivery_crew__isnull=False).order_by('-date').first()
+        order = Order.objects.exclude(id=getattr(crew_order, 'id', None)).order_by('-date').first()
+        manager = User.objects.filter(groups__name='manager').first()
+        if not crew_order or not order or not manager:
+            raise CommandError('The database needs orders and a manager to benchmark; run seed_bench or use --seed.')
+        customer = order.user
+        category = Category.objects.first()
+        menu_items = list(MenuItem.objects.values_list('id', flat=True)[:5])
+        orders = list(Order.objects.order_by('-date').values_list('id', flat=True)[:200])
+        for item in MenuItem.objects.filter(id__in=menu_items[1:4]):
+            Cart.objects.create(user=customer, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+
+        clients = {None: APIClient()}
+        for role, user in (('customer', customer), ('crew', crew_order.delivery_crew), ('manager', manager)):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+            clients[role] = client
+
+        ids = {
+            'counts': counts,
+            'menu_item': menu_items[0],
+            'menu_items': menu_items,
+            'category': category.id,
+            'category_slug': category.slug,
+            'order': order.id,
+            'crew_order': crew_order.id,
+            'orders': orders,
+            'event': max(0, latest_event_id() - 50),  # the order feed from 50 events back
+            'crew': crew_order.delivery_crew_id,
+            'customer': customer.id,
+            'month_ago': (order.date.date() - timedelta(days=30)).isoformat(),
+        }
+        return ids, clients
+
+    def bench(self, client, method, path, data, options):
+        cold = data is COLD
+        body = None if cold else data
+
+        def request():
+            if cold:
+                cache.clear()
+            # Each request runs in a savepoint that is rolled back, so writes don't pile up
+            savepoint = transaction.savepoint()
+            try:
+                response = getattr(client, method)(path, body, format='json' if body is not None else None)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            finally:
+                transaction.savepoint_rollback(savepoint)
+            return response
+
+        for _ in range(options['warmup']):
+            request()
+        timings = measure(request, options['runs'])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = request()
+        queries = len(ctx.captured_queries) - 2  # not counting the savepoint and its rollback
+        tracemalloc.start()
+        try:
+            request()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {'status': response.status_code, **summarize(timings), 'queries': queries,
+                'peak_kib': round(peak / 1024, 1)}
+
+    def report(self, result, previous):
+        line = (
+            f'{result["name"]:28} {result["status"]}  p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms'
+            f'  p99 {result["p99_ms"]:8.2f} ms  {result["queries"]:3} queries  {result["peak_kib"]:9.1f} KiB'
+        )
+        if previous:
+            line += f'  p50 {result["p50_ms"] / previous["p50_ms"] - 1:+.0%}'
+        style = self.style.WARNING if result['status'] >= 400 else (lambda text: text)
+        self.stdout.write(style(line))
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
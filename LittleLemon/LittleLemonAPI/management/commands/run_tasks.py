@@ -0,0 +1,54 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from LittleLemonAPI.tasks import Worker, run_worker_process
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued background tasks (the report rollups, ...) until stopped with Ctrl-C or SIGTERM, '
+        'which lets the tasks in hand finish first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Tasks run at once in each process.')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes, each with --threads threads.')
+        parser.add_argument('--batch', type=int, help='Tasks claimed at a time (default: twice --threads).')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between checks when the queue is empty.')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds a claimed task is held before another worker may take it over.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty, e.g. from cron.')
+
+    def handle(self, *args, **options):
+        worker_options = {name: options[name] for name in ('threads', 'batch', 'poll', 'lease', 'burst')}
+        if options['processes'] <= 1:
+            worker = Worker(**worker_options)
+            signal.signal(signal.SIGTERM, worker.stop)
+            signal.signal(signal.SIGINT, worker.stop)
+            ran = worker.run()
+            self.stdout.write(f'Ran {ran} tasks.')
+            return
+
+        # Fresh interpreters rather than forks, so no SQLite connection is shared
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=run_worker_process, args=(worker_options,), daemon=False)
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+
+        def stop(*args):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()  # SIGTERM: the worker finishes its tasks in hand, then exits
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
+        self.stdout.write(f'{len(processes)} worker processes stopped.')
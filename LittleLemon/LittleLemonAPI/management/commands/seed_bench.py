@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from LittleLemonAPI.bench import CATEGORIES, seed_menu, seed_orders, seed_users
+from LittleLemonAPI.models import MenuItem, Order
+from LittleLemonAPI.reports import rebuild_reports
+from LittleLemonAPI.snapshots import backfill_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills an empty database with a large synthetic dataset for run_bench. Point the project at a '
+        'scratch file first, for example:\n'
+        '  LITTLELEMON_DB=bench.sqlite3 manage.py migrate\n'
+        '  LITTLELEMON_DB=bench.sqlite3 manage.py seed_bench'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=len(CATEGORIES))
+        parser.add_argument('--menu-items', type=int, default=100_000)
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable datasets.')
+
+    def handle(self, *args, **options):
+        if MenuItem.objects.exists() or Order.objects.exists():
+            raise CommandError(
+                f'{connection.settings_dict["NAME"]} already has menu items or orders; '
+                'seed_bench only fills an empty database (see --help).'
+            )
+
+        categories = [
+            CATEGORIES[i % len(CATEGORIES)] + (f' {i // len(CATEGORIES) + 1}' if i >= len(CATEGORIES) else '')
+            for i in range(options['categories'])
+        ]
+        self.step('menu items', seed_menu, options['menu_items'], categories=categories, seed=options['seed'])
+        users = self.step('users', seed_users, options['users'])
+        self.step('orders', seed_orders, options['orders'], users['customer'], users['delivery-crew'], seed=options['seed'])
+        self.step('report rollups', transaction.atomic()(rebuild_reports))
+        self.step('order snapshots', backfill_snapshots, batch_size=5000)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {options["menu_items"]} menu items, {options["users"]} users and {options["orders"]} orders. '
+            'Every user\'s password is "bench1234".'
+        ))
+
+    def step(self, name, function, *args, **kwargs):
+        self.stdout.write(f'Creating {name}...', ending='')
+        self.stdout.flush()
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.stdout.write(f' {time.perf_counter() - start:.1f} s')
+        return result
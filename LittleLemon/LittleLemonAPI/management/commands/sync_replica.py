@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from LittleLemonAPI.db import replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the primary SQLite database into the replica file (LITTLELEMON_REPLICA_DB) with the '
+        'SQLite backup API. Stands in for replication when trying the read replica locally.'
+    )
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No replica is configured; set LITTLELEMON_REPLICA_DB.')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica only copies SQLite databases.')
+
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+        self.stdout.write(self.style.SUCCESS(f'Copied {primary.settings_dict["NAME"]} to {replica.settings_dict["NAME"]}.'))
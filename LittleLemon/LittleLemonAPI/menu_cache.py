@@ -0,0 +1,83 @@
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+
+
+MENU_CACHE_TIMEOUT = getattr(settings, 'MENU_CACHE_TIMEOUT', 600)
+MENU_VERSION_KEY = 'menu:version'
+
+# Query params that change what a menu page contains, with the value used
+# when the client leaves them out (so ?per_page=3 and no per_page share an entry)
+MENU_CACHE_PARAMS = {
+    'title': '',
+    'price': '',
+    'category': '',
+    'search': '',
+    'page': '',
+    'per_page': '3',
+    'cursor': '',
+    'count': '',
+    'fields': '',
+    'exclude': '',
+}
+
+
+def get_menu_version():
+    version = cache.get(MENU_VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than 1, so an evicted version never
+        # comes back as a number that old ETags were built from
+        cache.add(MENU_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(MENU_VERSION_KEY)
+    return version
+
+
+def bump_menu_version():
+    try:
+        cache.incr(MENU_VERSION_KEY)
+    except ValueError:
+        get_menu_version()
+
+
+def menu_cache_entry(request, name, **extra):
+    """
+    Returns the (cache key, ETag) pair for a menu response. Both change when
+    the menu version is bumped, so stale pages are never served.
+    """
+    return _menu_cache_entry(request, name, get_menu_version(), extra)
+
+
+async def amenu_cache_entry(request, name, **extra):
+    """menu_cache_entry() for async views, which always render JSON."""
+    version = await cache.aget(MENU_VERSION_KEY)
+    if version is None:
+        version = await sync_to_async(get_menu_version)()
+    return _menu_cache_entry(request, name, version, extra)
+
+
+def _menu_cache_entry(request, name, version, extra):
+    params = tuple(
+        (param, request.query_params.get(param, default).strip())
+        for param, default in MENU_CACHE_PARAMS.items()
+    )
+    # Async views have no renderer negotiation and only render JSON
+    renderer = getattr(request, 'accepted_renderer', None)
+    # The host is part of the key because cursor links are absolute URLs
+    fingerprint = repr((
+        name, version, request.get_host(), renderer.format if renderer else 'json', params, sorted(extra.items())
+    ))
+    digest = hashlib.md5(fingerprint.encode()).hexdigest()
+    return f'menu:{name}:{digest}', f'"{digest}"'
+
+
+def is_not_modified(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    # Weak comparison: compressed responses carry the weak form (W/"...")
+    etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+    return '*' in etags or etag in etags
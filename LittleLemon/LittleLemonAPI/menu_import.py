@@ -0,0 +1,104 @@
+"""
+Bulk menu upserts, for the menu-items/bulk/ endpoint and the import_menu
+command. Categories are looked up by slug and existing items are matched
+by id (or by title when a row has no id), each with a single query, then
+everything is written with bulk_create in one transaction.
+"""
+import csv
+import io
+import json
+
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .menu_cache import bump_menu_version
+from .models import Category, MenuItem
+from .serializers import MenuItemImportSerializer
+
+
+BATCH_SIZE = 500
+UPDATE_FIELDS = ['title', 'price', 'featured', 'category']
+
+
+def parse_menu_file(content, file_format):
+    """Reads rows from JSON (a list, or {"items": [...]}) or CSV text."""
+    if file_format == 'csv':
+        # Empty cells mean "not given", e.g. no id for a new item
+        return [
+            {key: value for key, value in row.items() if value not in ('', None)}
+            for row in csv.DictReader(io.StringIO(content))
+        ]
+    rows = json.loads(content)
+    return rows.get('items') if isinstance(rows, dict) else rows
+
+
+def import_menu(rows, dry_run=False):
+    """
+    Creates or updates menu items from `rows` (dicts with id, title, price,
+    featured and category, the category's slug). Nothing is written unless
+    every row is valid. Returns (created, updated, errors), where errors is a
+    list of {'row': index, 'errors': {...}}.
+    """
+    errors = []
+    valid = []
+    # One serializer for every row, like ListSerializer, so the fields are only built once
+    serializer = MenuItemImportSerializer()
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except ValidationError as error:
+            errors.append({'row': index, 'errors': error.detail})
+
+    slugs = {data['category'] for _, data in valid}
+    categories = {}
+    for category in Category.objects.filter(slug__in=slugs).order_by('-id'):
+        categories[category.slug] = category  # the oldest category wins if slugs repeat
+
+    ids = {data['id'] for _, data in valid if 'id' in data}
+    titles = {data['title'] for _, data in valid if 'id' not in data}
+    by_id, by_title = {}, {}
+    for item in MenuItem.objects.filter(Q(id__in=ids) | Q(title__in=titles)).order_by('-id'):
+        if item.id in ids:
+            by_id[item.id] = item
+        if item.title in titles:
+            by_title[item.title] = item  # the oldest item wins if titles repeat
+
+    to_create, to_update, seen_titles, seen_ids = [], [], set(), set()
+    for index, data in valid:
+        item = by_id.get(data['id']) if 'id' in data else by_title.get(data['title'])
+        row_errors = {}
+        if 'id' in data and item is None:
+            row_errors['id'] = ['Menu item not found.']
+        elif (item.id in seen_ids) if item else (data['title'] in seen_titles):
+            row_errors['id' if 'id' in data else 'title'] = ['Appears more than once in the import.']
+        if data['category'] not in categories:
+            row_errors['category'] = [f'No category with slug "{data["category"]}".']
+        if row_errors:
+            errors.append({'row': index, 'errors': row_errors})
+            continue
+
+        if item is None:
+            seen_titles.add(data['title'])
+            to_create.append(MenuItem(
+                title=data['title'], price=data['price'], featured=data['featured'], category=categories[data['category']],
+            ))
+        else:
+            seen_ids.add(item.id)
+            item.title, item.price, item.featured = data['title'], data['price'], data['featured']
+            item.category = categories[data['category']]
+            to_update.append(item)
+
+    if errors:
+        return 0, 0, sorted(errors, key=lambda error: error['row'])
+    if not dry_run:
+        with transaction.atomic():
+            MenuItem.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+            # An upsert on the primary key: much cheaper than bulk_update()'s CASE WHEN per field
+            MenuItem.objects.bulk_create(
+                to_update, batch_size=BATCH_SIZE, update_conflicts=True, unique_fields=['id'], update_fields=UPDATE_FIELDS,
+            )
+        # bulk_create/bulk_update don't send the signals that invalidate cached
+        # menu pages; bump the version once the rows are committed, as they do
+        transaction.on_commit(bump_menu_version)
+    return len(to_create), len(to_update), []
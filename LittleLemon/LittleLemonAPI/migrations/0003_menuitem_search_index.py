@@ -0,0 +1,74 @@
+from django.db import migrations
+
+
+# FTS5 table mirroring MenuItem.title and its category title (rowid = menu item id).
+# Triggers keep it in sync, including bulk inserts/updates that skip model signals.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS "LittleLemonAPI_menuitem_fts"
+    USING fts5(title, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS "LittleLemonAPI_menuitem_fts_insert"
+    AFTER INSERT ON "LittleLemonAPI_menuitem" BEGIN
+        INSERT INTO "LittleLemonAPI_menuitem_fts" (rowid, title, category)
+        SELECT new.id, new.title, title FROM "LittleLemonAPI_category" WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS "LittleLemonAPI_menuitem_fts_update"
+    AFTER UPDATE OF id, title, category_id ON "LittleLemonAPI_menuitem" BEGIN
+        DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid = old.id;
+        INSERT INTO "LittleLemonAPI_menuitem_fts" (rowid, title, category)
+        SELECT new.id, new.title, title FROM "LittleLemonAPI_category" WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS "LittleLemonAPI_menuitem_fts_delete"
+    AFTER DELETE ON "LittleLemonAPI_menuitem" BEGIN
+        DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS "LittleLemonAPI_category_fts_update"
+    AFTER UPDATE OF title ON "LittleLemonAPI_category" BEGIN
+        UPDATE "LittleLemonAPI_menuitem_fts" SET category = new.title
+        WHERE rowid IN (SELECT id FROM "LittleLemonAPI_menuitem" WHERE category_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO "LittleLemonAPI_menuitem_fts" (rowid, title, category)
+    SELECT item.id, item.title, category.title
+    FROM "LittleLemonAPI_menuitem" item
+    JOIN "LittleLemonAPI_category" category ON category.id = item.category_id
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_category_fts_update"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_delete"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_update"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_insert"',
+    'DROP TABLE IF EXISTS "LittleLemonAPI_menuitem_fts"',
+]
+
+
+def run_sqlite(statements):
+    def operation(apps, schema_editor):
+        # Full-text search is SQLite only, other databases fall back to icontains
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0002_rename_catgeory_menuitem_category'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(CREATE_SQL), run_sqlite(DROP_SQL)),
+    ]
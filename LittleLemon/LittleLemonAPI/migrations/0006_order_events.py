@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0005_composite_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('created', 'Created'), ('assigned', 'Assigned'), ('status', 'Status changed'), ('deleted', 'Deleted')], max_length=10)),
+                ('status', models.BooleanField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivery_crew', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('previous_crew', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='orderevent_user_idx'), models.Index(fields=['delivery_crew', 'id'], name='orderevent_crew_idx'), models.Index(fields=['previous_crew', 'id'], name='orderevent_previous_crew_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# OrderHistory: the orders and the archived orders as one table. A migration
+# that rebuilds either table on SQLite has to drop the view first and recreate it
+CREATE_VIEW_SQL = """
+    CREATE VIEW "LittleLemonAPI_orderhistory" AS
+    SELECT "id", "user_id", "delivery_crew_id", "status", "total", "date", "snapshot" FROM "LittleLemonAPI_order"
+    UNION ALL
+    SELECT "id", "user_id", "delivery_crew_id", "status", "total", "date", "snapshot" FROM "LittleLemonAPI_archivedorder"
+"""
+
+DROP_VIEW_SQL = 'DROP VIEW IF EXISTS "LittleLemonAPI_orderhistory"'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0008_tasks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.BooleanField()),
+                ('total', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('date', models.DateTimeField()),
+                ('snapshot', models.JSONField(null=True)),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_orderhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.BooleanField(default=True)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('date', models.DateTimeField()),
+                ('snapshot', models.JSONField(editable=False)),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivery_crew', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.SmallIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('menuitem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='LittleLemonAPI.menuitem')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.archivedorder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['date', 'id'], name='archivedorder_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'date', 'id'], name='archivedorder_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['delivery_crew', 'date', 'id'], name='archivedorder_crew_date_idx'),
+        ),
+        migrations.RunSQL(CREATE_VIEW_SQL, DROP_VIEW_SQL),
+    ]
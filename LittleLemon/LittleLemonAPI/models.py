@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User, Group
+from django.utils import timezone
 
 class Category(models.Model):
     slug = models.SlugField()
@@ -15,6 +16,11 @@ class MenuItem(models.Model):
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [
+            # menu filtered by category and price
+            models.Index(fields=['category', 'price'], name='menuitem_category_price_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -38,6 +44,16 @@ class Order(models.Model):
     status = models.BooleanField(default=False, db_index=True) # delivered or not
     total = models.DecimalField(max_digits=6, decimal_places=2)
     date = models.DateTimeField(db_index=True)
+    # What the order endpoints show, written at checkout (see snapshots.py)
+    snapshot = models.JSONField(null=True, blank=True, editable=False)
+
+    class Meta:
+        # Order listings filter on one of these and page by date, newest first
+        indexes = [
+            models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+            models.Index(fields=['delivery_crew', 'date'], name='order_crew_date_idx'),
+            models.Index(fields=['status', 'date'], name='order_status_date_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -49,3 +65,128 @@ class OrderItem(models.Model):
 
     class Meta:
         unique_together = ('order', 'menuitem') # this means an order can have only one of each menu item
+
+
+# Delivered orders moved out of Order and OrderItem by `manage.py archive_orders`
+# (see archive.py), so the tables every order listing reads stay small
+class ArchivedOrder(models.Model):
+    # The order's id: AUTOINCREMENT never hands it out to a new order again
+    id = models.BigIntegerField(primary_key=True)
+    # Indexed below, together with the date
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+', db_index=False)
+    status = models.BooleanField(default=True)
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateTimeField()
+    snapshot = models.JSONField(editable=False)
+    archived = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # The listings page by (date, id). Order's indexes end in the rowid, so
+        # they hold that order already; a bigint primary key isn't the rowid
+        indexes = [
+            models.Index(fields=['date', 'id'], name='archivedorder_date_idx'),
+            models.Index(fields=['user', 'date', 'id'], name='archivedorder_user_date_idx'),
+            models.Index(fields=['delivery_crew', 'date', 'id'], name='archivedorder_crew_date_idx'),
+        ]
+
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+
+# Orders and archived orders together: a UNION ALL view over both tables, read
+# when a client asks for ?archived=1. SQLite applies the filters and the
+# ordering to each table's indexes and merges the two, so it pages like Order
+class OrderHistory(models.Model):
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='+')
+    delivery_crew = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    status = models.BooleanField()
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateTimeField()
+    snapshot = models.JSONField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'LittleLemonAPI_orderhistory'
+
+
+# Reporting rollups, kept up to date as orders change (see reports.py)
+class MenuItemSales(models.Model):
+    date = models.DateField()
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'menuitem')
+
+
+class CategorySales(models.Model):
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'category')
+
+
+class DeliveryCrewOrders(models.Model):
+    date = models.DateField()
+    delivery_crew = models.ForeignKey(User, on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'delivery_crew')
+
+
+# Feed of order changes for the long-poll and SSE endpoints (see events.py)
+class OrderEvent(models.Model):
+    CREATED, ASSIGNED, STATUS, DELETED = 'created', 'assigned', 'status', 'deleted'
+    KINDS = [(CREATED, 'Created'), (ASSIGNED, 'Assigned'), (STATUS, 'Status changed'), (DELETED, 'Deleted')]
+
+    order_id = models.BigIntegerField()  # not a foreign key, so the events outlive a deleted order
+    kind = models.CharField(max_length=10, choices=KINDS)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    delivery_crew = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+', db_index=False)
+    # The crew member an order was taken from, so they hear about it too
+    previous_crew = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+', db_index=False)
+    status = models.BooleanField()
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Each client reads the events after its cursor for the orders it can see
+        indexes = [
+            models.Index(fields=['user', 'id'], name='orderevent_user_idx'),
+            models.Index(fields=['delivery_crew', 'id'], name='orderevent_crew_idx'),
+            models.Index(fields=['previous_crew', 'id'], name='orderevent_previous_crew_idx'),
+        ]
+
+
+# Background jobs, run by `manage.py run_tasks` (see tasks.py)
+class Task(models.Model):
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=255)  # dotted path of a @task function
+    kwargs = models.JSONField(default=dict)
+    # Enqueueing a second task with the same key does nothing
+    key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # When a queued task is due; for a running one, when its worker's lease runs out
+    run_at = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        # Workers claim due tasks with status IN (queued, running) AND run_at <= now
+        indexes = [models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx')]
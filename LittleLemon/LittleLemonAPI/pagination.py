@@ -0,0 +1,84 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class _RowsNeeded(Exception):
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+
+class _PageQuery:
+    """
+    Stands in for the queryset while CursorPagination works out which page to
+    read. The first pass stops at the slice with the final query, so the rows
+    can be fetched with the async ORM; the second pass hands those rows back.
+    """
+    def __init__(self, queryset, rows=None):
+        self.queryset = queryset
+        self.rows = rows
+
+    def order_by(self, *fields):
+        return _PageQuery(self.queryset.order_by(*fields), self.rows)
+
+    def filter(self, *args, **kwargs):
+        return _PageQuery(self.queryset.filter(*args, **kwargs), self.rows)
+
+    def __getitem__(self, key):
+        if self.rows is None:
+            raise _RowsNeeded(self.queryset[key])
+        return self.rows
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over an indexed column. Pages are fetched with
+    WHERE column > last_seen instead of OFFSET, so deep pages cost the same as
+    the first one. The total count is only computed when asked for (?count=true).
+    """
+    results_key = 'results'
+    page_size_query_param = 'per_page'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views, reading the page with the async ORM."""
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = await queryset.acount()
+        try:
+            return super().paginate_queryset(_PageQuery(queryset), request, view)
+        except _RowsNeeded as needed:
+            rows = [row async for row in needed.queryset]
+        return super().paginate_queryset(_PageQuery(queryset, rows), request, view)
+
+    def get_paginated_data(self, data):
+        paginated = {
+            self.results_key: data,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.count is not None:
+            paginated['count'] = self.count
+        return paginated
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class MenuItemPagination(KeysetPagination):
+    results_key = 'menu_items'
+    ordering = 'id'
+    page_size = 3
+    max_page_size = 100
+
+
+class OrderPagination(KeysetPagination):
+    results_key = 'orders'
+    ordering = ('-date', '-id')  # newest first
+    page_size = 50
+    max_page_size = 500
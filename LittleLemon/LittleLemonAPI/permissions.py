@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import IsAuthenticated
+
+
+ROLE_CACHE_TIMEOUT = getattr(settings, 'ROLE_CACHE_TIMEOUT', 300)
+
+
+def _role_cache_key(user_id):
+    return f'roles:{user_id}'
+
+
+def get_roles(user):
+    """
+    Returns the set of group names for the user, cached across requests so
+    the groups table is only read again after the TTL or a membership change.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    key = _role_cache_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, roles, ROLE_CACHE_TIMEOUT)
+    return roles
+
+
+async def aget_roles(user):
+    """get_roles() for async views."""
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    key = _role_cache_key(user.pk)
+    roles = await cache.aget(key)
+    if roles is None:
+        roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        await cache.aset(key, roles, ROLE_CACHE_TIMEOUT)
+    return roles
+
+
+def invalidate_roles(*user_ids):
+    cache.delete_many([_role_cache_key(user_id) for user_id in user_ids])
+
+
+class IsAuthenticatedWithRoles(IsAuthenticated):
+    """
+    Same as IsAuthenticated, but also loads the user's groups once and keeps
+    them on request.roles so views can check roles without hitting the DB.
+    """
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        request.roles = get_roles(request.user)
+        return True
@@ -0,0 +1,18 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from .instrumentation import current_metrics
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that adds its time to the request's render time (see instrumentation.py)."""
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        metrics = current_metrics()
+        if metrics is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        start = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            metrics.render += time.perf_counter() - start
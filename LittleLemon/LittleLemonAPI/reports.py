@@ -0,0 +1,221 @@
+"""
+Pre-aggregated sales rollups. The tables are updated incrementally whenever an
+order is created, reassigned, delivered or deleted, so reports read a few
+rows per day instead of scanning the order tables.
+
+The order endpoints don't update them themselves: they work out the deltas
+and queue an update_rollups task (see tasks.py) in the same transaction,
+and `manage.py run_tasks` applies it. The deltas are additions, so the
+tasks give the same totals whatever order they run in.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    ArchivedOrderItem, CategorySales, DeliveryCrewOrders, MenuItem, MenuItemSales, OrderHistory, OrderItem, Task,
+)
+from .tasks import enqueue, task
+
+
+def order_day(date):
+    return timezone.localdate(date) if timezone.is_aware(date) else date.date()
+
+
+def _add(model, key_fields, rows):
+    """
+    Adds deltas to rollup counters with a single INSERT ... ON CONFLICT DO UPDATE.
+    `rows` maps a tuple of key values to a dict of {counter field: delta}.
+    Adding in SQL means concurrent orders never lose each other's increments.
+    """
+    rows = {key: deltas for key, deltas in rows.items() if any(deltas.values())}
+    if not rows:
+        return
+
+    value_fields = list(next(iter(rows.values())))
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    key_columns = [qn(model._meta.get_field(field).column) for field in key_fields]
+    value_columns = [qn(model._meta.get_field(field).column) for field in value_fields]
+
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * (len(key_columns) + len(value_columns))) + ')'] * len(rows))
+    updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in value_columns)
+    params = []
+    for key, deltas in rows.items():
+        day, *other_keys = key
+        params += [connection.ops.adapt_datefield_value(day), *other_keys]
+        params += [str(deltas[field]) if isinstance(deltas[field], Decimal) else deltas[field] for field in value_fields]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(key_columns + value_columns)}) VALUES {placeholders} '
+            f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {updates}',
+            params,
+        )
+
+
+def record_sales(day, items, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) order items from the daily item and
+    category sales. `items` are dicts with menuitem_id, quantity and price.
+    """
+    per_item = defaultdict(lambda: {'quantity': 0, 'revenue': Decimal(0)})
+    for item in items:
+        per_item[day, item['menuitem_id']]['quantity'] += sign * item['quantity']
+        per_item[day, item['menuitem_id']]['revenue'] += sign * item['price']
+    if not per_item:
+        return
+
+    categories = dict(MenuItem.objects.filter(id__in=[menuitem_id for _, menuitem_id in per_item]).values_list('id', 'category_id'))
+    per_category = defaultdict(lambda: {'quantity': 0, 'revenue': Decimal(0)})
+    for (_, menuitem_id), deltas in per_item.items():
+        per_category[day, categories[menuitem_id]]['quantity'] += deltas['quantity']
+        per_category[day, categories[menuitem_id]]['revenue'] += deltas['revenue']
+
+    _add(MenuItemSales, ['date', 'menuitem'], per_item)
+    _add(CategorySales, ['date', 'category'], per_category)
+
+
+def record_crew_changes(changes):
+    """
+    Moves orders between delivery crew counters. `changes` are tuples of
+    (day, old_crew_id, old_delivered, new_crew_id, new_delivered), where a
+    crew id of None means the order is unassigned (or doesn't exist).
+    """
+    deltas = defaultdict(lambda: {'orders': 0, 'delivered': 0})
+    for day, old_crew_id, old_delivered, new_crew_id, new_delivered in changes:
+        if old_crew_id:
+            deltas[day, old_crew_id]['orders'] -= 1
+            deltas[day, old_crew_id]['delivered'] -= int(bool(old_delivered))
+        if new_crew_id:
+            deltas[day, new_crew_id]['orders'] += 1
+            deltas[day, new_crew_id]['delivered'] += int(bool(new_delivered))
+
+    _add(DeliveryCrewOrders, ['date', 'delivery_crew'], deltas)
+
+
+@task()
+def update_rollups(day=None, items=(), sign=1, crew_changes=()):
+    """
+    Task: applies the deltas queued by enqueue_rollups(). Days are ISO dates
+    and prices strings, as they were stored in the task's JSON.
+    """
+    if items:
+        record_sales(date.fromisoformat(day), [{**item, 'price': Decimal(item['price'])} for item in items], sign)
+    if crew_changes:
+        record_crew_changes([(date.fromisoformat(change_day), *change) for change_day, *change in crew_changes])
+
+
+def enqueue_rollups(day=None, items=(), sign=1, crew_changes=(), key=None):
+    """Queues record_sales(day, items, sign) and record_crew_changes(crew_changes) as one task."""
+    enqueue(
+        update_rollups, key=key, day=day and day.isoformat(), sign=sign,
+        items=[{'menuitem_id': item['menuitem_id'], 'quantity': item['quantity'], 'price': str(item['price'])} for item in items],
+        crew_changes=[(change_day.isoformat(), *change) for change_day, *change in crew_changes],
+    )
+
+
+def record_order(order, items):
+    day = order_day(order.date)
+    # Keyed, so an order's sales can only ever be queued once
+    enqueue_rollups(day, items, crew_changes=[(day, None, False, order.delivery_crew_id, order.status)],
+                    key=f'rollups:order:{order.id}')
+
+
+def record_order_update(order, old_crew_id, old_status):
+    day = order_day(order.date)
+    enqueue_rollups(crew_changes=[(day, old_crew_id, old_status, order.delivery_crew_id, order.status)])
+
+
+def record_order_deleted(order, items):
+    day = order_day(order.date)
+    enqueue_rollups(day, items, sign=-1, crew_changes=[(day, order.delivery_crew_id, order.status, None, False)])
+
+
+def _item_totals(group):
+    # {(day, group): [quantity, revenue]} over the order items and the archived ones
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for items in (OrderItem.objects, ArchivedOrderItem.objects):
+        for row in (
+            items.annotate(day=TruncDate('order__date')).values('day', group)
+            .annotate(quantity=Sum('quantity'), revenue=Sum('price')).order_by()
+        ):
+            total = totals[row['day'], row[group]]
+            total[0] += row['quantity']
+            total[1] += row['revenue']
+    return totals
+
+
+def rebuild_reports():
+    """Recomputes every rollup table from the orders, archived ones included, and their items."""
+    # The rebuild already counts every committed change, so drop the updates still queued for them
+    Task.objects.filter(name=update_rollups.task_name, status__in=[Task.QUEUED, Task.RUNNING]).delete()
+    MenuItemSales.objects.all().delete()
+    CategorySales.objects.all().delete()
+    DeliveryCrewOrders.objects.all().delete()
+
+    MenuItemSales.objects.bulk_create(
+        MenuItemSales(date=day, menuitem_id=menuitem, quantity=quantity, revenue=revenue)
+        for (day, menuitem), (quantity, revenue) in _item_totals('menuitem').items()
+    )
+    CategorySales.objects.bulk_create(
+        CategorySales(date=day, category_id=category, quantity=quantity, revenue=revenue)
+        for (day, category), (quantity, revenue) in _item_totals('menuitem__category').items()
+    )
+    crew_orders = (
+        OrderHistory.objects.filter(delivery_crew__isnull=False)
+        .annotate(day=TruncDate('date'))
+        .values('day', 'delivery_crew')
+        .annotate(orders=Count('id'), delivered=Count('id', filter=Q(status=True)))
+        .order_by()
+    )
+    DeliveryCrewOrders.objects.bulk_create(
+        DeliveryCrewOrders(date=row['day'], delivery_crew_id=row['delivery_crew'], orders=row['orders'], delivered=row['delivered'])
+        for row in crew_orders
+    )
+
+
+def sales_report(start=None, end=None):
+    """Totals per menu item, category and delivery crew between two dates (inclusive)."""
+    def in_range(queryset):
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
+
+    daily = (
+        in_range(CategorySales.objects)
+        .values('date')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('date')
+    )
+    menu_items = (
+        in_range(MenuItemSales.objects)
+        .values('menuitem_id', title=F('menuitem__title'))
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-revenue')
+    )
+    categories = (
+        in_range(CategorySales.objects)
+        .values('category_id', title=F('category__title'))
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-revenue')
+    )
+    delivery_crew = (
+        in_range(DeliveryCrewOrders.objects)
+        .values('delivery_crew_id', username=F('delivery_crew__username'))
+        .annotate(orders=Sum('orders'), delivered=Sum('delivered'))
+        .order_by('-orders')
+    )
+    return {
+        'daily': list(daily),
+        'menu_items': list(menu_items),
+        'categories': list(categories),
+        'delivery_crew': list(delivery_crew),
+    }
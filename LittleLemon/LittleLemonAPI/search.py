@@ -0,0 +1,53 @@
+import re
+
+from django.db import connection
+
+from .models import Category, MenuItem
+
+
+FTS_TABLE = 'LittleLemonAPI_menuitem_fts'
+
+
+def fts_query(text):
+    """
+    Turns free text into an FTS5 query where every word is a prefix match,
+    e.g. 'chick sal' -> '"chick"* "sal"*'. Quoting each word keeps FTS5
+    operators typed by the user (AND, NEAR, ...) from being interpreted.
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def search_menu_items(queryset, text):
+    """
+    Filters the menu items to those whose title or category title match the
+    search text and orders them by relevance (best match first).
+    """
+    query = fts_query(text)
+    if not query:
+        return queryset.none()
+
+    if connection.vendor != 'sqlite':
+        return queryset.filter(title__icontains=text)
+
+    menu_table = MenuItem._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'"{FTS_TABLE}".rowid = "{menu_table}"."id"', f'"{FTS_TABLE}" MATCH %s'],
+        params=[query],
+        select={'rank': f'"{FTS_TABLE}".rank'},
+        order_by=['rank', 'id'],
+    )
+
+
+def rebuild_search_index():
+    """Refills the search table from the menu. Returns the number of rows indexed."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{FTS_TABLE}"')
+        cursor.execute(
+            f'INSERT INTO "{FTS_TABLE}" (rowid, title, category) '
+            f'SELECT item.id, item.title, category.title FROM "{MenuItem._meta.db_table}" item '
+            f'JOIN "{Category._meta.db_table}" category ON category.id = item.category_id'
+        )
+        count = cursor.rowcount
+        cursor.execute(f'INSERT INTO "{FTS_TABLE}" ("{FTS_TABLE}") VALUES (\'optimize\')')
+    return count
@@ -1,15 +1,58 @@
-from .models import MenuItem, Category, Cart, Order, OrderItem
+from functools import lru_cache
+
+from .cart import MAX_PRICE, MAX_QUANTITY, within_limits
+from .models import MenuItem, Category, Cart, Order, OrderEvent, OrderItem
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from django.db.models import Prefetch
+from .instrumentation import TimedSerializerMixin
+
+
+class SparseFieldsMixin:
+    """
+    Takes fields=[...] and leaves out the other readable fields, for the
+    ?fields= and ?exclude= query params (see requested_fields()).
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name, field in list(self.fields.items()):
+                if name not in fields and not field.write_only:
+                    del self.fields[name]
+
+
+@lru_cache(maxsize=None)
+def readable_fields(serializer_class):
+    return tuple(name for name, field in serializer_class().fields.items() if not field.write_only)
+
 
+def requested_fields(params, serializer_class):
+    """
+    The top-level fields a client asked for with ?fields=a,b or ?exclude=a,b,
+    as a frozenset, or None when it wants all of them.
+    """
+    only, exclude = params.get('fields'), params.get('exclude')
+    if only is None and exclude is None:
+        return None
+    if only is not None and exclude is not None:
+        raise ParseError('Use either fields or exclude, not both.')
 
-class CategorySerializer(serializers.ModelSerializer):
+    readable = readable_fields(serializer_class)
+    names = {name.strip() for name in (only if only is not None else exclude).split(',') if name.strip()}
+    unknown = names.difference(readable)
+    if unknown:
+        raise ParseError(f'Unknown fields: {", ".join(sorted(unknown))}. Available: {", ".join(readable)}.')
+    return frozenset(names if only is not None else set(readable) - names)
+
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'title', 'slug']
         read_only_fields = ['id']
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         source='category', queryset=Category.objects.all(), write_only=True
@@ -17,7 +60,7 @@ class MenuItemSerializer(serializers.ModelSerializer):
 
 
     def validate(self, data):
-        if data['price'] <= 0:
+        if 'price' in data and data['price'] <= 0:  # price is missing on partial updates
             raise serializers.ValidationError("Price must be greater than zero.")
         return data
 
@@ -29,7 +72,21 @@ class MenuItemSerializer(serializers.ModelSerializer):
 
 
 
-class CartSerializer(serializers.ModelSerializer):
+class MenuItemImportSerializer(serializers.Serializer):
+    # One row of a bulk menu import; the category is given by its slug
+    id = serializers.IntegerField(required=False)
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2)
+    featured = serializers.BooleanField(default=False)
+    category = serializers.SlugField()
+
+    def validate_price(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Price must be greater than zero.")
+        return value
+
+
+class CartSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     menu_item = serializers.PrimaryKeyRelatedField(
         source='menuitem', queryset=MenuItem.objects.all(), write_only=True
     )
@@ -43,6 +100,8 @@ class CartSerializer(serializers.ModelSerializer):
     def validate(self, data):
         if data['quantity'] <= 0:
             raise serializers.ValidationError("Quantity must be greater than zero.")
+        if not within_limits(data['quantity'], data['menuitem'].price):
+            raise serializers.ValidationError(f"The price of a cart line can't be more than {MAX_PRICE}.")
         return data
 
     def create(self, validated_data):
@@ -52,3 +111,93 @@ class CartSerializer(serializers.ModelSerializer):
         validated_data['price'] = quantity * menu_item.price
         return super().create(validated_data)
 
+
+class CartEntrySerializer(serializers.Serializer):
+    # Plain ids, so a batch is validated without a MenuItem lookup per entry
+    menu_item = serializers.IntegerField()
+    quantity = serializers.IntegerField(max_value=MAX_QUANTITY)
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be greater than zero.")
+        return value
+
+
+class OrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # ReadOnlyField passes values straight to the renderer, so the output
+    # matches the hand-built dicts the order endpoints used to return
+    menuitem = serializers.ReadOnlyField(source='menuitem.title')
+    unit_price = serializers.ReadOnlyField()
+    price = serializers.ReadOnlyField()
+
+    class Meta:
+        model = OrderItem
+        fields = ['menuitem', 'quantity', 'unit_price', 'price']
+
+
+class OrderSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    order_id = serializers.ReadOnlyField(source='id')
+    user = serializers.ReadOnlyField(source='user.username')
+    total = serializers.ReadOnlyField()
+    date = serializers.ReadOnlyField()
+    items = OrderItemSerializer(source='orderitem_set', many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['order_id', 'user', 'total', 'date', 'items']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # Load users with the orders and all order items (with their menu item)
+        # in one extra query, instead of querying per order and per item
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))
+        )
+
+
+class CustomerOrderSerializer(OrderSerializer):
+    # Customers only see their own orders, so the username is left out
+    class Meta(OrderSerializer.Meta):
+        fields = ['order_id', 'total', 'date', 'items']
+
+
+class OrderDetailSerializer(OrderSerializer):
+    class Meta(OrderSerializer.Meta):
+        fields = ['order_id', 'items']
+
+
+class OrderFilterSerializer(serializers.Serializer):
+    # Query string filters for the manager order listing and export; total is an upper bound
+    date = serializers.DateField(required=False)
+    status = serializers.BooleanField(required=False)
+    total = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+    user = serializers.IntegerField(required=False)
+    delivery_crew = serializers.IntegerField(required=False)
+
+
+MAX_BULK_ORDERS = 1000  # keeps the IN (...) lists well inside SQLite's parameter limit
+
+
+class OrderBulkUpdateSerializer(serializers.Serializer):
+    # The orders to change, and one of: a crew member, a status, or auto-dispatch
+    orders = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=MAX_BULK_ORDERS, required=False)
+    delivery_crew = serializers.IntegerField(required=False)
+    status = serializers.BooleanField(required=False)
+    auto = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        changes = [name for name in ('delivery_crew', 'status') if name in data] + (['auto'] if data['auto'] else [])
+        if len(changes) != 1:
+            raise serializers.ValidationError("Give exactly one of delivery_crew, status or auto.")
+        if 'orders' not in data and not data['auto']:
+            raise serializers.ValidationError({'orders': ["This field is required."]})
+        return data
+
+
+class OrderEventSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    order = serializers.IntegerField(source='order_id')
+    delivery_crew = serializers.IntegerField(source='delivery_crew_id', allow_null=True)
+
+    class Meta:
+        model = OrderEvent
+        fields = ['id', 'order', 'kind', 'status', 'delivery_crew', 'created']
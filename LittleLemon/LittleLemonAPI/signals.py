@@ -0,0 +1,73 @@
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .db import configure_sqlite
+from .instrumentation import install_query_timer
+from .menu_cache import bump_menu_version
+from .models import Category, MenuItem
+from .permissions import invalidate_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Drop cached roles whenever someone is added to or removed from a group
+    if action == 'pre_clear' and reverse:
+        # group.user_set.clear() doesn't say who was in the group, so remember it
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_roles(*(pk_set if reverse else [instance.pk]))
+    elif action == 'post_clear':
+        invalidate_roles(*(instance.__dict__.pop('_cleared_user_ids', []) if reverse else [instance.pk]))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # Deleting a group removes its memberships without an m2m_changed signal,
+    # and they're gone by post_delete
+    instance._member_ids = list(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_roles(*instance.__dict__.pop('_member_ids', []))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # Cached roles are group names, so a renamed group's members need theirs reloaded
+    if not created:
+        invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=MenuItem)
+@receiver([post_save, post_delete], sender=Category)
+def menu_changed(sender, **kwargs):
+    # Any change to the menu makes every cached menu page (and its ETag) stale.
+    # Only once it's committed: bumped earlier, a concurrent GET could cache the
+    # old menu under the new version, and a rollback would drop every page for nothing
+    transaction.on_commit(bump_menu_version)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # The cached token holds a copy of the user, so deactivation (or any other
+    # change) must drop it
+    if not created:
+        invalidate_tokens(*Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+# Time every query on every connection; outside a request the wrapper is a no-op
+connection_created.connect(install_query_timer, dispatch_uid='install_query_timer')
+
+# WAL, busy timeout and the other SQLITE_PRAGMAS on every SQLite connection
+connection_created.connect(configure_sqlite, dispatch_uid='configure_sqlite')
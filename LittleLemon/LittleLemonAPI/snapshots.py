@@ -0,0 +1,177 @@
+"""
+Order snapshots: a JSON copy of what the order endpoints show about an order
+(the customer's username, the total, the items with their menu item titles
+and prices, the status and the delivery crew), stored on the order row.
+Checkout writes it, and the status and crew endpoints keep those two keys
+current; the items never change after checkout. Order reads then come from
+the order rows alone, instead of joining OrderItem, MenuItem and User.
+
+Orders without a snapshot (created before the column existed) are read
+through the serializers as before until `manage.py backfill_order_snapshots`
+fills them in.
+"""
+import json
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Func, JSONField, Value
+
+from .instrumentation import current_metrics
+from .models import Order, OrderItem
+
+
+def _money(value):
+    # As strings, so nothing is lost to floats; checkout's Sum() can come back as Decimal('36')
+    return f'{value:.2f}'
+
+
+def build_snapshot(username, total, status, delivery_crew_id, items):
+    """The snapshot document. `items` are dicts with title, quantity, unit_price and price, in order."""
+    return {
+        'user': username,
+        'total': _money(total),
+        'status': status,
+        'delivery_crew': delivery_crew_id,
+        'items': [
+            {'menuitem': item['title'], 'quantity': item['quantity'],
+             'unit_price': _money(item['unit_price']), 'price': _money(item['price'])}
+            for item in items
+        ],
+    }
+
+
+def refresh_snapshot(order):
+    """Copies the order's status and crew into its snapshot, ahead of order.save()."""
+    if order.snapshot is not None:
+        order.snapshot.update(status=order.status, delivery_crew=order.delivery_crew_id)
+
+
+def snapshot_update(**changes):
+    """
+    An expression for queryset.update(snapshot=...) that sets keys in each
+    row's snapshot with JSON_SET, so bulk updates stay a single UPDATE. Rows
+    without a snapshot keep none.
+    """
+    args = []
+    for key, value in changes.items():
+        if isinstance(value, bool):
+            # JSON() keeps true/false from being stored as 1/0
+            value = Func(Value(json.dumps(value)), function='JSON')
+        elif not hasattr(value, 'resolve_expression'):
+            value = Value(value)
+        args += [Value(f'$.{key}'), value]
+    return Func(F('snapshot'), *args, function='JSON_SET', output_field=JSONField())
+
+
+def snapshot_rows(queryset, fields=None):
+    """
+    The order columns order_data() reads, for requested_fields() `fields`;
+    pass these to the paginator. The snapshot is left out when none of the
+    fields come from it.
+    """
+    if fields is not None and not fields & SNAPSHOT_KEYS:
+        return queryset.values('id', 'date')
+    return queryset.values('id', 'date', 'snapshot')
+
+
+def _item(item):
+    return {**item, 'unit_price': Decimal(item['unit_price']), 'price': Decimal(item['price'])}
+
+
+# Each order serializer field, read from a snapshot row. The values are the
+# ones the serializers pass to the renderer, so the JSON is the same
+SNAPSHOT_FIELDS = {
+    'order_id': lambda row: row['id'],
+    'user': lambda row: row['snapshot']['user'],
+    'total': lambda row: Decimal(row['snapshot']['total']),
+    'date': lambda row: row['date'],
+    'items': lambda row: [_item(item) for item in row['snapshot']['items']],
+}
+SNAPSHOT_KEYS = {'user', 'total', 'items'}
+
+
+def _without_snapshot(rows, serializer_class):
+    missing = [row['id'] for row in rows if 'snapshot' in row and row['snapshot'] is None]
+    if missing:
+        return serializer_class.setup_eager_loading(Order.objects.filter(id__in=missing))
+    return None
+
+
+def _fallback(orders, serializer_class, fields):
+    # {order id: serializer output}; order_id may be one of the fields left out
+    return dict(zip([order.id for order in orders], serializer_class(orders, many=True, fields=fields).data))
+
+
+def _merge(rows, serializer_class, fields, fallback):
+    metrics = current_metrics()
+    start = time.perf_counter()
+    fields = [
+        (name, SNAPSHOT_FIELDS[name]) for name in serializer_class.Meta.fields if fields is None or name in fields
+    ]
+    data = [
+        fallback[row['id']] if row['id'] in fallback else {name: read(row) for name, read in fields}
+        for row in rows
+    ]
+    if metrics is not None:
+        metrics.serializer += time.perf_counter() - start
+    return data
+
+
+def order_data(rows, serializer_class, fields=None):
+    """
+    serializer_class(orders, many=True, fields=fields).data for snapshot_rows(),
+    built from the snapshots. Orders without one go through serializer_class.
+    """
+    queryset = _without_snapshot(rows, serializer_class)
+    fallback = _fallback(list(queryset), serializer_class, fields) if queryset is not None else {}
+    return _merge(rows, serializer_class, fields, fallback)
+
+
+async def aorder_data(rows, serializer_class, fields=None):
+    """order_data() for async views."""
+    queryset = _without_snapshot(rows, serializer_class)
+    fallback = _fallback([order async for order in queryset], serializer_class, fields) if queryset is not None else {}
+    return _merge(rows, serializer_class, fields, fallback)
+
+
+def build_snapshots(orders):
+    """
+    {order id: snapshot} for order rows with id, user__username, total,
+    status and delivery_crew_id, reading their items in one query.
+    """
+    items = defaultdict(list)
+    # In the order they were added, like the order item prefetch returns them
+    for item in OrderItem.objects.filter(order_id__in=[order['id'] for order in orders]).order_by('id').values(
+        'order_id', 'quantity', 'unit_price', 'price', title=F('menuitem__title'),
+    ):
+        items[item['order_id']].append(item)
+    return {
+        order['id']: build_snapshot(
+            order['user__username'], order['total'], order['status'], order['delivery_crew_id'], items[order['id']],
+        )
+        for order in orders
+    }
+
+
+def backfill_snapshots(rebuild=False, batch_size=1000):
+    """
+    Writes snapshots for the orders that have none (every order with
+    rebuild=True), a batch per transaction. Returns how many were written.
+    """
+    orders = Order.objects.all() if rebuild else Order.objects.filter(snapshot__isnull=True)
+    written, last_id = 0, 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                orders.filter(id__gt=last_id).order_by('id')
+                .values('id', 'user__username', 'total', 'status', 'delivery_crew_id')[:batch_size]
+            )
+            if not batch:
+                return written
+            Order.objects.bulk_update([
+                Order(id=order_id, snapshot=snapshot) for order_id, snapshot in build_snapshots(batch).items()
+            ], ['snapshot'])
+        written += len(batch)
+        last_id = batch[-1]['id']
@@ -0,0 +1,192 @@
+"""
+A small background task queue kept in the database, so follow-up work
+(like the report rollups) runs after the request instead of inside it,
+with no broker to deploy.
+
+Functions decorated with @task are queued with enqueue(), which adds a
+Task row in the caller's transaction: the task exists exactly when the
+change that asked for it commits. `manage.py run_tasks` claims due tasks
+and runs them on a pool of threads (and processes, with --processes).
+
+Each task runs in a transaction that also marks it done, so its database
+writes happen once even if a worker dies midway: the task goes back to the
+queue when its lease runs out, and its half-done work was never committed.
+Failures are retried with exponential backoff (TASK_RETRY_BACKOFF seconds,
+doubling, at most TASK_RETRY_BACKOFF_MAX) up to the task's max_attempts.
+"""
+import logging
+import signal
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+
+logger = logging.getLogger('LittleLemonAPI.tasks')
+
+_registry = {}
+
+
+class TaskLost(Exception):
+    """The task was taken over (its lease ran out) or removed while it ran."""
+
+
+def task(max_attempts=5):
+    """Registers a function as a task. Its keyword arguments must be JSON-serializable."""
+    def decorator(function):
+        function.task_name = f'{function.__module__}.{function.__qualname__}'
+        function.max_attempts = max_attempts
+        _registry[function.task_name] = function
+        return function
+    return decorator
+
+
+def enqueue(function, key=None, delay=0, **kwargs):
+    """
+    Queues function(**kwargs). Call it inside the transaction making the
+    change, so the task commits (or rolls back) with it. A task with the same
+    `key` as an earlier one is dropped. `delay` is in seconds.
+    """
+    Task.objects.bulk_create([Task(
+        name=function.task_name, kwargs=kwargs, key=key, max_attempts=function.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )], ignore_conflicts=True)
+
+
+def registered(name):
+    if name not in _registry:
+        import_string(name)  # registers it, if the module has a @task by that name
+    return _registry[name]
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a task that has failed `attempts` times."""
+    base = getattr(settings, 'TASK_RETRY_BACKOFF', 5)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'TASK_RETRY_BACKOFF_MAX', 600))
+
+
+def claim(limit, lease):
+    """
+    Marks up to `limit` due tasks as running for `lease` seconds and returns
+    them. Running tasks whose lease has run out (their worker died) are due
+    again.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        ids = list(
+            Task.objects.filter(status__in=[Task.QUEUED, Task.RUNNING], run_at__lte=now)
+            .order_by('run_at', 'id').values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        Task.objects.filter(id__in=ids).update(
+            status=Task.RUNNING, run_at=now + timedelta(seconds=lease), attempts=F('attempts') + 1,
+        )
+        return list(Task.objects.filter(id__in=ids).order_by('id'))
+
+
+def execute(claimed):
+    """Runs a claimed task; returns its new status."""
+    # Only the worker holding this attempt may finish it
+    mine = Task.objects.filter(id=claimed.id, status=Task.RUNNING, attempts=claimed.attempts)
+    try:
+        with transaction.atomic():
+            registered(claimed.name)(**claimed.kwargs)
+            if not mine.update(status=Task.DONE, finished=timezone.now(), last_error=''):
+                raise TaskLost(claimed.id)
+        return Task.DONE
+    except TaskLost:
+        logger.warning('Task %s (%s) was taken over by another worker; its changes were rolled back', claimed.id, claimed.name)
+        return None
+    except Exception:
+        error = traceback.format_exc()
+        if claimed.attempts >= claimed.max_attempts:
+            logger.error('Task %s (%s) failed for good after %s attempts:\n%s', claimed.id, claimed.name, claimed.attempts, error)
+            mine.update(status=Task.FAILED, finished=timezone.now(), last_error=error)
+            return Task.FAILED
+        logger.warning('Task %s (%s) failed, retrying:\n%s', claimed.id, claimed.name, error)
+        mine.update(status=Task.QUEUED, run_at=timezone.now() + timedelta(seconds=backoff(claimed.attempts)), last_error=error)
+        return Task.QUEUED
+
+
+def purge_finished():
+    """Deletes tasks done more than TASK_RETENTION_DAYS ago; their keys can be used again after that."""
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'TASK_RETENTION_DAYS', 7))
+    return Task.objects.filter(status__in=[Task.DONE], finished__lt=cutoff).delete()[0]
+
+
+def run_pending(limit=100, lease=300):
+    """Runs every due task in this thread until there are none left. Returns how many ran."""
+    ran = 0
+    while tasks := claim(limit, lease):
+        for claimed in tasks:
+            execute(claimed)
+        ran += len(tasks)
+    return ran
+
+
+class Worker:
+    """Claims due tasks and runs them on `threads` threads, polling every `poll` seconds when idle."""
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, threads=4, batch=None, poll=1.0, lease=300, burst=False):
+        self.threads, self.batch, self.poll, self.lease, self.burst = threads, batch or threads * 2, poll, lease, burst
+        self.stopping = False
+        self.purged = 0.0
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def execute(self, claimed):
+        # Like a request: pool threads drop connections that are broken or past CONN_MAX_AGE
+        close_old_connections()
+        try:
+            return execute(claimed)
+        except OperationalError as error:
+            # Couldn't even record the outcome (e.g. "database is locked"); the
+            # task runs again when its lease runs out
+            logger.warning('Task %s (%s) could not be finished: %s', claimed.id, claimed.name, error)
+            return None
+
+    def run(self):
+        """Runs until stop() (or, with burst, until the queue is empty). Returns how many tasks ran."""
+        ran = 0
+        with ThreadPoolExecutor(self.threads) as pool:
+            while not self.stopping:
+                close_old_connections()
+                try:
+                    tasks = claim(self.batch, self.lease)
+                except OperationalError as error:
+                    # Busy database: try again after the poll interval rather than die
+                    logger.warning('Could not claim tasks: %s', error)
+                    time.sleep(self.poll)
+                    continue
+                if tasks:
+                    list(pool.map(self.execute, tasks))
+                    ran += len(tasks)
+                    continue
+                if self.burst:
+                    break
+                if time.monotonic() - self.purged > self.PURGE_INTERVAL:
+                    purge_finished()
+                    self.purged = time.monotonic()
+                time.sleep(self.poll)
+        return ran
+
+
+def run_worker_process(options):
+    """multiprocessing target for `run_tasks --processes`: one Worker in a fresh interpreter."""
+    django.setup()
+    worker = Worker(**options)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
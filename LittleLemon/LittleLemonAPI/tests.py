@@ -1,3 +1,1674 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+from contextlib import nullcontext
+from unittest import mock, skipUnless
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from . import urls
+from .bench import local_server, private_cache, seed_orders, seed_users
+from .compression import accepted_encoding
+from .db import replica_alias
+from .events import order_event, publish
+from .fast_serializers import ValuesSerializer, cart_values, menu_item_values
+from .menu_cache import get_menu_version
+from .management.commands import loadtest, run_bench
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Cart, Category, CategorySales, DeliveryCrewOrders, MenuItem, MenuItemSales, Order,
+    OrderEvent, OrderItem, Task,
+)
+from .permissions import get_roles
+from .search import search_menu_items
+from .serializers import CartSerializer, MenuItemSerializer, OrderSerializer
+from .tasks import Worker, claim, enqueue, execute, run_pending, task
+from .throttling import TokenBucketStore
+
+
+@task()
+def add_category(slug):
+    Category.objects.create(slug=slug, title=slug)
+
+
+@task(max_attempts=2)
+def add_category_then_fail(slug):
+    Category.objects.create(slug=slug, title=slug)
+    raise ValueError(f'{slug} failed')
+
+
+class LittleLemonTestMixin:
+    def setUp(self):
+        # Cached roles, tokens and menu pages would leak between tests otherwise,
+        # and clearing the shared cache would empty it under a running server
+        self.cache_dir = self.enterContext(private_cache())
+        # Give every test its own (empty) rate limit store
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        self.enterContext(override_settings(THROTTLE_STORE_PATH=os.path.join(store_dir, 'throttle.sqlite3')))
+        # Password hashing makes logins "slow"; keep those warnings out of the test output
+        self.enterContext(override_settings(SLOW_REQUEST_MS=10_000))
+        self.category = Category.objects.create(slug='mains', title='Mains')
+        self.menu = [
+            MenuItem.objects.create(title=f'Dish {i}', price=Decimal('5.00') + i, featured=False, category=self.category)
+            for i in range(3)
+        ]
+
+    def make_user(self, username, *groups):
+        user = User.objects.create_user(username=username, password='pass1234', email=f'{username}@example.com')
+        for name in groups:
+            user.groups.add(Group.objects.get_or_create(name=name)[0])
+        return user
+
+    def make_orders(self, user, count, delivery_crew=None):
+        for _ in range(count):
+            order = Order.objects.create(user=user, delivery_crew=delivery_crew, total=0, date=timezone.now())
+            for item in self.menu:
+                OrderItem.objects.create(order=order, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+
+    def committed(self):
+        # TestCase wraps each test in a transaction, so on_commit callbacks (the
+        # menu version bump) only run when asked to, as if the writes were committed
+        capture = getattr(self, 'captureOnCommitCallbacks', None)
+        return capture(execute=True) if capture else nullcontext()
+
+    def count_queries(self, method, url, user, **kwargs):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx, self.committed():
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, len(ctx.captured_queries)
+
+    def fill_cart(self, user):
+        for item in self.menu:
+            Cart.objects.create(user=user, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+
+    def rollups(self):
+        run_pending()  # the order endpoints queue their rollup updates
+        return (
+            list(MenuItemSales.objects.order_by('date', 'menuitem').values_list('date', 'menuitem', 'quantity', 'revenue')),
+            list(CategorySales.objects.order_by('date', 'category').values_list('date', 'category', 'quantity', 'revenue')),
+            list(DeliveryCrewOrders.objects.exclude(orders=0).order_by('date', 'delivery_crew')
+                 .values_list('date', 'delivery_crew', 'orders', 'delivered')),
+        )
+
+
+class LittleLemonTestCase(LittleLemonTestMixin, APITestCase):
+    pass
+
+
+class OrderListingTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+
+    def test_order_listing_output(self):
+        self.make_orders(self.customer, 1, delivery_crew=self.crew)
+        response, _ = self.count_queries('get', '/api/orders/', self.manager)
+        self.assertEqual(response.status_code, 200)
+        order = response.data['orders'][0]
+        self.assertEqual(order['user'], 'customer')
+        self.assertEqual([item['menuitem'] for item in order['items']], ['Dish 0', 'Dish 1', 'Dish 2'])
+
+        response, _ = self.count_queries('get', '/api/orders/', self.customer)
+        self.assertNotIn('user', response.data['orders'][0])
+
+        order_id = order['order_id']
+        response, _ = self.count_queries('get', f'/api/orders/{order_id}/', self.crew)
+        self.assertEqual(set(response.data), {'order_id', 'items'})
+        self.assertEqual(len(response.data['items']), 3)
+
+    def test_order_listing_query_count_is_constant(self):
+        for user in (self.manager, self.crew, self.customer):
+            self.count_queries('get', '/api/orders/', user)  # warm the role cache
+            self.make_orders(self.customer, 2, delivery_crew=self.crew)
+            _, few = self.count_queries('get', '/api/orders/', user)
+            self.make_orders(self.customer, 10, delivery_crew=self.crew)
+            _, many = self.count_queries('get', '/api/orders/', user)
+            self.assertEqual(few, many, f'query count grew with orders for {user.username}')
+
+
+class RoleCacheTests(LittleLemonTestCase):
+    def test_roles_are_resolved_once_and_cached(self):
+        manager = self.make_user('manager', 'manager')
+        crew = self.make_user('crew', 'delivery-crew')
+        self.make_orders(self.make_user('customer', 'customer'), 1, delivery_crew=crew)
+        order = Order.objects.get()
+
+        # Cold cache: one groups query for the caller, then one for the crew member
+        _, cold = self.count_queries('put', f'/api/orders/{order.id}/', manager, data={'delivery_crew': crew.id})
+        _, warm = self.count_queries('put', f'/api/orders/{order.id}/', manager, data={'delivery_crew': crew.id})
+        self.assertEqual(cold - warm, 2)
+
+    def test_membership_changes_invalidate_cached_roles(self):
+        manager = self.make_user('manager', 'manager')
+        user = self.make_user('someone', 'customer')
+        Group.objects.create(name='delivery-crew')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 403)
+
+        self.client.force_authenticate(manager)
+        self.client.post('/api/groups/manager/users', {'user_id': user.id})
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 200)
+
+        self.client.force_authenticate(manager)
+        self.client.delete(f'/api/groups/manager/users/{user.id}/')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 403)
+
+    def test_group_side_changes_invalidate_cached_roles(self):
+        user = self.make_user('someone', 'customer')
+        group = Group.objects.get(name='customer')
+        self.assertEqual(get_roles(user), {'customer'})  # cached from here on
+
+        manager = Group.objects.create(name='manager')
+        manager.user_set.add(user)
+        self.assertEqual(get_roles(user), {'customer', 'manager'})
+        manager.user_set.remove(user)
+        self.assertEqual(get_roles(user), {'customer'})
+
+        manager.user_set.add(user)
+        get_roles(user)
+        manager.user_set.clear()
+        self.assertEqual(get_roles(user), {'customer'})
+
+        group.name = 'regular'
+        group.save()
+        self.assertEqual(get_roles(user), {'regular'})
+        group.delete()
+        self.assertEqual(get_roles(user), frozenset())
+
+
+class MenuCacheTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.customer = self.make_user('customer', 'customer')
+
+    def test_repeat_requests_are_served_from_cache(self):
+        response, _ = self.count_queries('get', '/api/menu-items/?per_page=2', self.customer)
+        self.assertEqual(len(response.data['menu_items']), 2)
+        cached, queries = self.count_queries('get', '/api/menu-items/?per_page=2', self.customer)
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertLessEqual(queries, 1)  # just the role lookup
+
+    def test_etag_returns_not_modified_until_menu_changes(self):
+        url = f'/api/menu-items/{self.menu[0].id}/'
+        etag = self.count_queries('get', url, self.customer)[0]['ETag']
+        response, _ = self.count_queries('get', url, self.customer, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.count_queries('patch', url, self.manager, data={'title': 'Renamed'})
+        response, _ = self.count_queries('get', url, self.customer, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['menu_items'][0]['title'], 'Renamed')
+
+    def test_version_is_bumped_only_after_commit(self):
+        version = get_menu_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.category.save()
+                self.assertEqual(get_menu_version(), version)
+        self.assertNotEqual(get_menu_version(), version)
+
+        # A rolled-back change leaves the cached pages alone
+        version = get_menu_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.category.save()
+                raise ValueError
+        self.assertEqual(get_menu_version(), version)
+
+    def test_category_change_invalidates_menu_pages(self):
+        self.count_queries('get', '/api/menu-items/', self.customer)
+        self.category.title = 'Starters'
+        with self.committed():
+            self.category.save()
+        response, _ = self.count_queries('get', '/api/menu-items/', self.customer)
+        self.assertEqual(response.data['menu_items'][0]['category']['title'], 'Starters')
+
+
+class PaginationTests(LittleLemonTestCase):
+    def test_menu_cursor_pages(self):
+        customer = self.make_user('customer', 'customer')
+        response, _ = self.count_queries('get', '/api/menu-items/?per_page=2', customer)
+        self.assertEqual([item['title'] for item in response.data['menu_items']], ['Dish 0', 'Dish 1'])
+        self.assertIsNone(response.data['previous'])
+        self.assertNotIn('count', response.data)
+
+        response, queries = self.count_queries('get', response.data['next'], customer)
+        self.assertEqual([item['title'] for item in response.data['menu_items']], ['Dish 2'])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(queries, 1)  # no COUNT(*)
+
+        response, _ = self.count_queries('get', '/api/menu-items/?per_page=2&count=true', customer)
+        self.assertEqual(response.data['count'], 3)
+
+    def test_menu_page_numbers_still_work(self):
+        customer = self.make_user('customer', 'customer')
+        response, _ = self.count_queries('get', '/api/menu-items/?page=2&per_page=2', customer)
+        self.assertEqual(response.data, {'menu_items': response.data['menu_items']})
+        self.assertEqual([item['title'] for item in response.data['menu_items']], ['Dish 2'])
+
+    def test_order_listing_is_paginated(self):
+        manager = self.make_user('manager', 'manager')
+        self.make_orders(self.make_user('customer', 'customer'), 3)
+        response, _ = self.count_queries('get', '/api/orders/?per_page=2', manager)
+        first_page = [order['order_id'] for order in response.data['orders']]
+        response, _ = self.count_queries('get', response.data['next'], manager)
+        second_page = [order['order_id'] for order in response.data['orders']]
+        self.assertEqual(first_page + second_page, sorted(first_page + second_page, reverse=True))
+        self.assertEqual(len(first_page + second_page), 3)
+
+
+class MenuSearchTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('customer', 'customer')
+        drinks = Category.objects.create(slug='drinks', title='Drinks')
+        MenuItem.objects.create(title='Lemon Chicken', price=9, featured=False, category=self.category)
+        MenuItem.objects.create(title='Chicken Soup', price=6, featured=False, category=self.category)
+        MenuItem.objects.create(title='Lemonade', price=3, featured=False, category=drinks)
+
+    def search(self, text):
+        response, _ = self.count_queries('get', f'/api/menu-items/?search={text}', self.customer)
+        return [item['title'] for item in response.data['menu_items']]
+
+    def test_prefix_search_on_title_and_category(self):
+        self.assertEqual(sorted(self.search('lemon')), ['Lemon Chicken', 'Lemonade'])
+        self.assertEqual(self.search('chick sou'), ['Chicken Soup'])
+        self.assertEqual(self.search('drink'), ['Lemonade'])
+        self.assertEqual(self.search('"NEAR('), [])
+
+    def test_index_follows_menu_changes(self):
+        item = MenuItem.objects.get(title='Chicken Soup')
+        item.title = 'Tomato Soup'
+        with self.committed():
+            item.save()
+        self.assertEqual(self.search('tomato'), ['Tomato Soup'])
+        with self.committed():
+            item.delete()
+        self.assertEqual(self.search('tomato'), [])
+
+        MenuItem.objects.bulk_create([MenuItem(title='Lemon Tart', price=4, featured=False, category=self.category)])
+        self.assertIn('Lemon Tart', self.search('tart'))
+
+    def test_rebuild_command(self):
+        call_command('rebuild_menu_search', stdout=open(os.devnull, 'w'))
+        self.assertEqual(sorted(self.search('lemon')), ['Lemon Chicken', 'Lemonade'])
+
+
+class MenuImportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        Category.objects.create(slug='desserts', title='Desserts')
+
+    def test_bulk_upsert(self):
+        rows = [
+            {'id': self.menu[0].id, 'title': 'Dish 0', 'price': '9.50', 'category': 'desserts'},
+            {'title': 'Dish 1', 'price': '4.00', 'featured': True, 'category': 'mains'},
+        ] + [{'title': f'New {i}', 'price': '3.00', 'category': 'desserts'} for i in range(20)]
+        response, queries = self.count_queries('post', '/api/menu-items/bulk/', self.manager, data=rows, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['created'], response.data['updated']), (20, 2))
+        # roles, categories, existing items, then the writes and savepoint
+        self.assertLessEqual(queries, 8)
+
+        self.assertEqual(MenuItem.objects.count(), 23)
+        dish = MenuItem.objects.get(id=self.menu[0].id)
+        self.assertEqual((dish.price, dish.category.slug), (Decimal('9.50'), 'desserts'))
+        self.assertTrue(MenuItem.objects.get(id=self.menu[1].id).featured)
+        # The search index triggers see the bulk writes too
+        response, _ = self.count_queries('get', '/api/menu-items/?search=new&per_page=50', self.manager)
+        self.assertEqual(len(response.data['menu_items']), 20)
+
+    def test_invalid_rows_import_nothing(self):
+        rows = [
+            {'title': 'Fine', 'price': '3.00', 'category': 'mains'},
+            {'title': 'Free', 'price': '0', 'category': 'mains'},
+            {'title': 'Lost', 'price': '3.00', 'category': 'nope'},
+            {'id': 999, 'title': 'Ghost', 'price': '3.00', 'category': 'mains'},
+            {'title': 'Fine', 'price': '4.00', 'category': 'mains'},
+        ]
+        response, _ = self.count_queries('post', '/api/menu-items/bulk/', self.manager, data={'items': rows}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([(error['row'], list(error['errors'])) for error in response.data['errors']],
+                         [(1, ['price']), (2, ['category']), (3, ['id']), (4, ['title'])])
+        self.assertEqual(MenuItem.objects.count(), 3)
+
+        self.client.force_authenticate(self.make_user('customer', 'customer'))
+        self.assertEqual(self.client.post('/api/menu-items/bulk/', [], format='json').status_code, 403)
+
+    def test_csv_upload_and_command(self):
+        menu_page = self.count_queries('get', '/api/menu-items/', self.manager)[0].data
+        upload = io.BytesIO(b'title,price,featured,category\nDish 2,12.00,false,mains\nSorbet,4.50,true,desserts\n')
+        upload.name = 'menu.csv'
+        response, _ = self.count_queries('post', '/api/menu-items/bulk/', self.manager, data={'file': upload}, format='multipart')
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        # Cached menu pages are invalidated even though bulk writes send no signals
+        self.assertNotEqual(self.count_queries('get', '/api/menu-items/', self.manager)[0].data, menu_page)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump([{'title': 'Sorbet', 'price': '5.00', 'category': 'desserts'}], file)
+        self.addCleanup(os.remove, file.name)
+        out = io.StringIO()
+        call_command('import_menu', file.name, stdout=out)
+        self.assertIn('Created 0 and updated 1', out.getvalue())
+        self.assertEqual(MenuItem.objects.get(title='Sorbet').price, Decimal('5.00'))
+
+
+class OrderExportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.customer = self.make_user('customer', 'customer')
+        self.other = self.make_user('other', 'customer')
+        self.make_orders(self.customer, 3)
+        self.make_orders(self.other, 2)
+
+    def export(self, query):
+        self.client.force_authenticate(self.manager)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/orders/export/?{query}')
+            self.assertTrue(response.streaming)
+            body = b''.join(response.streaming_content).decode()
+        return body, len(ctx.captured_queries)
+
+    def test_ndjson_export(self):
+        body, _ = self.export('output=ndjson')
+        orders = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(orders), 5)
+        self.assertEqual(set(orders[0]), {'order_id', 'user', 'total', 'date', 'items'})
+        self.assertEqual(len(orders[0]['items']), 3)
+
+        body, _ = self.export(f'user={self.other.id}')
+        self.assertEqual(len(body.splitlines()), 2)
+
+    def test_csv_export(self):
+        body, _ = self.export('output=csv')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][:2], ['order_id', 'user'])
+        self.assertEqual(len(rows), 1 + 5 * 3)
+
+    def test_export_filters(self):
+        Order.objects.filter(user=self.other).update(status=True, total=20)
+        today = timezone.localdate().isoformat()
+        for query, count in (('status=true', 2), ('status=1', 2), ('status=false', 3), (f'date={today}', 5),
+                             ('date=2020-01-01', 0), ('total=10', 3), (f'total=20&user={self.other.id}', 2)):
+            body, _ = self.export(query)
+            self.assertEqual(len(body.splitlines()), count, query)
+
+        for query in ('status=maybe', 'date=bad', 'date=2025-02-30', 'total=abc', 'user=x', 'delivery_crew=1.5'):
+            response, _ = self.count_queries('get', f'/api/orders/export/?{query}', self.manager)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(list(response.data), [query.split('=')[0]])
+
+    def test_export_reads_in_chunks(self):
+        self.export('output=ndjson')  # warm the role cache
+        _, queries = self.export('output=ndjson')
+        self.make_orders(self.customer, 20)
+        self.assertEqual(self.export('output=ndjson')[1], queries)
+
+    def test_export_is_manager_only(self):
+        response, _ = self.count_queries('get', '/api/orders/export/', self.customer)
+        self.assertEqual(response.status_code, 403)
+
+
+class SalesReportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        for _ in range(3):
+            self.fill_cart(self.customer)
+            self.count_queries('post', '/api/orders/', self.customer)
+        first, second, third = Order.objects.order_by('id')
+        self.count_queries('put', f'/api/orders/{first.id}/', self.manager, data={'delivery_crew': self.crew.id})
+        self.count_queries('put', f'/api/orders/{second.id}/', self.manager, data={'delivery_crew': self.crew.id})
+        self.count_queries('patch', f'/api/orders/{first.id}/', self.crew, data={'status': True})
+        self.count_queries('delete', f'/api/orders/{second.id}/', self.manager)
+
+        incremental = self.rollups()
+        call_command('rebuild_reports', stdout=open(os.devnull, 'w'))
+        self.assertEqual(incremental, self.rollups())
+        self.assertEqual(incremental[2][0][2:], (1, 1))
+
+    def test_report_endpoint(self):
+        self.fill_cart(self.customer)
+        self.count_queries('post', '/api/orders/', self.customer)
+        run_pending()
+        today = timezone.localdate()
+
+        response, _ = self.count_queries('get', f'/api/reports/?start={today}&end={today}', self.manager)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['daily'][0]['revenue'], Decimal('36.00'))
+        self.assertEqual(response.data['categories'][0]['title'], 'Mains')
+        self.assertEqual(len(response.data['menu_items']), 3)
+
+        response, _ = self.count_queries('get', f'/api/reports/?end={today - timedelta(days=1)}', self.manager)
+        self.assertEqual(response.data['daily'], [])
+        response, _ = self.count_queries('get', '/api/reports/?start=2025-02-30', self.manager)
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.count_queries('get', '/api/reports/', self.customer)
+        self.assertEqual(response.status_code, 403)
+
+
+class TaskQueueTests(LittleLemonTestCase):
+    def test_tasks_commit_with_the_caller(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            enqueue(add_category, slug='rolled-back')
+            raise ValueError
+        enqueue(add_category, key='once', slug='sides')
+        enqueue(add_category, key='once', slug='sides')
+        self.assertEqual(Task.objects.count(), 1)
+
+        self.assertEqual(run_pending(), 1)
+        self.assertTrue(Category.objects.filter(slug='sides').exists())
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+        self.assertEqual(run_pending(), 0)
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        enqueue(add_category_then_fail, slug='sides')
+        with self.assertLogs('LittleLemonAPI.tasks', 'WARNING'):
+            self.assertEqual(run_pending(), 1)
+        retry = Task.objects.get()
+        self.assertEqual((retry.status, retry.attempts), (Task.QUEUED, 1))
+        self.assertGreater(retry.run_at, timezone.now() + timedelta(seconds=4))
+        self.assertIn('ValueError: sides failed', retry.last_error)
+        self.assertEqual(run_pending(), 0)  # not due yet
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('LittleLemonAPI.tasks', 'ERROR'):
+            self.assertEqual(run_pending(), 1)
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+        # Each attempt's writes were rolled back with it
+        self.assertFalse(Category.objects.filter(slug='sides').exists())
+
+    def test_expired_leases_are_taken_over(self):
+        enqueue(add_category, slug='sides')
+        [first] = claim(10, lease=0)  # this worker "dies" without finishing
+        [second] = claim(10, lease=300)
+        self.assertEqual((first.id, second.attempts), (second.id, 2))
+        self.assertEqual(claim(10, lease=300), [])
+
+        # The first worker waking up can't finish it: its work is rolled back
+        with self.assertLogs('LittleLemonAPI.tasks', 'WARNING'):
+            self.assertIsNone(execute(first))
+        self.assertFalse(Category.objects.filter(slug='sides').exists())
+        self.assertEqual(execute(second), Task.DONE)
+        self.assertEqual(Category.objects.filter(slug='sides').count(), 1)
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+    def test_checkout_queues_the_rollups(self):
+        customer = self.make_user('customer', 'customer')
+        self.fill_cart(customer)
+        self.count_queries('post', '/api/orders/', customer)
+        self.assertFalse(MenuItemSales.objects.exists())
+        self.assertEqual(Task.objects.get().key, f'rollups:order:{Order.objects.get().id}')
+
+        incremental = self.rollups()
+        call_command('rebuild_reports', stdout=open(os.devnull, 'w'))
+        self.assertEqual(incremental, self.rollups())
+        self.assertEqual(incremental[0][0][2:], (2, Decimal('10.00')))
+
+
+class SparseFieldsetTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('customer', 'customer')
+        self.manager = self.make_user('manager', 'manager')
+
+    def get(self, url, user=None):
+        self.client.force_authenticate(user or self.customer)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, ' '.join(query['sql'] for query in ctx.captured_queries)
+
+    def test_menu_fields(self):
+        response, sql = self.get('/api/menu-items/?fields=id,title,price&per_page=2')
+        self.assertEqual(response.data['menu_items'], [
+            {'id': item.id, 'title': item.title, 'price': f'{item.price:.2f}'} for item in self.menu[:2]
+        ])
+        self.assertNotIn('LittleLemonAPI_category', sql)  # the category join is left out too
+        self.assertIn('cursor=', response.data['next'])
+
+        # Cached separately from the full page, and in the same order either way
+        full, _ = self.get('/api/menu-items/?per_page=2')
+        self.assertIn('category', full.data['menu_items'][0])
+        excluded, _ = self.get('/api/menu-items/?exclude=category,featured&per_page=2')
+        self.assertEqual(excluded.data['menu_items'], response.data['menu_items'])
+
+        response, _ = self.get(f'/api/menu-items/{self.menu[0].id}/?fields=title')
+        self.assertEqual(response.data, {'menu_items': [{'title': 'Dish 0'}]})
+
+    def test_unknown_fields(self):
+        for query in ('fields=title,secret', 'exclude=category_id', 'fields=title&exclude=price'):
+            response, _ = self.get(f'/api/menu-items/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+        response, _ = self.get('/api/menu-items/?fields=secret')
+        self.assertEqual(response.data['detail'], 'Unknown fields: secret. Available: id, title, price, featured, category.')
+
+    def test_cart_fields(self):
+        self.fill_cart(self.customer)
+        response, sql = self.get('/api/cart/menu-items/?fields=quantity,price')
+        self.assertEqual(response.data['cart_items'][0], {'quantity': 2, 'price': '10.00'})
+        self.assertNotIn('LittleLemonAPI_menuitem', sql)
+
+    def test_order_fields(self):
+        self.make_orders(self.customer, 2)
+        call_command('backfill_order_snapshots', stdout=io.StringIO())
+        response, sql = self.get('/api/orders/?fields=order_id,date', self.manager)
+        self.assertEqual([set(order) for order in response.data['orders']], [{'order_id', 'date'}] * 2)
+        self.assertNotIn('snapshot', sql)
+
+        response, _ = self.get('/api/orders/?exclude=items', self.customer)
+        self.assertEqual(list(response.data['orders'][0]), ['order_id', 'total', 'date'])
+
+        # Orders without a snapshot go through the serializer, with the same fields
+        full, _ = self.get('/api/orders/?fields=user,items', self.manager)
+        Order.objects.update(snapshot=None)
+        fallback, _ = self.get('/api/orders/?fields=user,items', self.manager)
+        self.assertEqual(fallback.content, full.content)
+        response, _ = self.get('/api/orders/?fields=bogus', self.manager)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_fields(self):
+        token = await Token.objects.acreate(user=self.customer)
+        response = await self.async_client.get('/api/async/menu-items/?fields=title&per_page=1', headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(json.loads(response.content)['menu_items'], [{'title': 'Dish 0'}])
+        response = await self.async_client.get('/api/async/menu-items/?fields=nope', headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200)
+class CompressionTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.make_user('customer', 'customer'))
+
+    def test_accepted_encoding(self):
+        self.assertEqual(accepted_encoding('gzip, deflate, br'), 'gzip')
+        self.assertEqual(accepted_encoding('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(accepted_encoding('*'), 'gzip')
+        self.assertEqual(accepted_encoding('gzip;q=0, identity'), None)
+        self.assertEqual(accepted_encoding(''), None)
+
+    def test_negotiated_compression(self):
+        plain = self.client.get('/api/menu-items/')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        for accept, encoding, decompress in (('gzip', 'gzip', gzip.decompress), ('deflate, gzip;q=0.9', 'deflate', zlib.decompress)):
+            response = self.client.get('/api/menu-items/', HTTP_ACCEPT_ENCODING=accept)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertEqual(decompress(response.content), plain.content)
+            self.assertEqual(int(response['Content-Length']), len(response.content))
+            self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        # The weak ETag a client got with a compressed response still revalidates
+        response = self.client.get('/api/menu-items/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='W/' + plain['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_responses_are_left_alone(self):
+        response = self.client.get(f'/api/menu-items/{self.menu[0].id}/?fields=title', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_html_is_left_alone(self):
+        # The admin login page and the browsable API carry the CSRF token
+        self.client.force_authenticate(None)
+        response = self.client.get('/admin/login/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.content), 200)
+        self.assertNotIn('Content-Encoding', response)
+
+        self.client.force_authenticate(User.objects.get(username='customer'))
+        response = self.client.get('/api/menu-items/', HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertNotIn('Content-Encoding', response)
+
+    async def test_async_responses(self):
+        token = await Token.objects.acreate(user=await User.objects.aget(username='customer'))
+        response = await self.async_client.get(
+            '/api/async/menu-items/', headers={'Authorization': f'Token {token.key}', 'Accept-Encoding': 'gzip'},
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'Dish 0', gzip.decompress(response.content))
+
+
+class OrderSnapshotTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+
+    def checkout(self):
+        # Added in reverse, to check the items keep their order either way
+        for item in reversed(self.menu):
+            Cart.objects.create(user=self.customer, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+        self.count_queries('post', '/api/orders/', self.customer)
+        return Order.objects.latest('id')
+
+    def reads(self):
+        order = Order.objects.filter(delivery_crew=self.crew).first()
+        return [
+            self.count_queries('get', '/api/orders/', self.manager),
+            self.count_queries('get', '/api/orders/', self.customer),
+            self.count_queries('get', '/api/orders/', self.crew),
+            self.count_queries('get', f'/api/orders/{order.id}/', self.crew),
+        ]
+
+    def test_reads_match_the_joins(self):
+        first = self.checkout()
+        self.checkout()
+        self.count_queries('put', f'/api/orders/{first.id}/', self.manager, data={'delivery_crew': self.crew.id})
+        self.count_queries('patch', f'/api/orders/{first.id}/', self.crew, data={'status': True})
+
+        from_snapshots = self.reads()
+        Order.objects.update(snapshot=None)
+        from_joins = self.reads()
+        for (snapshot_response, snapshot_queries), (join_response, join_queries) in zip(from_snapshots, from_joins):
+            self.assertEqual(snapshot_response.content, join_response.content)
+            self.assertLess(snapshot_queries, join_queries)
+        self.assertEqual([item['menuitem'] for item in from_snapshots[0][0].data['orders'][0]['items']], ['Dish 2', 'Dish 1', 'Dish 0'])
+
+        # Pages mixing orders with and without a snapshot keep their order
+        Order.objects.filter(id=first.id).update(snapshot=None)
+        self.assertEqual(self.reads()[0][0].content, from_joins[0][0].content)
+
+    def test_changes_refresh_the_snapshot(self):
+        order = self.checkout()
+        other = self.make_user('crew2', 'delivery-crew')
+        snapshot = lambda: Order.objects.values_list('snapshot', flat=True).get(id=order.id)
+        self.assertEqual(snapshot()['user'], 'customer')
+        self.assertEqual((snapshot()['status'], snapshot()['delivery_crew']), (False, None))
+
+        self.count_queries('put', f'/api/orders/{order.id}/', self.manager, data={'delivery_crew': self.crew.id})
+        self.assertEqual(snapshot()['delivery_crew'], self.crew.id)
+        self.count_queries('patch', '/api/orders/bulk/', self.manager, data={'orders': [order.id], 'delivery_crew': other.id}, format='json')
+        self.assertEqual(snapshot()['delivery_crew'], other.id)
+        self.count_queries('patch', '/api/orders/bulk/', other, data={'orders': [order.id], 'status': True}, format='json')
+        self.assertIs(snapshot()['status'], True)
+        self.count_queries('patch', f'/api/orders/{order.id}/', other, data={'status': False})
+        self.assertIs(snapshot()['status'], False)
+
+        unassigned = self.checkout()
+        self.count_queries('patch', '/api/orders/bulk/', self.manager, data={'auto': True}, format='json')
+        self.assertEqual(Order.objects.get(id=unassigned.id).snapshot['delivery_crew'], self.crew.id)
+        self.assertEqual(Order.objects.get(id=unassigned.id).snapshot['items'], snapshot()['items'])
+
+    def test_backfill(self):
+        written_at_checkout = self.checkout().snapshot
+        self.make_orders(self.customer, 3, delivery_crew=self.crew)
+
+        out = io.StringIO()
+        call_command('backfill_order_snapshots', '--batch-size', '2', stdout=out)
+        self.assertIn('Wrote 3 order snapshots', out.getvalue())
+        self.assertFalse(Order.objects.filter(snapshot__isnull=True).exists())
+        self.assertEqual(Order.objects.filter(delivery_crew=self.crew).first().snapshot['delivery_crew'], self.crew.id)
+
+        call_command('backfill_order_snapshots', '--rebuild', stdout=out)
+        self.assertEqual(Order.objects.earliest('id').snapshot, written_at_checkout)
+
+    async def test_async_listing(self):
+        await sync_to_async(self.checkout)()
+        token = await Token.objects.acreate(user=self.customer)
+        headers = {'Authorization': f'Token {token.key}'}
+        from_snapshot = await self.async_client.get('/api/async/orders/', headers=headers)
+        await Order.objects.aupdate(snapshot=None)
+        from_joins = await self.async_client.get('/api/async/orders/', headers=headers)
+        self.assertEqual(from_snapshot.content, from_joins.content)
+
+
+class OrderArchiveTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+        for _ in range(4):
+            self.fill_cart(self.customer)
+            self.count_queries('post', '/api/orders/', self.customer)
+        self.orders = [order.id for order in Order.objects.order_by('id')]
+        self.count_queries('patch', '/api/orders/bulk/', self.manager, data={'orders': self.orders, 'delivery_crew': self.crew.id}, format='json')
+        self.count_queries('patch', '/api/orders/bulk/', self.crew, data={'orders': self.orders[:3], 'status': True}, format='json')
+        # Two old delivered orders (one from before snapshots), a recent delivered one, an old open one
+        Order.objects.exclude(id=self.orders[2]).update(date=timezone.now() - timedelta(days=100))
+        Order.objects.filter(id=self.orders[1]).update(snapshot=None)
+
+    def archive(self):
+        out = io.StringIO()
+        call_command('archive_orders', stdout=out)
+        return out.getvalue().strip()
+
+    def reads(self, query):
+        responses = [
+            self.count_queries('get', f'/api/orders/{query}', user)[0] for user in (self.manager, self.customer, self.crew)
+        ] + [
+            self.count_queries('get', f'/api/orders/{self.orders[0]}/{query}', self.crew)[0],
+            self.count_queries('get', f'/api/async/orders/{query}', self.customer)[0],
+        ]
+        self.client.force_authenticate(self.manager)
+        export = self.client.get(f'/api/orders/export/{query}')
+        return [response.content for response in responses] + [b''.join(export.streaming_content)]
+
+    def test_archived_orders_read_through(self):
+        before = self.reads('?archived=1')
+        self.assertEqual(self.reads(''), before)
+        self.assertEqual(self.archive(), 'Archived 2 orders.')
+
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), self.orders[2:])
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)), self.orders[:2])
+        self.assertEqual((OrderItem.objects.count(), ArchivedOrderItem.objects.count()), (6, 6))
+        self.assertEqual(len(ArchivedOrder.objects.get(id=self.orders[1]).snapshot['items']), 3)
+        self.assertEqual(self.reads('?archived=1'), before)
+        self.assertEqual(self.archive(), 'Archived 0 orders.')
+
+        # Without ?archived=1 only the hot tables are read
+        response, _ = self.count_queries('get', '/api/orders/', self.manager)
+        self.assertEqual([order['order_id'] for order in response.data['orders']], [self.orders[2], self.orders[3]])
+        response, _ = self.count_queries('get', f'/api/orders/{self.orders[0]}/', self.crew)
+        self.assertEqual(response.status_code, 404)
+        # Archived orders are read-only
+        response, _ = self.count_queries('patch', f'/api/orders/{self.orders[0]}/', self.crew, data={'status': False})
+        self.assertEqual(response.status_code, 404)
+
+    def test_rebuilt_reports_count_archived_orders(self):
+        call_command('rebuild_reports', stdout=open(os.devnull, 'w'))
+        before = self.rollups()
+        self.archive()
+        call_command('rebuild_reports', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.rollups(), before)
+
+    def test_archived_ids_are_not_reused(self):
+        Order.objects.update(status=True, date=timezone.now() - timedelta(days=100))
+        self.archive()
+        self.assertFalse(Order.objects.exists())
+        self.fill_cart(self.customer)
+        self.count_queries('post', '/api/orders/', self.customer)
+        self.assertGreater(Order.objects.get().id, self.orders[-1])
+
+class BulkDispatchTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.other_crew = self.make_user('crew2', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+        self.checkout(6)
+        self.orders = list(Order.objects.order_by('id').values_list('id', flat=True))
+
+    def checkout(self, count):
+        # Through the endpoint, so the rollups are kept up to date
+        for _ in range(count):
+            self.fill_cart(self.customer)
+            self.count_queries('post', '/api/orders/', self.customer)
+
+    def bulk(self, user, data):
+        return self.count_queries('patch', '/api/orders/bulk/', user, data=data, format='json')
+
+    def assertRollupsMatchRebuild(self):
+        incremental = self.rollups()
+        call_command('rebuild_reports', stdout=open(os.devnull, 'w'))
+        self.assertEqual(incremental, self.rollups())
+
+    def test_assign_and_deliver_in_one_update_each(self):
+        response, queries = self.bulk(self.manager, {'orders': self.orders[:4], 'delivery_crew': self.crew.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 4)
+        # roles, crew member, crew roles, savepoint, read, UPDATE, rollups, events, release
+        self.assertEqual(queries, 9)
+        _, more_queries = self.bulk(self.manager, {'orders': self.orders, 'delivery_crew': self.other_crew.id})
+        self.assertEqual(more_queries, queries - 1)  # the crew member's roles are cached now
+
+        response, _ = self.bulk(self.other_crew, {'orders': self.orders[:2], 'status': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.filter(status=True).count(), 2)
+        self.assertRollupsMatchRebuild()
+
+    def test_nothing_changes_unless_every_order_can_be(self):
+        self.bulk(self.manager, {'orders': self.orders[:2], 'delivery_crew': self.crew.id})
+
+        response, _ = self.bulk(self.manager, {'orders': [self.orders[0], 999], 'delivery_crew': self.other_crew.id})
+        self.assertEqual((response.status_code, response.data['orders']), (404, [999]))
+        # Crew can only update their own orders
+        response, _ = self.bulk(self.crew, {'orders': self.orders[:3], 'status': True})
+        self.assertEqual((response.status_code, response.data['orders']), (404, [self.orders[2]]))
+        self.assertFalse(Order.objects.filter(status=True).exists())
+        self.assertEqual(Order.objects.filter(delivery_crew=self.crew).count(), 2)
+
+        response, _ = self.bulk(self.manager, {'orders': self.orders, 'delivery_crew': self.customer.id})
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.bulk(self.manager, {'orders': self.orders, 'delivery_crew': self.crew.id, 'status': True})
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.bulk(self.customer, {'orders': self.orders, 'status': True})
+        self.assertEqual(response.status_code, 403)
+
+    def test_auto_dispatch_balances_open_orders(self):
+        # crew already has three open orders and one delivered
+        self.bulk(self.manager, {'orders': self.orders[:4], 'delivery_crew': self.crew.id})
+        self.bulk(self.crew, {'orders': self.orders[:1], 'status': True})
+        self.checkout(4)
+
+        response, queries = self.bulk(self.manager, {'auto': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 6)
+        # savepoint, crew, their open orders, read, UPDATE, rollups, events, release (roles are cached by now)
+        self.assertEqual(queries, 8)
+        self.assertEqual(
+            dict(Order.objects.filter(status=False).values_list('delivery_crew').annotate(count=Count('id'))),
+            {self.crew.id: 5, self.other_crew.id: 4},  # ties go to the lower id
+        )
+        self.assertRollupsMatchRebuild()
+
+        response, _ = self.bulk(self.manager, {'auto': True})
+        self.assertEqual(response.data['updated'], 0)
+
+
+class OrderEventTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.other_crew = self.make_user('crew2', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+        self.other_customer = self.make_user('other', 'customer')
+
+    def feed(self, user, url='/api/orders/events/?since=0&timeout=0'):
+        response, _ = self.count_queries('get', url, user)
+        self.assertEqual(response.status_code, 200)
+        return [(event['order'], event['kind']) for event in response.data['events']]
+
+    def test_order_changes_reach_the_right_users(self):
+        self.fill_cart(self.customer)
+        self.count_queries('post', '/api/orders/', self.customer)
+        order = Order.objects.get()
+        self.count_queries('put', f'/api/orders/{order.id}/', self.manager, data={'delivery_crew': self.crew.id})
+        self.count_queries('patch', f'/api/orders/bulk/', self.manager,
+                           data={'orders': [order.id], 'delivery_crew': self.other_crew.id}, format='json')
+        self.count_queries('patch', f'/api/orders/{order.id}/', self.other_crew, data={'status': True})
+        self.count_queries('delete', f'/api/orders/{order.id}/', self.manager)
+
+        everything = [(order.id, kind) for kind in ('created', 'assigned', 'assigned', 'status', 'deleted')]
+        self.assertEqual(self.feed(self.customer), everything)
+        self.assertEqual(self.feed(self.manager), everything)
+        # The first crew member hears about the order until it's taken off them
+        self.assertEqual(self.feed(self.crew), everything[1:3])
+        self.assertEqual(self.feed(self.other_crew), everything[2:])
+        self.assertEqual(self.feed(self.other_customer), [])
+
+    def test_cursor(self):
+        self.make_orders(self.customer, 1)
+        publish(*[order_event(OrderEvent.CREATED, order) for order in Order.objects.all()])
+        latest = OrderEvent.objects.get().id
+
+        response, queries = self.count_queries('get', f'/api/orders/events/?since={latest}&timeout=0', self.customer)
+        self.assertEqual((response.data['events'], response.data['cursor']), ([], latest))
+        self.assertEqual(queries, 2)  # roles and the newest event id; nothing new, so no events query
+
+        response, _ = self.count_queries('get', f'/api/orders/events/?since={latest - 1}', self.customer)
+        self.assertEqual(response.data['cursor'], latest)  # returns straight away when there are events
+        self.assertEqual(response.data['events'][0]['delivery_crew'], None)
+
+        # Without a cursor the feed starts from now
+        response, _ = self.count_queries('get', '/api/orders/events/?timeout=0', self.customer)
+        self.assertEqual((response.data['events'], response.data['cursor']), ([], latest))
+        for query in ('since=abc', 'since=-1', 'timeout=soon'):
+            response, _ = self.count_queries('get', f'/api/orders/events/?{query}', self.customer)
+            self.assertEqual(response.status_code, 400, query)
+
+    async def test_async_long_poll_and_stream(self):
+        await sync_to_async(self.make_orders)(self.customer, 2)
+        orders = [order async for order in Order.objects.order_by('id')]
+        await sync_to_async(publish)(*[order_event(OrderEvent.CREATED, order) for order in orders])
+        first = await OrderEvent.objects.order_by('id').afirst()
+        token = await Token.objects.acreate(user=self.customer)
+        headers = {'Authorization': f'Token {token.key}'}
+
+        response = await self.async_client.get('/api/async/orders/events/?since=0&timeout=0', headers=headers)
+        self.assertEqual([event['order'] for event in json.loads(response.content)['events']], [order.id for order in orders])
+
+        # The stream picks up after Last-Event-ID, then sends keepalives until it closes
+        with override_settings(ORDER_EVENTS_STREAM_SECONDS=0.2):
+            response = await self.async_client.get(
+                '/api/async/orders/events/stream/', headers={**headers, 'Last-Event-ID': str(first.id)},
+            )
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        messages = body.split('\n\n')
+        self.assertEqual(messages[0], 'retry: 3000')
+        self.assertTrue(messages[1].startswith(f'id: {first.id + 1}\nevent: order\ndata: {{"id": {first.id + 1}, "order": {orders[1].id}'))
+        self.assertEqual(messages[2], ': keepalive')
+
+    def test_stream_needs_asgi(self):
+        token = Token.objects.create(user=self.customer)
+        response = self.client.get('/api/async/orders/events/stream/', headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CachedTokenAuthenticationTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('customer', 'customer')
+
+    def get_me(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/users/users/me')
+        return response, len(ctx.captured_queries)
+
+    def test_login_warms_the_cache(self):
+        response = self.client.post('/token/login/', {'username': 'customer', 'password': 'pass1234'})
+        token = response.data['token']
+        response, queries = self.get_me(token)
+        self.assertEqual(response.data['username'], 'customer')
+        self.assertEqual(queries, 0)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/menu-items/')
+        self.assertFalse(any('authtoken' in query['sql'] or 'auth_group' in query['sql'] for query in ctx.captured_queries))
+
+    def test_token_is_looked_up_once(self):
+        token = Token.objects.create(user=self.customer)
+        self.assertEqual(self.get_me(token.key)[1], 2)  # token + user, then the roles
+        self.assertEqual(self.get_me(token.key)[1], 0)
+
+    def test_deleted_token_and_inactive_user_are_rejected(self):
+        token = Token.objects.create(user=self.customer)
+        self.get_me(token.key)
+        token.delete()
+        self.assertEqual(self.get_me(token.key)[0].status_code, 401)
+
+        token = Token.objects.create(user=self.customer)
+        self.get_me(token.key)
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertEqual(self.get_me(token.key)[0].status_code, 401)
+
+
+class SharedThrottleTests(LittleLemonTestCase):
+    def test_token_bucket_is_shared_between_connections(self):
+        path = settings.THROTTLE_STORE_PATH
+        worker_a, worker_b = TokenBucketStore(path), TokenBucketStore(path)
+        results = [store.consume('key', 3, 1, now=100)[0] for store in (worker_a, worker_b, worker_a, worker_b)]
+        self.assertEqual(results, [True, True, True, False])
+        # One token per second comes back
+        self.assertTrue(worker_b.consume('key', 3, 1, now=101)[0])
+        self.assertFalse(worker_a.consume('key', 3, 1, now=101.5)[0])
+
+    def test_per_endpoint_rates(self):
+        rates = {**api_settings.DEFAULT_THROTTLE_RATES, 'manage_order:POST': '2/hour'}
+        customer = self.make_user('customer', 'customer')
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            codes = [self.count_queries('post', '/api/orders/', customer)[0].status_code for _ in range(3)]
+            self.assertEqual(codes, [400, 400, 429])
+            # Other endpoints have their own budget
+            self.assertEqual(self.count_queries('get', '/api/orders/', customer)[0].status_code, 200)
+
+    async def test_async_endpoints_throttle_off_the_event_loop(self):
+        token = await Token.objects.acreate(user=await sync_to_async(self.make_user)('customer', 'customer'))
+        rates = {**api_settings.DEFAULT_THROTTLE_RATES, 'async_current_user:GET': '1/hour'}
+        consume = TokenBucketStore.consume
+        in_event_loop = []
+
+        def record(store, *args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                in_event_loop.append(True)
+            except RuntimeError:
+                in_event_loop.append(False)
+            return consume(store, *args, **kwargs)
+
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}), \
+                mock.patch.object(TokenBucketStore, 'consume', record):
+            responses = [await self.async_client.get('/api/async/users/users/me', headers={'Authorization': f'Token {token.key}'})
+                         for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [200, 429])
+        self.assertIn('Retry-After', responses[1])
+        self.assertTrue(in_event_loop)
+        self.assertNotIn(True, in_event_loop)
+
+class CheckoutTests(LittleLemonTestCase):
+    def test_checkout_moves_cart_into_one_order(self):
+        customer = self.make_user('customer', 'customer')
+        self.fill_cart(customer)
+        response, _ = self.count_queries('post', '/api/orders/', customer)
+        self.assertEqual(response.status_code, 201)
+
+        order = Order.objects.get()
+        self.assertEqual(order.total, Decimal('36.00'))
+        self.assertEqual(order.orderitem_set.count(), 3)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        customer = self.make_user('customer', 'customer')
+        Cart.objects.create(user=customer, menuitem=self.menu[0], quantity=1, unit_price=5, price=5)
+        _, one_item = self.count_queries('post', '/api/orders/', customer)
+        self.fill_cart(customer)
+        _, three_items = self.count_queries('post', '/api/orders/', customer)
+        self.assertEqual(one_item - 1, three_items)  # the first request also loaded the roles
+
+    def test_empty_cart_is_rejected(self):
+        customer = self.make_user('customer', 'customer')
+        response, _ = self.count_queries('post', '/api/orders/', customer)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class AsyncEndpointTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.customer = self.make_user('customer', 'customer')
+        self.make_orders(self.customer, 2)
+
+    def get_both(self, url, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return self.client.get(f'/api{url}'), self.client.get(f'/api/async{url}')
+
+    def test_same_output_as_sync_endpoints(self):
+        for url in ['/users/users/me', '/menu-items/', '/menu-items/?per_page=2&count=true',
+                    '/menu-items/?page=2&per_page=2', f'/menu-items/{self.menu[1].id}/', '/orders/?per_page=1']:
+            for user in (self.manager, self.customer):
+                sync_response, async_response = self.get_both(url, user)
+                self.assertEqual(async_response.status_code, 200, url)
+                # Only the next/previous links point at the other endpoint
+                self.assertEqual(async_response.content.replace(b'/api/async/', b'/api/'), sync_response.content, url)
+
+    def test_manager_filters_come_from_the_query_string(self):
+        self.make_orders(self.manager, 1)
+        for url, count in ((f'/orders/?user={self.manager.id}', 1), ('/orders/?status=false&total=10', 3)):
+            for response in self.get_both(url, self.manager):
+                self.assertEqual(len(json.loads(response.content)['orders']), count, url)
+
+        # A filter in the body is ignored, and a bad one in the query string is a 400
+        self.assertEqual(len(self.client.generic('GET', '/api/orders/', 'total=abc', content_type='application/x-www-form-urlencoded').data['orders']), 3)
+        sync_response, async_response = self.get_both('/orders/?total=abc', self.manager)
+        self.assertEqual((sync_response.status_code, async_response.status_code), (400, 400))
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_following_the_next_link(self):
+        _, response = self.get_both('/menu-items/?per_page=2', self.customer)
+        response = self.client.get(json.loads(response.content)['next'])
+        self.assertEqual([item['title'] for item in json.loads(response.content)['menu_items']], ['Dish 2'])
+
+    def test_menu_etag(self):
+        _, response = self.get_both('/menu-items/', self.customer)
+        response = self.client.get('/api/async/menu-items/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_authentication_and_roles(self):
+        self.assertEqual(self.client.get('/api/async/menu-items/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(self.client.get('/api/async/menu-items/').status_code, 401)
+
+        _, response = self.get_both('/menu-items/', self.make_user('nobody'))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post('/api/async/menu-items/').status_code, 405)
+
+        sync_response, async_response = self.get_both('/menu-items/?cursor=bad', self.customer)
+        self.assertEqual(async_response.status_code, 404)
+        self.assertEqual(async_response.content, sync_response.content)
+
+
+class CartTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('customer', 'customer')
+
+    def test_adding_an_item_twice_bumps_the_quantity(self):
+        data = {'menu_item': self.menu[1].id, 'quantity': 2}
+        response, _ = self.count_queries('post', '/api/cart/menu-items/', self.customer, data=data)
+        self.assertEqual(response.status_code, 201)
+        response, queries = self.count_queries('post', '/api/cart/menu-items/', self.customer, data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cart_item']['quantity'], 3)
+        self.assertEqual(queries, 2)  # the update, then the row for the response
+
+        cart_item = Cart.objects.get()
+        self.assertEqual((cart_item.quantity, cart_item.price), (3, Decimal('18.00')))
+
+    def test_bulk_add(self):
+        Cart.objects.create(user=self.customer, menuitem=self.menu[0], quantity=1, unit_price=5, price=5)
+        entries = [
+            {'menu_item': self.menu[0].id, 'quantity': 2},
+            {'menu_item': self.menu[2].id, 'quantity': 1},
+            {'menu_item': self.menu[2].id, 'quantity': 3},
+        ]
+        response, queries = self.count_queries('post', '/api/cart/menu-items/bulk/', self.customer, data=entries, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 7)  # roles, prices, BEGIN, rows in the cart, upsert, COMMIT, then the cart for the response
+        self.assertEqual(
+            sorted(Cart.objects.values_list('menuitem__title', 'quantity', 'price')),
+            [('Dish 0', 3, Decimal('15.00')), ('Dish 2', 4, Decimal('28.00'))],
+        )
+        self.assertEqual(len(response.data['cart_items']), 2)
+
+        # The {"items": [...]} form works too
+        response, _ = self.count_queries('post', '/api/cart/menu-items/bulk/', self.customer,
+                                         data={'items': entries[:1]}, format='json')
+        self.assertEqual(Cart.objects.get(menuitem=self.menu[0]).quantity, 5)
+
+    def test_bulk_add_rejects_bad_entries(self):
+        for entries in ([], [{'menu_item': self.menu[0].id, 'quantity': 0}], [{'menu_item': 'x', 'quantity': 1}],
+                        [{'menu_item': self.menu[0].id, 'quantity': 1}, {'menu_item': 999, 'quantity': 1}]):
+            response, _ = self.count_queries('post', '/api/cart/menu-items/bulk/', self.customer, data=entries, format='json')
+            self.assertEqual(response.status_code, 400, entries)
+        self.assertEqual(response.data['menu_items'], [999])
+        self.assertFalse(Cart.objects.exists())
+
+    def test_adds_past_the_column_limits_are_rejected(self):
+        Cart.objects.create(user=self.customer, menuitem=self.menu[0], quantity=1, unit_price=5, price=5)
+        # Each entry is valid alone, but together (and with the row in the cart) they'd overflow it
+        for entries in ([{'menu_item': self.menu[1].id, 'quantity': 30000}, {'menu_item': self.menu[1].id, 'quantity': 30000}],
+                        [{'menu_item': self.menu[0].id, 'quantity': 1000}, {'menu_item': self.menu[0].id, 'quantity': 999}],
+                        [{'menu_item': self.menu[2].id, 'quantity': 1}, {'menu_item': self.menu[0].id, 'quantity': 32767}]):
+            response, _ = self.count_queries('post', '/api/cart/menu-items/bulk/', self.customer, data=entries, format='json')
+            self.assertEqual(response.status_code, 400, entries)
+            self.assertEqual(response.data['menu_items'], [entries[-1]['menu_item']])
+        self.assertEqual(list(Cart.objects.values_list('menuitem', 'quantity')), [(self.menu[0].id, 1)])
+
+        # Up to the limit is fine (1 + 1998 at 5.00 = 9995.00)
+        entries = [{'menu_item': self.menu[0].id, 'quantity': 999}, {'menu_item': self.menu[0].id, 'quantity': 999}]
+        response, _ = self.count_queries('post', '/api/cart/menu-items/bulk/', self.customer, data=entries, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # The single item endpoint checks the same limits, whether the item is new or already in the cart
+        for menu_item, quantity in ((self.menu[1].id, 2000), (self.menu[0].id, 1)):
+            response, _ = self.count_queries('post', '/api/cart/menu-items/', self.customer, data={'menu_item': menu_item, 'quantity': quantity})
+            self.assertEqual(response.status_code, 400, menu_item)
+        response, _ = self.count_queries('get', '/api/cart/menu-items/', self.customer)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['quantity'], item['price']) for item in response.data['cart_items']], [(1999, '9995.00')])
+
+
+class QueryPlanTests(LittleLemonTestCase):
+    """
+    Runs the endpoints and EXPLAINs every statement they send. A full scan of
+    the order or menu item tables fails, unless it reads in index order up to
+    a LIMIT (the first page of a listing) without sorting.
+    """
+    scan_pattern = re.compile(r'SCAN (\S+)')
+    guarded_tables = {Order._meta.db_table, ArchivedOrder._meta.db_table, MenuItem._meta.db_table}
+
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.crew = self.make_user('crew', 'delivery-crew')
+        self.customer = self.make_user('customer', 'customer')
+        self.make_orders(self.customer, 3, delivery_crew=self.crew)
+
+    def query_plans(self, method, url, user, **kwargs):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        plans = []
+        for query in ctx.captured_queries:
+            if query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')):
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        return response, plans
+
+    def full_scans(self, sql, plan):
+        limited = ' LIMIT ' in sql and not any('TEMP B-TREE' in step for step in plan)
+        return [
+            step for step in plan
+            if (match := self.scan_pattern.match(step)) and match.group(1) in self.guarded_tables and not limited
+        ]
+
+    def assertNoFullScans(self, method, url, user, **kwargs):
+        response, plans = self.query_plans(method, url, user, **kwargs)
+        for sql, plan in plans:
+            self.assertEqual(self.full_scans(sql, plan), [], f'{method.upper()} {url}: {sql}')
+        return response
+
+    def assertUsesIndex(self, index, method, url, user, **kwargs):
+        _, plans = self.query_plans(method, url, user, **kwargs)
+        self.assertTrue(any(index in step for _, plan in plans for step in plan), f'{index} not used by {url}: {plans}')
+
+    def test_menu(self):
+        for url in ['/api/menu-items/', '/api/menu-items/?category=Mains', '/api/menu-items/?price=6',
+                    '/api/menu-items/?category=Mains&price=6', '/api/menu-items/?search=dish',
+                    f'/api/menu-items/{self.menu[0].id}/']:
+            response = self.assertNoFullScans('get', url, self.customer)
+        response = self.assertNoFullScans('get', '/api/menu-items/?per_page=1', self.customer)
+        self.assertNoFullScans('get', response.data['next'], self.customer)
+
+    def test_orders(self):
+        for user in (self.customer, self.crew, self.manager):
+            for url in ('/api/orders/?per_page=1', '/api/orders/?per_page=1&archived=1'):
+                response = self.assertNoFullScans('get', url, user)
+                self.assertNoFullScans('get', response.data['next'], user)
+        self.assertNoFullScans('get', '/api/orders/export/?status=0', self.manager)
+        self.assertNoFullScans('get', f'/api/orders/export/?user={self.customer.id}&archived=1', self.manager)
+
+        order = Order.objects.first()
+        self.assertNoFullScans('get', f'/api/orders/{order.id}/', self.crew)
+        self.assertNoFullScans('patch', f'/api/orders/{order.id}/', self.crew, data={'status': 1})
+        self.assertNoFullScans('patch', f'/api/orders/{order.id}/', self.manager, data={'delivery_crew': self.crew.id})
+        self.assertNoFullScans('delete', f'/api/orders/{order.id}/', self.manager)
+
+    def test_cart_and_checkout(self):
+        self.assertNoFullScans('post', '/api/cart/menu-items/', self.customer, data={'menu_item': self.menu[0].id, 'quantity': 1})
+        self.assertNoFullScans('post', '/api/cart/menu-items/', self.customer, data={'menu_item': self.menu[0].id, 'quantity': 1})
+        self.assertNoFullScans('post', '/api/cart/menu-items/bulk/', self.customer,
+                               data=[{'menu_item': item.id, 'quantity': 1} for item in self.menu], format='json')
+        self.assertNoFullScans('get', '/api/cart/menu-items/', self.customer)
+        self.assertNoFullScans('post', '/api/orders/', self.customer)
+
+    def test_listings_use_composite_indexes(self):
+        self.assertUsesIndex('order_user_date_idx', 'get', '/api/orders/', self.customer)
+        self.assertUsesIndex('order_crew_date_idx', 'get', '/api/orders/', self.crew)
+        self.assertUsesIndex('archivedorder_user_date_idx', 'get', '/api/orders/?archived=1', self.customer)
+        self.assertUsesIndex('archivedorder_crew_date_idx', 'get', '/api/orders/?archived=1', self.crew)
+        # The sync endpoint reads manager filters from the body; the async one from the query string
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.manager).key}')
+        self.assertUsesIndex('order_status_date_idx', 'get', '/api/async/orders/?status=1', self.manager)
+        self.assertUsesIndex('menuitem_category_price_idx', 'get', '/api/menu-items/?category=Mains&price=6', self.customer)
+
+    def test_detects_a_full_scan(self):
+        def scans(queryset):
+            with connection.cursor() as cursor:
+                sql = str(queryset.query)
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return self.full_scans(sql, [row[-1] for row in cursor.fetchall()])
+
+        self.assertTrue(scans(Order.objects.filter(total__gt=1)))
+        self.assertTrue(scans(MenuItem.objects.order_by('featured', 'title')[:5]))
+        self.assertFalse(scans(MenuItem.objects.order_by('id')[:5]))
+
+
+class BenchmarkTests(LittleLemonTestCase):
+    def test_every_route_runs(self):
+        users = seed_users(20)
+        seed_orders(50, users['customer'], users['delivery-crew'], max_items=3)
+        self.assertEqual(Order.objects.count(), 50)
+        self.assertTrue(User.objects.filter(groups__name='manager').exists())
+
+        output = os.path.join(tempfile.mkdtemp(), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('run_bench', runs=1, warmup=0, output=output, stdout=io.StringIO())
+        with open(output) as file:
+            results = json.load(file)['results']
+        self.assertEqual({result['route'] for result in results} | set(run_bench.NOT_BENCHMARKED),
+                         {pattern.name for pattern in urls.urlpatterns})
+        self.assertEqual([result['name'] for result in results if result['status'] >= 400], [])
+        # Writes were rolled back
+        self.assertEqual(Order.objects.count(), 50)
+
+    def test_refuses_the_project_database(self):
+        with mock.patch.dict(connection.settings_dict, NAME=settings.BASE_DIR / 'db.sqlite3'), \
+                self.assertRaisesMessage(CommandError, "won't run on the project's database"):
+            call_command('run_bench', runs=1, warmup=0, stdout=io.StringIO())
+
+
+@override_settings(ALLOWED_HOSTS=['127.0.0.1'])
+class DeploymentBenchTests(LittleLemonTestMixin, APITransactionTestCase):
+    def bench(self):
+        token = Token.objects.get_or_create(user=self.make_user('customer', 'customer'))[0]
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with local_server() as base_url:
+            call_command('bench_deployments', '/users/users/me', wsgi=base_url, asgi=base_url, token=token.key,
+                         requests=60, concurrency='4', stdout=stdout, stderr=stderr)
+        return stdout.getvalue().splitlines(), stderr.getvalue()
+
+    def test_throttled_responses_are_reported(self):
+        # The 100/day user rate runs out partway through the WSGI run
+        lines, warning = self.bench()
+        self.assertIn('429: ', lines[0])
+        self.assertIn('statuses 429: 60', lines[1])
+        self.assertIn('The asgi and wsgi server answered 429s', warning)
+
+    def test_unthrottled(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': None, 'anon': None}}):
+            lines, warning = self.bench()
+        self.assertEqual([line.split('statuses ')[1] for line in lines], ['200: 60', '200: 60'])
+        self.assertEqual(warning, '')
+
+
+class ServerTimingTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = self.make_user('manager', 'manager')
+        self.make_orders(self.manager, 2)
+
+    def timings(self, response):
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timings[name] = dict(param.split('=', 1) for param in params)
+        return timings
+
+    def test_header_breaks_down_the_request(self):
+        response, queries = self.count_queries('get', '/api/orders/', self.manager)
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'lock', 'serialize', 'render', 'total'})
+        self.assertEqual(timings['db']['desc'], f'"{queries} queries"')
+        for name in ('db', 'serialize', 'render'):
+            self.assertGreater(float(timings[name]['dur']), 0, name)
+        self.assertGreaterEqual(float(timings['total']['dur']), float(timings['db']['dur']))
+
+    async def test_async_views_are_measured(self):
+        # The async client runs the middleware and view through the ASGI handler
+        token = await Token.objects.acreate(user=self.manager)
+        timings = self.timings(await self.async_client.get('/api/async/orders/', headers={'Authorization': f'Token {token.key}'}))
+        self.assertNotEqual(timings['db']['desc'], '"0 queries"')
+        self.assertGreater(float(timings['serialize']['dur']), 0)
+
+    def test_logs(self):
+        with self.assertLogs('LittleLemonAPI.performance', 'INFO') as logs:
+            self.count_queries('get', '/api/orders/', self.manager)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].performance['path'], '/api/orders/')
+        self.assertIn('status=200', logs.output[0])
+
+        with override_settings(SLOW_REQUEST_MS=0), self.assertLogs('LittleLemonAPI.performance', 'WARNING') as logs:
+            self.count_queries('get', '/api/orders/', self.manager)
+        self.assertIn('Slow request: GET /api/orders/', logs.output[0])
+        self.assertIn('FROM "LittleLemonAPI_order"', logs.output[0])
+
+
+class FastSerializerTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('customer', 'customer')
+        MenuItem.objects.create(title='Lemon Tart', price=Decimal('4.5'), featured=True, category=self.category)
+        self.fill_cart(self.customer)
+
+    def assertSameBytes(self, fast, serializer):
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(serializer.data))
+
+    def test_output_is_byte_identical(self):
+        queryset = MenuItem.objects.select_related('category').order_by('id')
+        self.assertSameBytes(menu_item_values.serialize(menu_item_values.values(queryset)),
+                             MenuItemSerializer(queryset, many=True))
+
+        searched = search_menu_items(queryset, 'lemon')
+        self.assertSameBytes(menu_item_values.serialize(menu_item_values.values(searched)),
+                             MenuItemSerializer(searched, many=True))
+
+        cart = Cart.objects.filter(user=self.customer).select_related('menuitem__category')
+        self.assertSameBytes(cart_values.serialize(cart_values.values(cart)), CartSerializer(cart, many=True))
+
+    def test_related_rows_are_read_in_the_same_query(self):
+        # The roles lookup, then one query for the rows (page numbers add a COUNT)
+        for url, expected in (('/api/menu-items/?per_page=10', 2), ('/api/menu-items/?page=1', 3),
+                              (f'/api/menu-items/{self.menu[0].id}/', 2), ('/api/cart/menu-items/', 2)):
+            cache.clear()
+            response, queries = self.count_queries('get', url, self.customer)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(queries, expected, url)
+
+    def test_unsupported_serializers_are_rejected(self):
+        with self.assertRaises(TypeError):
+            ValuesSerializer(OrderSerializer)
+
+
+class DatabaseTuningTests(LittleLemonTestCase):
+    def test_pragmas_are_applied_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = connections['default'].__class__({**connection.settings_dict, 'NAME': os.path.join(directory, 'tuned.sqlite3')})
+            try:
+                with wrapper.cursor() as cursor:
+                    pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in settings.SQLITE_PRAGMAS}
+            finally:
+                wrapper.close()
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+        self.assertEqual(pragmas['busy_timeout'], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_journal_mode_is_left_alone_on_the_checked_in_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checked-in.sqlite3')
+            sqlite3.connect(path).close()
+            with override_settings(SQLITE_KEEP_JOURNAL_MODE=[path]):
+                wrapper = connections['default'].__class__({**connection.settings_dict, 'NAME': path})
+                try:
+                    with wrapper.cursor() as cursor:
+                        journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+                        busy_timeout = cursor.execute('PRAGMA busy_timeout').fetchone()[0]
+                finally:
+                    wrapper.close()
+        self.assertEqual(journal_mode, 'delete')
+        self.assertEqual(busy_timeout, settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_everything_uses_the_primary_without_a_replica(self):
+        if replica_alias() is None:
+            self.assertEqual(router.db_for_read(MenuItem), 'default')
+        self.assertEqual(router.db_for_write(MenuItem), 'default')
+
+
+@override_settings(REPLICA_DATABASE=None)  # the menu is read from the primary, which the other process edits
+class SharedCacheTests(LittleLemonTestMixin, APITransactionTestCase):
+    # Each gunicorn worker is a separate process, so changes made in one have
+    # to reach what the others have cached
+
+    def in_another_process(self, code):
+        env = {**os.environ, 'LITTLELEMON_DB': str(connection.settings_dict['NAME']), 'LITTLELEMON_CACHE_DIR': self.cache_dir}
+        env.pop('LITTLELEMON_REDIS_URL', None)
+        subprocess.run([sys.executable, 'manage.py', 'shell', '-c', code], cwd=settings.BASE_DIR, env=env,
+                       check=True, capture_output=True)
+
+    def test_revoking_a_token_in_another_process(self):
+        customer = self.make_user('customer', 'customer')
+        token = Token.objects.create(user=customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.client.get('/api/users/users/me').status_code, 200)  # cached from here on
+
+        self.in_another_process(f'from rest_framework.authtoken.models import Token; Token.objects.filter(key={token.key!r}).delete()')
+        self.assertEqual(self.client.get('/api/users/users/me').status_code, 401)
+
+    def test_menu_changes_in_another_process(self):
+        self.client.force_authenticate(self.make_user('customer', 'customer'))
+        etag = self.client.get('/api/menu-items/')['ETag']
+
+        self.in_another_process(f'from LittleLemonAPI.models import MenuItem; MenuItem.objects.get(id={self.menu[0].id}).save()')
+        self.assertEqual(self.client.get('/api/menu-items/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ConcurrentCheckoutTests(LittleLemonTestMixin, APITransactionTestCase):
+    def test_simultaneous_checkouts_create_one_order(self):
+        customer = self.make_user('customer', 'customer')
+        self.fill_cart(customer)
+        barrier = threading.Barrier(2)
+        results = []
+
+        def checkout():
+            client = APIClient()
+            client.force_authenticate(customer)
+            barrier.wait()
+            try:
+                results.append(client.post('/api/orders/').status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results)[0], 201)
+        self.assertIn(sorted(results)[1], (400, 409))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertFalse(Cart.objects.exists())
+
+
+class ConcurrentCartTests(LittleLemonTestMixin, APITransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        # Threads sharing an in-memory test database fail with "table is locked"
+        # instead of waiting their turn, so this only holds on a file (DATABASES TEST NAME)
+        self.assertFalse(connection.is_in_memory_db(), 'the concurrency tests need a file test database')
+
+    def test_simultaneous_adds_keep_every_increment(self):
+        customer = self.make_user('customer', 'customer')
+        Cart.objects.create(user=customer, menuitem=self.menu[0], quantity=1, unit_price=5, price=5)
+        barrier = threading.Barrier(4)
+        results = []
+
+        def add():
+            client = APIClient()
+            client.force_authenticate(customer)
+            barrier.wait()
+            try:
+                for url, data in (('/api/cart/menu-items/', {'menu_item': self.menu[0].id, 'quantity': 1}),
+                                  ('/api/cart/menu-items/bulk/', [{'menu_item': self.menu[0].id, 'quantity': 1}])):
+                    results.append(client.post(url, data, format='json').status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [200] * 8)
+        cart_item = Cart.objects.get()
+        self.assertEqual((cart_item.quantity, cart_item.price), (9, Decimal('45.00')))
+
+
+@skipUnless(replica_alias(), 'set LITTLELEMON_REPLICA_DB to test the read replica')
+class ReplicaRoutingTests(LittleLemonTestMixin, APITransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('customer', 'customer')
+        self.client.force_authenticate(self.customer)
+
+    def menu_titles(self):
+        cache.clear()
+        return [item['title'] for item in self.client.get('/api/menu-items/').data['menu_items']]
+
+    def test_listings_read_from_the_replica(self):
+        # The replica is empty until it's synced
+        self.assertEqual(self.menu_titles(), [])
+        call_command('sync_replica', stdout=io.StringIO())
+        self.assertEqual(self.menu_titles(), ['Dish 0', 'Dish 1', 'Dish 2'])
+
+    def test_writers_read_their_own_writes(self):
+        call_command('sync_replica', stdout=io.StringIO())
+        self.make_orders(self.customer, 1)
+        self.assertEqual(len(self.client.get('/api/orders/').data['orders']), 0)
+
+        # After a write the user's reads go to the primary for a while
+        self.assertEqual(self.client.post('/api/cart/menu-items/', {'menu_item': self.menu[0].id, 'quantity': 1}).status_code, 201)
+        self.assertEqual(len(self.client.get('/api/orders/').data['orders']), 1)
+        self.assertEqual(len(self.menu_titles()), 3)
+
+        cache.clear()
+        self.assertEqual(len(self.client.get('/api/orders/').data['orders']), 0)
+
+
+class TaskWorkerTests(LittleLemonTestMixin, APITransactionTestCase):
+    def test_run_tasks_burst(self):
+        customer = self.make_user('customer', 'customer')
+        for _ in range(3):
+            self.fill_cart(customer)
+            self.count_queries('post', '/api/orders/', customer)
+        for slug in ('sides', 'drinks', 'desserts'):
+            enqueue(add_category, slug=slug)
+
+        out = io.StringIO()
+        call_command('run_tasks', '--burst', '--threads', '3', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Ran 6 tasks.')
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 6)
+        self.assertEqual(Category.objects.filter(slug__in=['sides', 'drinks', 'desserts']).count(), 3)
+        self.assertEqual(self.rollups()[0][0][2:], (6, Decimal('30.00')))
+
+
+# An unsynced replica would answer the scripts' reads from an empty database
+@override_settings(REPLICA_DATABASE=None)
+class LoadTestTests(LittleLemonTestMixin, APITransactionTestCase):
+    def hold_write_lock(self, seconds):
+        # Another process's writer, which commits after `seconds`
+        holder = sqlite3.connect(settings.DATABASES['default']['NAME'], check_same_thread=False)
+        holder.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(seconds, holder.commit)
+        timer.start()
+        self.addCleanup(holder.close)
+        self.addCleanup(timer.join)
+
+    def test_scripts_run_against_a_local_server(self):
+        tokens = loadtest.load_users({'customer': 3, 'delivery-crew': 1, 'manager': 1})
+        self.assertEqual(loadtest.load_users({'customer': 3}), {'customer': tokens['customer']})
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': None, 'anon': None}}
+        with override_settings(REST_FRAMEWORK=rest_framework, ALLOWED_HOSTS=['127.0.0.1']), local_server() as base_url:
+            results, elapsed = loadtest.run_load(base_url, tokens, [item.id for item in self.menu], duration=1)
+        summary = results.summary(elapsed)
+
+        self.assertEqual(summary['total']['errors'], 0, summary['steps'])
+        self.assertGreater(summary['checkouts'], 0)
+        self.assertEqual(Order.objects.count(), summary['checkouts'])
+        self.assertLessEqual({'browse menu', 'add to cart', 'checkout', 'assigned orders', 'dispatch'}, set(summary['steps']))
+        self.assertGreater(summary['total']['per_second'], 0)
+
+    def test_load_users_are_deleted_after_loading_a_server(self):
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'user': None, 'anon': None}}
+        with override_settings(REST_FRAMEWORK=rest_framework, ALLOWED_HOSTS=['127.0.0.1']), local_server() as base_url:
+            call_command('loadtest', url=base_url, customers=2, crew=1, managers=1, duration=0.5, stdout=io.StringIO())
+        self.assertFalse(User.objects.filter(username__startswith='load-').exists())
+        self.assertFalse(Token.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_lock_wait_is_reported(self):
+        customer = self.make_user('customer', 'customer')
+        self.fill_cart(customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=customer).key}')
+        self.hold_write_lock(0.3)
+        response = self.client.post('/api/orders/')
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(loadtest.lock_wait(response['Server-Timing']), 200)
+        self.assertEqual(loadtest.lock_wait('db;dur=1.5, total;dur=2'), 0.0)
+
+    def test_worker_outlasts_a_locked_database(self):
+        enqueue(add_category, slug='sides')
+        self.hold_write_lock(0.3)
+        worker = Worker(threads=1, poll=0.05, burst=True)
+        with override_settings(SQLITE_PRAGMAS={'busy_timeout': 0}), self.assertLogs('LittleLemonAPI.tasks', 'WARNING') as logs:
+            thread = threading.Thread(target=lambda: (worker.run(), connections.close_all()))
+            thread.start()
+            thread.join()
+        self.assertIn('database is locked', logs.output[0])
+        self.assertTrue(Category.objects.filter(slug='sides').exists())
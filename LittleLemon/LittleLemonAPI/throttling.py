@@ -0,0 +1,156 @@
+"""
+Throttles whose counters live in a small SQLite file instead of the process
+local cache, so every worker process (and thread) enforces the same limit.
+
+Each throttle key is a single token bucket row (tokens left + last refill
+time), updated with one atomic INSERT ... ON CONFLICT DO UPDATE statement,
+instead of DRF's pickled list of request timestamps.
+"""
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import AnonRateThrottle, SimpleRateThrottle, UserRateThrottle
+
+
+CREATE_SQL = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    expires REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID
+'''
+
+# Refill the bucket for the time since the last request, then take a token if
+# there is a whole one. All right-hand sides see the row as it was before.
+CONSUME_SQL = '''
+INSERT INTO buckets (key, tokens, updated, expires, allowed)
+VALUES (:key, :capacity - 1, :now, :now + :capacity / :rate, 1)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = MIN(:capacity, tokens + MAX(0, :now - updated) * :rate)
+             - (MIN(:capacity, tokens + MAX(0, :now - updated) * :rate) >= 1),
+    allowed = MIN(:capacity, tokens + MAX(0, :now - updated) * :rate) >= 1,
+    updated = :now,
+    expires = :now + :capacity / :rate
+RETURNING allowed, tokens
+'''
+
+# A bucket past its expiry time would be full again, so it can be forgotten
+PRUNE_SQL = 'DELETE FROM buckets WHERE expires < :now'
+PRUNE_PROBABILITY = 0.001
+
+
+class TokenBucketStore:
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(CREATE_SQL)
+            self.local.connection = connection
+        return connection
+
+    def consume(self, key, capacity, rate, now=None):
+        """
+        Takes one token from the bucket `key`, which holds up to `capacity`
+        tokens and refills at `rate` tokens per second. Returns whether a token
+        was available, and how many tokens are left.
+        """
+        now = time.time() if now is None else now
+        params = {'key': key, 'capacity': float(capacity), 'rate': float(rate), 'now': now}
+        allowed, tokens = self.connection.execute(CONSUME_SQL, params).fetchone()
+        if random.random() < PRUNE_PROBABILITY:
+            self.connection.execute(PRUNE_SQL, {'now': now})
+        return bool(allowed), tokens
+
+    def clear(self):
+        self.connection.execute('DELETE FROM buckets')
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    path = str(settings.THROTTLE_STORE_PATH)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = TokenBucketStore(path)
+        return _stores[path]
+
+
+class SharedRateThrottleMixin:
+    """Makes a SimpleRateThrottle keep its history in the shared token bucket store."""
+    def get_rate(self):
+        # DRF copies the rates onto the class at import; read them per request
+        # so override_settings (and the benchmarks) can change or lift them
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.refill_rate = self.num_requests / self.duration
+        allowed, self.tokens = get_store().consume(self.key, self.num_requests, self.refill_rate)
+        return allowed
+
+    def wait(self):
+        # Seconds until the next whole token
+        return max(0.0, (1 - self.tokens) / self.refill_rate)
+
+
+class SharedUserRateThrottle(SharedRateThrottleMixin, UserRateThrottle):
+    pass
+
+
+class SharedAnonRateThrottle(SharedRateThrottleMixin, AnonRateThrottle):
+    pass
+
+
+class SharedEndpointRateThrottle(SharedRateThrottleMixin, SimpleRateThrottle):
+    """
+    Per-endpoint limits, on top of the user/anon ones. Rates are set in
+    DEFAULT_THROTTLE_RATES under '<url name>:<HTTP method>', for example
+    'manage_order:POST'. Endpoints without a rate are not limited.
+    """
+    def __init__(self):
+        # The scope depends on the request, so the rate is looked up in allow_request
+        self.rate = None
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        if not match or not match.url_name:
+            return True
+
+        self.scope = f'{match.url_name}:{request.method}'
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
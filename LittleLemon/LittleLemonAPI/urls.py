@@ -1,15 +1,28 @@
 from django.urls import path 
-from . import views
+from . import async_views, views
 
 
 urlpatterns = [
-    path('users/', views.users),
-    path('users/users/me', views.display_current_user),
-    path('menu-items/', views.menu_items),
+    path('users/', views.users, name='users'),
+    path('users/users/me', views.display_current_user, name='current_user'),
+    path('menu-items/', views.menu_items, name='menu_items'),
+    path('menu-items/bulk/', views.menu_items_bulk, name='menu_items_bulk'),
     path('menu-items/<int:menuItem>/', views.menu_item_detail, name='menu_item_detail'),
     path('groups/<str:group_name>/users', views.group_user, name='group_user'),
     path('groups/<str:group_name>/users/<int:user_id>/', views.remove_user_from_group, name='remove_user_from_group'),
     path('cart/menu-items/', views.manage_cart, name='manage_cart'),
+    path('cart/menu-items/bulk/', views.manage_cart_bulk, name='manage_cart_bulk'),
     path('orders/', views.manage_order, name='manage_order'),
+    path('orders/bulk/', views.manage_orders_bulk, name='manage_orders_bulk'),
+    path('orders/events/', views.order_events, name='order_events'),
+    path('orders/export/', views.export_orders, name='export_orders'),
     path('orders/<int:order_id>/', views.manager_specific_order, name='manager_specific_order'),
+    path('reports/', views.sales_reports, name='sales_reports'),
+    # Async versions of the read endpoints, for ASGI deployments
+    path('async/users/users/me', async_views.display_current_user, name='async_current_user'),
+    path('async/menu-items/', async_views.menu_items, name='async_menu_items'),
+    path('async/menu-items/<int:menuItem>/', async_views.menu_item_detail, name='async_menu_item_detail'),
+    path('async/orders/', async_views.orders, name='async_orders'),
+    path('async/orders/events/', async_views.order_events, name='async_order_events'),
+    path('async/orders/events/stream/', async_views.order_event_stream, name='async_order_event_stream'),
 ]
\ No newline at end of file
@@ -1,13 +1,40 @@
+import csv
+from datetime import datetime, timedelta
+
 from django.shortcuts import render
-from .models import User, MenuItem, Group, Cart, OrderItem, Order
+from django.http import StreamingHttpResponse
+from .models import User, MenuItem, Group, Cart, OrderItem, Order, OrderEvent
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.decorators import permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.decorators import permission_classes
 from rest_framework import status
-from .serializers import MenuItemSerializer, CartSerializer
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
+from .archive import order_model
+from .authentication import cache_token
+from .cart import CartLimitError, add_cart_item, add_cart_items, increment_cart_item
+from .db import replica_reads
+from .dispatch import assign_orders, auto_dispatch, set_orders_status
+from .events import latest_event_id, order_event, parse_cursor, publish, wait_for_events, wait_timeout
+from .exports import EXPORT_FORMATS
+from .fast_serializers import cart_values, menu_item_values
+from .reports import record_order, record_order_update, record_order_deleted, sales_report
+from .menu_import import import_menu, parse_menu_file
+from .menu_cache import MENU_CACHE_TIMEOUT, menu_cache_entry, is_not_modified
+from .search import search_menu_items
+from .snapshots import build_snapshot, order_data, refresh_snapshot, snapshot_rows
+from .throttling import SharedEndpointRateThrottle
+from .permissions import IsAuthenticatedWithRoles, get_roles
+from .serializers import MenuItemSerializer, CartSerializer, CartEntrySerializer, OrderSerializer, CustomerOrderSerializer, OrderDetailSerializer, OrderBulkUpdateSerializer, OrderFilterSerializer, requested_fields
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, transaction
+from django.db.models import F, Sum
+from django.core.cache import cache
 from rest_framework.pagination import PageNumberPagination
+from .pagination import MenuItemPagination, OrderPagination
 
 @api_view(['POST'])
 def users(request):
@@ -29,36 +56,68 @@ def display_current_user(request):
     return Response({'username': user.username, 'email': user.email})
 
 
-@api_view(['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
-@permission_classes([IsAuthenticated])
-def menu_items(request):
-    if request.method == 'GET' and request.user.groups.filter(name__in=['customer', 'delivery-crew', 'manager']).exists():
-        queryset = MenuItem.objects.all().order_by('id')
+def filter_menu_items(params):
+    queryset = MenuItem.objects.select_related('category').order_by('id')
+
+    title = params.get('title')
+    price_lte = params.get('price')
+    category = params.get('category')
+    search = params.get('search')
 
-        title = request.query_params.get('title')
-        price_lte = request.query_params.get('price')
-        category = request.query_params.get('category')
+    if title:
+        queryset = queryset.filter(title__icontains=title)
+    if price_lte:
+        queryset = queryset.filter(price__lte=price_lte)
+    if category:
+        queryset = queryset.filter(category__title=category)
+    if search:
+        queryset = search_menu_items(queryset, search)
+    return queryset
 
-        if title:
-            queryset = queryset.filter(title__icontains=title)
-        if price_lte:
-            queryset = queryset.filter(price__lte=price_lte)
-        if category:
-            queryset = queryset.filter(category__title=category)
 
+def uses_page_numbers(params):
+    # Page numbers are still accepted for older clients, and search
+    # results are ordered by relevance which cursors can't follow
+    return 'page' in params or bool(params.get('search'))
 
-        # Apply Pagination
+
+def menu_page(request):
+    queryset = filter_menu_items(request.query_params)
+    menu_values = menu_item_values.only(requested_fields(request.query_params, MenuItemSerializer))
+
+    # Apply Pagination
+    if uses_page_numbers(request.query_params):
         page_number = request.query_params.get('page', 1)
         per_page = request.query_params.get('per_page', 3)
         paginator = PageNumberPagination()
         paginator.page = page_number  # Set the current page
         paginator.page_size = per_page  # Set the page size
-        paginated_queryset = paginator.paginate_queryset(queryset, request)
-        
-        serializer = MenuItemSerializer(paginated_queryset, many=True)
-        return Response({'menu_items': serializer.data}, status=status.HTTP_200_OK)
+        paginated_queryset = paginator.paginate_queryset(menu_values.values(queryset), request)
+
+        return {'menu_items': menu_values.serialize(paginated_queryset)}
+
+    paginator = MenuItemPagination()
+    paginated_queryset = paginator.paginate_queryset(menu_values.values(queryset), request)
 
-    if request.method == 'POST' and request.user.groups.filter(name='manager').exists():
+    return paginator.get_paginated_data(menu_values.serialize(paginated_queryset))
+
+
+@api_view(['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticatedWithRoles])
+@replica_reads
+def menu_items(request):
+    if request.method == 'GET' and request.roles & {'customer', 'delivery-crew', 'manager'}:
+        cache_key, etag = menu_cache_entry(request, 'list')
+        if is_not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = cache.get(cache_key)
+        if data is None:
+            data = menu_page(request)
+            cache.set(cache_key, data, MENU_CACHE_TIMEOUT)
+        return Response(data, status=status.HTTP_200_OK, headers={'ETag': etag})
+
+    if request.method == 'POST' and 'manager' in request.roles:
         serializer = MenuItemSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
@@ -70,15 +129,50 @@ def menu_items(request):
 
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticatedWithRoles])
+def menu_items_bulk(request):
+    if 'manager' not in request.roles:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+    # A JSON list of items ({"items": [...]} works too), or a CSV/JSON upload in "file"
+    upload = request.FILES.get('file')
+    if upload:
+        file_format = 'csv' if upload.name.lower().endswith('.csv') else 'json'
+        try:
+            rows = parse_menu_file(upload.read().decode('utf-8-sig'), file_format)
+        except (ValueError, csv.Error) as error:
+            return Response({'error': f'Could not read the file: {error}'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        rows = request.data.get('items') if hasattr(request.data, 'get') else request.data
+    if not isinstance(rows, list):
+        return Response({'error': 'Expected a list of menu items'}, status=status.HTTP_400_BAD_REQUEST)
+
+    created, updated, errors = import_menu(rows)
+    if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'message': 'Menu imported successfully', 'created': created, 'updated': updated}, status=status.HTTP_200_OK)
+
+
+
 @api_view(['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedWithRoles])
+@replica_reads
 def menu_item_detail(request, menuItem):
-    if request.method == 'GET' and request.user.groups.filter(name__in=['customer', 'delivery-crew', 'manager']).exists():
-        menu_items = MenuItem.objects.filter(id=menuItem)
-        serializer = MenuItemSerializer(menu_items, many=True)
-        return Response({'menu_items': serializer.data}, status=status.HTTP_200_OK)
+    if request.method == 'GET' and request.roles & {'customer', 'delivery-crew', 'manager'}:
+        cache_key, etag = menu_cache_entry(request, 'detail', id=menuItem)
+        if is_not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = cache.get(cache_key)
+        if data is None:
+            menu_values = menu_item_values.only(requested_fields(request.query_params, MenuItemSerializer))
+            menu_items = menu_values.values(MenuItem.objects.filter(id=menuItem))
+            data = {'menu_items': menu_values.serialize(menu_items)}
+            cache.set(cache_key, data, MENU_CACHE_TIMEOUT)
+        return Response(data, status=status.HTTP_200_OK, headers={'ETag': etag})
     
-    if request.method in ['PUT', 'PATCH', 'DELETE'] and request.user.groups.filter(name='manager').exists():
+    if request.method in ['PUT', 'PATCH', 'DELETE'] and 'manager' in request.roles:
         menu_item = MenuItem.objects.filter(id=menuItem).first()
         if not menu_item:
             return Response({'error': 'Menu item not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -99,18 +193,18 @@ def menu_item_detail(request, menuItem):
     return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
 @api_view(['GET', 'POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedWithRoles])
 def group_user(request, group_name):
     if group_name not in ['manager', 'delivery-crew'] or not Group.objects.filter(name=group_name).exists():
         return Response({'error': 'Invalid group name'}, status=status.HTTP_400_BAD_REQUEST)
     
-    if request.method == 'GET' and request.user.groups.filter(name='manager').exists():
+    if request.method == 'GET' and 'manager' in request.roles:
         # display all users in the specified group
         users = User.objects.filter(groups__name=group_name)
         user_data = [{'id': user.id, 'username': user.username, 'email': user.email} for user in users]
         return Response({'users': user_data}, status=status.HTTP_200_OK)
 
-    if request.method == 'POST' and request.user.groups.filter(name='manager').exists():
+    if request.method == 'POST' and 'manager' in request.roles:
         # Assign the user in the payload to the Manager group
         user_id = request.data.get('user_id')
         if not user_id:
@@ -126,9 +220,9 @@ def group_user(request, group_name):
 
 
 @api_view(['DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedWithRoles])
 def remove_user_from_group(request, group_name, user_id):
-    if not request.user.groups.filter(name='manager').exists():
+    if 'manager' not in request.roles:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
     user = User.objects.filter(id=user_id).first()
@@ -144,31 +238,32 @@ def remove_user_from_group(request, group_name, user_id):
 
 
 @api_view(['POST', 'GET', 'DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedWithRoles])
 def manage_cart(request):
-    if not request.user.groups.filter(name='customer').exists():
+    if 'customer' not in request.roles:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
     
     if request.method == 'POST':
-        # check if item is in the cart, if so add its quantity to the existing item
+        # if the item is already in the cart, add one to its quantity
         menu_item = request.data.get('menu_item')
-        cart_item = Cart.objects.filter(user=request.user, menuitem=menu_item).first()
-        if cart_item:
-            cart_item.quantity += 1
-            cart_item.price = cart_item.quantity * cart_item.unit_price
-            cart_item.save()
-            return Response({'message': 'Item quantity updated', 'cart_item': CartSerializer(cart_item).data}, status=status.HTTP_200_OK)
+        if str(menu_item).isdigit() and increment_cart_item(request.user, menu_item):
+            return Response({'message': 'Item quantity updated', 'cart_item': CartSerializer(get_cart_item(request.user, menu_item)).data}, status=status.HTTP_200_OK)
 
         serializer = CartSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(user=request.user)
-            return Response({'message': 'Item added to cart', 'cart_item': serializer.data}, status=status.HTTP_201_CREATED)
+            try:
+                created = add_cart_item(serializer, request.user)
+            except CartLimitError as error:
+                return Response({'error': str(error), 'menu_items': error.menu_items}, status=status.HTTP_400_BAD_REQUEST)
+            if created:
+                return Response({'message': 'Item added to cart', 'cart_item': serializer.data}, status=status.HTTP_201_CREATED)
+            # a concurrent request added it first
+            return Response({'message': 'Item quantity updated', 'cart_item': CartSerializer(get_cart_item(request.user, menu_item)).data}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     if request.method == 'GET':
-        cart_items = Cart.objects.filter(user=request.user)
-        serializer = CartSerializer(cart_items, many=True)
-        return Response({'cart_items': serializer.data}, status=status.HTTP_200_OK)
+        cart = cart_values.only(requested_fields(request.query_params, CartSerializer))
+        return Response({'cart_items': cart.serialize(cart.values(Cart.objects.filter(user=request.user)))}, status=status.HTTP_200_OK)
     
 
     if request.method == 'DELETE': # Delete all records in the Cart registerd by that user
@@ -181,192 +276,323 @@ def manage_cart(request):
 
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticatedWithRoles])
+def manage_cart_bulk(request):
+    if 'customer' not in request.roles:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+    # Accepts a list of {menu_item, quantity} entries, or {"items": [...]}
+    entries = request.data.get('items') if hasattr(request.data, 'get') else request.data
+    serializer = CartEntrySerializer(data=entries, many=True, allow_empty=False)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        missing = add_cart_items(request.user, [(entry['menu_item'], entry['quantity']) for entry in serializer.validated_data])
+    except CartLimitError as error:
+        return Response({'error': str(error), 'menu_items': error.menu_items}, status=status.HTTP_400_BAD_REQUEST)
+    if missing:
+        return Response({'error': 'Menu items not found', 'menu_items': missing}, status=status.HTTP_400_BAD_REQUEST)
+
+    cart_items = Cart.objects.filter(user=request.user).select_related('menuitem__category')
+    return Response({'message': 'Items added to cart', 'cart_items': CartSerializer(cart_items, many=True).data}, status=status.HTTP_200_OK)
+
+
+def get_cart_item(user, menu_item):
+    return Cart.objects.select_related('menuitem__category').get(user=user, menuitem=menu_item)
+
+
+def filter_orders(orders, params):
+    # Raises a ValidationError (400) for filters that don't parse. The
+    # serializer gets a plain dict: given a QueryDict, a missing BooleanField
+    # would read as False, like an unticked HTML checkbox
+    serializer = OrderFilterSerializer(data=dict(params.items()))
+    serializer.is_valid(raise_exception=True)
+    filters = serializer.validated_data
+
+    if 'date' in filters:
+        # Orders placed that day, as a range so the date index still applies
+        start = timezone.make_aware(datetime.combine(filters['date'], datetime.min.time()))
+        orders = orders.filter(date__gte=start, date__lt=start + timedelta(days=1))
+    if 'status' in filters:
+        # status=True compiles to a bare WHERE "status", which can't use an index; IN can
+        orders = orders.filter(status__in=[filters['status']])
+    if 'total' in filters:
+        orders = orders.filter(total__lte=filters['total'])
+    if 'user' in filters:
+        orders = orders.filter(user__id=filters['user'])
+    if 'delivery_crew' in filters:
+        orders = orders.filter(delivery_crew__id=filters['delivery_crew'])
+    return orders
+
+
+def paginated_orders(request, orders, serializer_class):
+    # Orders are read from their snapshots, one row each, without joining the items
+    fields = requested_fields(request.query_params, serializer_class)
+    paginator = OrderPagination()
+    page = paginator.paginate_queryset(snapshot_rows(orders, fields), request)
+    return paginator.get_paginated_response(order_data(page, serializer_class, fields))
+
+
 @api_view(['GET', 'POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedWithRoles])
+@replica_reads
 def manage_order(request):
-    if not request.user.groups.filter(name__in=['customer', 'manager', 'delivery-crew']).exists():
+    if not request.roles & {'customer', 'manager', 'delivery-crew'}:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
-    if request.method == 'GET' and request.user.groups.filter(name='manager').exists():
+    if request.method == 'GET' and 'manager' in request.roles:
         # Returns all orders with order items created by all users
-        # Apply filtering and searching
-
-        date = request.data.get('date')
-        status_got = request.data.get('status')
-        total_lte = request.data.get('total')
-        user = request.data.get('user')
-        delivery_crew = request.data.get('delivery_crew')
-
-        orders = Order.objects.all()
-
-        if date:
-            orders = orders.filter(date=date)
-        if status_got:
-            orders = orders.filter(status=status_got)
-        if total_lte:
-            orders = orders.filter(total__lte=total_lte)
-        if user:
-            orders = orders.filter(user__id=user)  # or user__username if using usernames
-        if delivery_crew:
-            orders = orders.filter(delivery_crew__id=delivery_crew)  # or delivery_crew__username
-
-        order_data = []
-        for order in orders:
-            order_items = OrderItem.objects.filter(order=order)
-            item_data = []
-            for item in order_items:
-                item_data.append({
-                    'menuitem': item.menuitem.title,
-                    'quantity': item.quantity,
-                    'unit_price': item.unit_price,
-                    'price': item.price
-                })
-            order_data.append({
-                'order_id': order.id,
-                'user': order.user.username,
-                'total': order.total,
-                'date': order.date,
-                'items': item_data
-            })
-        return Response({'orders': order_data}, status=status.HTTP_200_OK)
+        # Filters come from the query string; ?archived=1 adds the archived orders
+        orders = filter_orders(order_model(request.query_params).objects.all(), request.query_params)
+        return paginated_orders(request, orders, OrderSerializer)
     
-    if request.method == 'GET' and request.user.groups.filter(name='delivery-crew').exists():
+    if request.method == 'GET' and 'delivery-crew' in request.roles:
         # Returns all orders with order items assigned to the delivery crew
-        orders = Order.objects.filter(delivery_crew=request.user)
-        order_data = []
-        for order in orders:
-            order_items = OrderItem.objects.filter(order=order)
-            item_data = []
-            for item in order_items:
-                item_data.append({
-                    'menuitem': item.menuitem.title,
-                    'quantity': item.quantity,
-                    'unit_price': item.unit_price,
-                    'price': item.price
-                })
-            order_data.append({
-                'order_id': order.id,
-                'user': order.user.username,
-                'total': order.total,
-                'date': order.date,
-                'items': item_data
-            })
-        return Response({'orders': order_data}, status=status.HTTP_200_OK)
+        orders = order_model(request.query_params).objects.filter(delivery_crew=request.user)
+        return paginated_orders(request, orders, OrderSerializer)
 
     if request.method == 'POST':
         # Logic to create an order
         """
         Creates a new order item for the current user. Gets current cart items from the cart endpoints and adds those items to the order items table. Then deletes all items from the cart for this user.
         """
-        cart_items = Cart.objects.filter(user=request.user)
-        if not cart_items.exists():
-            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
-
-        order = Order.objects.create(
-            user=request.user,
-            total=0,  # Assuming total is the sum of all items in the cart
-            date=timezone.now()  # Assuming date is the current date
-        )
-
-        total_price = 0
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                menuitem=item.menuitem,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                price=item.price
-            )
-            total_price = total_price + item.price
-
-        order.total = total_price
-        order.save()
-
-        cart_items.delete()
+        try:
+            with transaction.atomic():
+                # Lock the cart rows, so a second checkout of the same cart waits for this one
+                cart_items = list(
+                    Cart.objects.select_for_update()
+                    .filter(user=request.user)
+                    .values('id', 'menuitem_id', 'quantity', 'unit_price', 'price', title=F('menuitem__title'))
+                )
+                if not cart_items:
+                    return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+                total_price = Cart.objects.filter(user=request.user).aggregate(total=Sum('price'))['total']
+
+                # Claim the cart before writing the order. If another checkout already
+                # took some of these rows, roll back without creating anything
+                deleted, _ = Cart.objects.filter(id__in=[item['id'] for item in cart_items]).delete()
+                if deleted != len(cart_items):
+                    transaction.set_rollback(True)
+                    return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+                order = Order.objects.create(
+                    user=request.user, total=total_price, date=timezone.now(),
+                    snapshot=build_snapshot(request.user.username, total_price, False, None, cart_items),
+                )
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        menuitem_id=item['menuitem_id'],
+                        quantity=item['quantity'],
+                        unit_price=item['unit_price'],
+                        price=item['price']
+                    )
+                    for item in cart_items
+                ])
+                record_order(order, cart_items)
+                publish(order_event(OrderEvent.CREATED, order))
+        except OperationalError as error:
+            # SQLite can't queue writers like SELECT ... FOR UPDATE does, the losing
+            # checkout gets "database is locked" instead
+            if 'locked' not in str(error):
+                raise
+            return Response({'error': 'Checkout already in progress'}, status=status.HTTP_409_CONFLICT)
+
         return Response({'message': 'Order created successfully'}, status=status.HTTP_201_CREATED)
 
     if request.method == 'GET':
         # Returns all orders with order items created by this user
-        orders = Order.objects.filter(user=request.user)
-        order_data = []
-        for order in orders:
-            order_items = OrderItem.objects.filter(order=order)
-            item_data = []
-            for item in order_items:
-                item_data.append({
-                    'menuitem': item.menuitem.title,
-                    'quantity': item.quantity,
-                    'unit_price': item.unit_price,
-                    'price': item.price
-                })
-            order_data.append({
-                'order_id': order.id,
-                'total': order.total,
-                'date': order.date,
-                'items': item_data
-            })
-        return Response({'orders': order_data}, status=status.HTTP_200_OK)
+        orders = order_model(request.query_params).objects.filter(user=request.user)
+        return paginated_orders(request, orders, CustomerOrderSerializer)
 
     return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
 
 
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedWithRoles])
 def manager_specific_order(request, order_id):
-    if request.method == 'GET' and request.user.groups.filter(name='delivery-crew').exists():
-        if not Order.objects.filter(id=order_id, delivery_crew=request.user).exists():
+    if request.method == 'GET' and 'delivery-crew' in request.roles:
+        fields = requested_fields(request.query_params, OrderDetailSerializer)
+        orders = order_model(request.query_params).objects.filter(id=order_id, delivery_crew=request.user)
+        rows = list(snapshot_rows(orders, fields))
+        if not rows:
             return Response({'error': 'Order not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
-        
-        order = Order.objects.get(id=order_id, delivery_crew=request.user)
-        order_items = OrderItem.objects.filter(order=order)
-        item_data = []
-
-        for item in order_items:
-            item_data.append({
-                'menuitem': item.menuitem.title,
-                'quantity': item.quantity,
-                'unit_price': item.unit_price,
-                'price': item.price
-            })
-
-        return Response({'order_id': order.id, 'items': item_data}, status=status.HTTP_200_OK)
+
+        return Response(order_data(rows, OrderDetailSerializer, fields)[0], status=status.HTTP_200_OK)
     
 
-    if request.method == 'PATCH' and request.user.groups.filter(name='delivery-crew').exists():
+    if request.method == 'PATCH' and 'delivery-crew' in request.roles:
         status_data = request.data.get('status')
         if not status_data:
             return Response({'error': 'Unauthorized Update'})
 
-        order = Order.objects.filter(id=order_id).first()
-        if not order:
-            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            status_data = Order._meta.get_field('status').to_python(status_data)
+        except ValidationError as error:
+            return Response({'error': error.messages}, status=status.HTTP_400_BAD_REQUEST)
 
-        order.status = status_data
-        order.save()
-        return Response({'message': 'Order status updated successfully'}, status=status.HTTP_200_OK)
+        with transaction.atomic():
+            order = Order.objects.select_for_update().filter(id=order_id).first()
+            if not order:
+                return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    if request.method in ['PUT', 'PATCH', 'DELETE'] and request.user.groups.filter(name='manager').exists():
-        order = Order.objects.filter(id=order_id).first()
-        if not order:
-            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        if request.method in ['PUT', 'PATCH']:
-            # Assign delivery Crew
-            delivery_crew = request.data.get('delivery_crew')
-            if not delivery_crew:
-                return Response({'error': 'Delivery crew is required'}, status=status.HTTP_400_BAD_REQUEST)
-            crew_member = User.objects.filter(id=delivery_crew).first()
-            if not crew_member or not crew_member.groups.filter(name='delivery-crew').exists():
-                return Response({'error': 'Invalid delivery crew'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            order.delivery_crew = crew_member
+            old_status = order.status
+            order.status = status_data
+            refresh_snapshot(order)
             order.save()
-            return Response({'message': 'Delivery crew assigned successfully'}, status=status.HTTP_200_OK)
-        
-        if request.method == 'DELETE':
-            order.delete()
-            return Response({'message': 'Order deleted successfully'}, status=status.HTTP_200_OK)
-        
+            record_order_update(order, order.delivery_crew_id, old_status)
+            publish(order_event(OrderEvent.STATUS, order))
+        return Response({'message': 'Order status updated successfully'}, status=status.HTTP_200_OK)
+
+    if request.method in ['PUT', 'PATCH', 'DELETE'] and 'manager' in request.roles:
+        with transaction.atomic():
+            order = Order.objects.select_for_update().filter(id=order_id).first()
+            if not order:
+                return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if request.method in ['PUT', 'PATCH']:
+                # Assign delivery Crew
+                delivery_crew = request.data.get('delivery_crew')
+                if not delivery_crew:
+                    return Response({'error': 'Delivery crew is required'}, status=status.HTTP_400_BAD_REQUEST)
+                crew_member = User.objects.filter(id=delivery_crew).first()
+                if not crew_member or 'delivery-crew' not in get_roles(crew_member):
+                    return Response({'error': 'Invalid delivery crew'}, status=status.HTTP_400_BAD_REQUEST)
+
+                old_crew_id = order.delivery_crew_id
+                order.delivery_crew = crew_member
+                refresh_snapshot(order)
+                order.save()
+                record_order_update(order, old_crew_id, order.status)
+                publish(order_event(OrderEvent.ASSIGNED, order, previous_crew_id=old_crew_id))
+                return Response({'message': 'Delivery crew assigned successfully'}, status=status.HTTP_200_OK)
+
+            if request.method == 'DELETE':
+                items = list(order.orderitem_set.values('menuitem_id', 'quantity', 'price'))
+                event = order_event(OrderEvent.DELETED, order)  # before delete() clears order.id
+                order.delete()
+                record_order_deleted(order, items)
+                publish(event)
+                return Response({'message': 'Order deleted successfully'}, status=status.HTTP_200_OK)
+
+
+    return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+
+@api_view(['PATCH'])
+@permission_classes([IsAuthenticatedWithRoles])
+def manage_orders_bulk(request):
+    serializer = OrderBulkUpdateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+
+    if 'manager' in request.roles and data['auto']:
+        # Spread unassigned orders across the crew, least loaded first
+        assignments = auto_dispatch(data.get('orders'))
+        return Response({
+            'message': 'Orders dispatched successfully',
+            'updated': sum(len(ids) for ids in assignments.values()),
+            'assignments': [{'delivery_crew': crew_id, 'orders': ids} for crew_id, ids in assignments.items()],
+        }, status=status.HTTP_200_OK)
+
+    if 'manager' in request.roles and 'delivery_crew' in data:
+        # The crew member is checked once for the whole batch
+        crew_member = User.objects.filter(id=data['delivery_crew']).first()
+        if not crew_member or 'delivery-crew' not in get_roles(crew_member):
+            return Response({'error': 'Invalid delivery crew'}, status=status.HTTP_400_BAD_REQUEST)
+        missing = assign_orders(data['orders'], crew_member.id)
+        if missing:
+            return Response({'error': 'Orders not found', 'orders': missing}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'Delivery crew assigned successfully', 'updated': len(set(data['orders']))}, status=status.HTTP_200_OK)
+
+    if 'delivery-crew' in request.roles and 'status' in data:
+        # Crew can only update the orders assigned to them
+        missing = set_orders_status(data['orders'], data['status'], delivery_crew=request.user)
+        if missing:
+            return Response({'error': 'Orders not found', 'orders': missing}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'Order status updated successfully', 'updated': len(set(data['orders']))}, status=status.HTTP_200_OK)
+
+    return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithRoles])
+@throttle_classes([SharedEndpointRateThrottle])  # clients call this in a loop, so it has its own rate
+def order_events(request):
+    if not request.roles & {'customer', 'manager', 'delivery-crew'}:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+    # Long-poll: waits up to `timeout` seconds for changes to the user's orders
+    # after the `since` cursor. Without a cursor it waits for the next change.
+    try:
+        since = parse_cursor(request.query_params.get('since'))
+        timeout = wait_timeout(request.query_params.get('timeout'))
+    except ValueError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    if since is None:
+        since = latest_event_id()
+
+    events = wait_for_events(request.user, request.roles, since, timeout)
+    return Response({'events': events, 'cursor': events[-1]['id'] if events else since}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithRoles])
+def export_orders(request):
+    # Streams the full order history (manager only) as NDJSON or CSV,
+    # accepting the same filters as the manager order listing
+    if 'manager' not in request.roles:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+    output = request.query_params.get('output', 'ndjson')
+    if output not in EXPORT_FORMATS:
+        return Response({'error': f'output must be one of: {", ".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type, rows = EXPORT_FORMATS[output]
+    orders = filter_orders(order_model(request.query_params).objects.order_by('id'), request.query_params)
+    response = StreamingHttpResponse(rows(orders), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+    return response
+
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithRoles])
+def sales_reports(request):
+    # Revenue per menu item and category, and orders per delivery crew,
+    # read from the rollup tables. Optional start / end dates (YYYY-MM-DD)
+    if 'manager' not in request.roles:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+
+    dates = {}
+    for param in ('start', 'end'):
+        value = request.query_params.get(param)
+        if value:
+            try:
+                dates[param] = parse_date(value)
+            except ValueError:  # well formed but not a real date, like 2025-02-30
+                dates[param] = None
+            if not dates[param]:
+                return Response({'error': f'{param} must be a date (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({**dates, **sales_report(**dates)}, status=status.HTTP_200_OK)
+
+
+
+class ObtainCachedAuthToken(ObtainAuthToken):
+    # Same as DRF's obtain_auth_token, but puts the token straight into the
+    # auth cache so the client's first API call doesn't have to look it up
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token, created = Token.objects.get_or_create(user=serializer.validated_data['user'])
+        cache_token(token)
+        return Response({'token': token.key})
+
 
-    return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+obtain_auth_token = ObtainCachedAuthToken.as_view()